@@ -1,19 +1,42 @@
 """
 Gerador de Thumb — entrypoint Vercel serverless (api/index.py)
 FastAPI: análise de referência → geração Gemini → extração de elementos editáveis.
-Imagens retornadas como base64 data URLs (sem escrita em disco).
+Imagens retornadas como base64 data URLs por padrão (IMAGE_STORAGE=local grava em disco).
 """
 
-import base64
-import json
+import asyncio
 import os
-import re
+import sys
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
 from pathlib import Path
 
-import httpx
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import Body, Depends, FastAPI, File, Form, Header, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+# Módulos compartilhados vivem em backend/ — acessível pelo sistema de arquivos Vercel
+_BACKEND_DIR = Path(__file__).parent.parent / "backend"
+sys.path.insert(0, str(_BACKEND_DIR))
+
+import cache  # noqa: E402
+import catalog  # noqa: E402
+import engines  # noqa: E402
+import fonts  # noqa: E402
+import gemini  # noqa: E402
+import headlines  # noqa: E402
+import idempotency  # noqa: E402
+import imaging  # noqa: E402
+import jobs  # noqa: E402
+import metrics  # noqa: E402
+import phash  # noqa: E402
+from pipeline import Pipeline  # noqa: E402
+import refdesign  # noqa: E402
+import schemas  # noqa: E402
+import sse  # noqa: E402
+import storage  # noqa: E402
+import uploads  # noqa: E402
 
 load_dotenv()
 
@@ -21,8 +44,22 @@ load_dotenv()
 # App
 # ---------------------------------------------------------------------------
 
-app = FastAPI(title="Gerador de Thumb API", version="0.4.0")
+@asynccontextmanager
+async def _lifespan(app):
+    """Pool HTTP do Gemini, scan das fontes e pré-aquecimento das headlines (HEADLINES_PREWARM)."""
+    async with gemini.lifespan(app):
+        await imaging.run(fonts.registry().scan)
+        warm = asyncio.create_task(_prewarm_headlines())
+        try:
+            yield
+        finally:
+            warm.cancel()
+
 
+app = FastAPI(title="Gerador de Thumb API", version="0.4.0", lifespan=_lifespan)
+
+# Antes do CORS: o último adicionado fica por fora, e o 413 precisa dos headers CORS
+app.add_middleware(uploads.BodyLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -30,12 +67,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.ServerTimingMiddleware)
 
-# templates.json fica em backend/data/ — acessível pelo sistema de arquivos Vercel
-_DATA_DIR = Path(__file__).parent.parent / "backend" / "data"
+# templates.json fica em backend/data/
+_DATA_DIR = _BACKEND_DIR / "data"
 
-with open(_DATA_DIR / "templates.json", "r", encoding="utf-8") as _f:
-    CATEGORIES = json.load(_f)["categories"]
+CATALOG = catalog.TemplateCatalog.load(_DATA_DIR / "templates.json")
 
 # ---------------------------------------------------------------------------
 # Dados
@@ -53,7 +90,7 @@ OBJECTIVE_CONTEXT: dict[str, str] = {
 }
 
 # ---------------------------------------------------------------------------
-# Gemini helpers
+# Motores (Gemini ou stub local)
 # ---------------------------------------------------------------------------
 
 def _api_key() -> str:
@@ -68,68 +105,93 @@ def _gen_model() -> str:
 VISION_MODEL = "gemini-2.5-flash"
 
 
-async def _vision_call(api_key: str, prompt: str, image_bytes: bytes, mime: str) -> str:
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{VISION_MODEL}:generateContent?key={api_key}"
-    payload = {
-        "contents": [{"parts": [
-            {"text": prompt},
-            {"inline_data": {"mime_type": mime, "data": base64.b64encode(image_bytes).decode()}},
-        ]}],
-        "generationConfig": {"temperature": 0.1},
-    }
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(url, json=payload)
-        resp.raise_for_status()
-        data = resp.json()
-
-    for candidate in data.get("candidates", []):
-        for part in candidate.get("content", {}).get("parts", []):
-            if "text" in part:
-                return part["text"]
-    return ""
-
-
-async def _analyze_reference(api_key: str, ref_bytes: bytes, ref_mime: str) -> dict:
-    prompt = """Você é um especialista em design de thumbnails virais para YouTube.
-
-Analise esta thumbnail de referência e extraia o sistema visual completo.
-Retorne APENAS JSON válido, sem markdown, sem explicações adicionais.
-
-{
-  "typography": {
-    "headline_font": "família da fonte principal (ex: Impact, Arial Black, Bebas Neue)",
-    "headline_weight": "bold ou normal",
-    "text_case": "UPPERCASE ou Mixed Case",
-    "has_stroke": true ou false,
-    "stroke_thickness": "thin/medium/thick",
-    "text_colors": ["#hex1", "#hex2"],
-    "stroke_colors": ["#hex"],
-    "line_count": número de linhas de texto visíveis,
-    "text_shadow": true ou false
-  },
-  "layout": {
-    "person_position": "left/right/center/fullwidth",
-    "person_crop": "full-body/torso-up/face-close",
-    "person_size": "small/medium/large/dominant",
-    "text_zone": "left/right/top/bottom/center-overlay",
-    "composition_type": "person-left-text-right/person-right-text-left/person-center-text-overlay/split"
-  },
-  "colors": {
-    "background_main": "#hex ou descrição",
-    "background_type": "solid/gradient/scene",
-    "accent_1": "#hex",
-    "accent_2": "#hex"
-  },
-  "atmosphere": "Descreva em 2-3 frases o clima visual."
-}"""
-    text = await _vision_call(api_key, prompt, ref_bytes, ref_mime)
-    match = re.search(r'\{[\s\S]*\}', text)
-    if match:
+def _engine(name: str | None = None) -> engines.Engine:
+    """Motor da requisição (campo `engine`) ou de GENERATION_ENGINE."""
+    if engines.engine_name(name) == "stub":
+        return engines.stub_engine()
+    return engines.gemini_engine(_api_key(), VISION_MODEL, _gen_model())
+
+
+_REF_PROMPT = """Você é um especialista em design de thumbnails virais para YouTube.
+Extraia o sistema visual desta thumbnail de referência: tipografia, layout, cores e atmosfera."""
+
+# Versão do prompt entra na chave do cache: editar o prompt invalida as análises antigas
+_REF_PROMPT_VERSION = cache.digest(_REF_PROMPT)[:12]
+
+REF_CACHE = cache.TieredCache.from_env("REF_CACHE", table="ref_analysis")
+
+# pHash da referência → chave de uma análise já feita para uma imagem equivalente
+REF_INDEX = phash.PerceptualIndex.from_env("REF_CACHE", table="ref_phash")
+
+# Serverless: data URLs por padrão (sem disco compartilhado); IMAGE_STORAGE=local habilita /api/images
+IMAGES = storage.ImageStorage.from_env(default_mode="dataurl")
+
+# Fila do modo assíncrono (/api/jobs); exige processo persistente, não serverless
+JOBS = jobs.JobQueue.from_env(IMAGES)
+
+# Respostas de /api/generate por Idempotency-Key
+IDEMPOTENCY = idempotency.IdempotencyStore.from_env(IMAGES)
+
+# Lotes de headlines por (tema, categoria) normalizados
+HEADLINES = headlines.HeadlineService(
+    cache.TieredCache.from_env("HEADLINES_CACHE", table="headlines", max_entries=1024, ttl=7 * 86400),
+    OBJECTIVE_CONTEXT,
+)
+
+
+async def _vision_as(engine: engines.Engine, model: type[schemas.LenientModel], prompt: str,
+                     image_bytes: bytes, mime: str) -> dict:
+    """Gemini Vision com resposta estruturada no schema de `model` ({} se não validar)."""
+    text = await engine.vision.describe(prompt, image_bytes, mime, schemas.response_schema(model))
+    parsed = schemas.parse(model, text)
+    return parsed.model_dump() if parsed is not None else {}
+
+
+async def _analyze_reference(engine: engines.Engine, ref_bytes: bytes, ref_mime: str) -> dict:
+    """Cores, texto e layout medidos localmente (refdesign); o Gemini Vision só
+    completa fonte, corte da pessoa e atmosfera. REF_ANALYSIS_MODE=remote volta
+    ao prompt completo."""
+    mode = refdesign.mode()
+    key = cache.digest(ref_bytes, engine.vision.name, _REF_PROMPT_VERSION, mode, refdesign.VERSION)
+    cached = REF_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    # Mesma thumbnail recomprimida/redimensionada/screenshot: reaproveita a análise
+    namespace = cache.digest(engine.vision.name, _REF_PROMPT_VERSION, mode, refdesign.VERSION)
+    with metrics.stage("ref_phash"):
+        fingerprint = await imaging.run(phash.phash, ref_bytes)
+        similar = REF_INDEX.lookup(fingerprint, namespace)
+    if similar is not None:
+        cached = REF_CACHE.get(similar)
+        if cached is not None:
+            REF_CACHE.set(key, cached)
+            return cached
+        REF_INDEX.discard(namespace, similar)
+
+    measured = None
+    if mode != "remote":
         try:
-            return json.loads(match.group())
+            with metrics.stage("ref_local"):
+                measured = await imaging.run(refdesign.measure, ref_bytes)
         except Exception:
-            pass
-    return {}
+            pass  # imagem ilegível para o Pillow — o Gemini decide
+
+    if measured is None:
+        analysis = await _vision_as(engine, schemas.RefAnalysis, _REF_PROMPT, ref_bytes, ref_mime)
+        complete = bool(analysis)
+    elif mode == "local":
+        analysis, complete = measured, True
+    else:
+        preview, preview_mime = await imaging.run(refdesign.preview, ref_bytes, ref_mime)
+        style = await _vision_as(engine, schemas.RefStyle, refdesign.STYLE_PROMPT, preview, preview_mime)
+        analysis, complete = refdesign.merge(measured, style), bool(style)
+
+    # Só cacheia análises completas — falhas voltam a consultar o Gemini
+    if complete:
+        REF_CACHE.set(key, analysis)
+        REF_INDEX.add(fingerprint, namespace, key)
+    return analysis
 
 
 def _build_prompt(objective: str, user_prompt: str, ref_analysis: dict,
@@ -150,23 +212,21 @@ def _build_prompt(objective: str, user_prompt: str, ref_analysis: dict,
 
     ref_section = ""
     if ref_analysis:
-        t   = ref_analysis.get("typography", {})
-        l   = ref_analysis.get("layout", {})
-        c   = ref_analysis.get("colors", {})
-        atm = ref_analysis.get("atmosphere", "")
+        a = schemas.RefAnalysis.coerce(ref_analysis)
+        t, l, c = a.typography, a.layout, a.colors
         ref_section = f"""
 ═══════════════════════════════════════════
 {fidelity_header}
 {fidelity_rule}
 ═══════════════════════════════════════════
 TIPOGRAFIA:
-- Fonte: {t.get('headline_font','Impact')} | Peso: {t.get('headline_weight','bold')} | Caixa: {t.get('text_case','UPPERCASE')}
-- Contorno: {"SIM" if t.get('has_stroke') else "NÃO"} ({t.get('stroke_thickness','medium')})
-- Cores texto: {', '.join(t.get('text_colors',['#FFFFFF']))} | Contorno: {', '.join(t.get('stroke_colors',['#000000']))}
-- Linhas: {t.get('line_count',2)} | Sombra: {"SIM" if t.get('text_shadow') else "NÃO"}
-LAYOUT: {l.get('composition_type','person-right-text-left')} | Pessoa: {l.get('person_position','right')} {l.get('person_crop','torso-up')} {l.get('person_size','large')} | Texto: {l.get('text_zone','left')}
-CORES: Fundo {c.get('background_main','#0D0D1A')} ({c.get('background_type','solid')}) | Destaque {c.get('accent_1','#FFD700')} / {c.get('accent_2','#FFFFFF')}
-ATMOSFERA: {atm}
+- Fonte: {t.headline_font} | Peso: {t.headline_weight} | Caixa: {t.text_case}
+- Contorno: {"SIM" if t.has_stroke else "NÃO"} ({t.stroke_thickness})
+- Cores texto: {', '.join(t.text_colors)} | Contorno: {', '.join(t.stroke_colors)}
+- Linhas: {t.line_count} | Sombra: {"SIM" if t.text_shadow else "NÃO"}
+LAYOUT: {l.composition_type} | Pessoa: {l.person_position} {l.person_crop} {l.person_size} | Texto: {l.text_zone}
+CORES: Fundo {c.background_main} ({c.background_type}) | Destaque {c.accent_1} / {c.accent_2}
+ATMOSFERA: {a.atmosphere}
 ═══════════════════════════════════════════
 """
 
@@ -196,56 +256,20 @@ REGRAS ABSOLUTAS:
 Gere apenas a imagem de fundo sem texto. Nenhum texto explicativo."""
 
 
-async def _generate_image(api_key: str, prompt: str,
-                           person_bytes: bytes, person_mime: str,
-                           ref_bytes: bytes | None, ref_mime: str | None,
-                           extra_bytes: bytes | None = None, extra_mime: str | None = None) -> bytes:
-    model = _gen_model()
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
-    parts: list[dict] = [{"text": prompt}]
-    if person_bytes and person_mime:
-        parts.append({"inline_data": {"mime_type": person_mime, "data": base64.b64encode(person_bytes).decode()}})
-    if ref_bytes and ref_mime:
-        parts.append({"inline_data": {"mime_type": ref_mime, "data": base64.b64encode(ref_bytes).decode()}})
-    if extra_bytes and extra_mime:
-        parts.append({"inline_data": {"mime_type": extra_mime, "data": base64.b64encode(extra_bytes).decode()}})
-
-    payload = {
-        "contents": [{"parts": parts}],
-        "generationConfig": {"responseModalities": ["IMAGE", "TEXT"]},
-    }
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        resp = await client.post(url, json=payload)
-        if resp.status_code != 200:
-            raise HTTPException(502, f"Gemini erro: {resp.text[:400]}")
-        data = resp.json()
-
-    for candidate in data.get("candidates", []):
-        for part in candidate.get("content", {}).get("parts", []):
-            img_data = part.get("inlineData") or part.get("inline_data")
-            if img_data:
-                return base64.b64decode(img_data["data"])
-
-    finish = data.get("candidates", [{}])[0].get("finishReason", "N/A")
-    raise HTTPException(502, f"Gemini não retornou imagem. finishReason={finish}")
+async def _generate_image(engine: engines.Engine, prompt: str, n: "GenerateInputs") -> bytes:
+    def blob(data: bytes | None, mime: str | None) -> engines.Blob | None:
+        return (data, mime) if data and mime else None
 
+    return await engine.image.generate(
+        prompt, blob(n.person_bytes, n.person_mime), blob(n.ref_bytes, n.ref_mime),
+        blob(n.extra_bytes, n.extra_mime),
+    )
 
-async def _generate_text_elements(
-    api_key: str, objective: str, user_prompt: str, ref_analysis: dict
-) -> list[dict]:
-    """Gera elementos de texto editáveis a partir do objetivo + prompt + referência.
-    Não depende da imagem gerada — evita duplicação de texto no canvas.
-    """
-    t = ref_analysis.get("typography", {})
-    l = ref_analysis.get("layout", {})
 
-    font        = t.get("headline_font", "Anton")
-    text_colors = t.get("text_colors", ["#FFFFFF"])
-    stroke_cols = t.get("stroke_colors", ["#000000"])
-    has_stroke  = t.get("has_stroke", True)
-    line_count  = max(1, min(3, int(t.get("line_count", 2))))
-    text_case   = t.get("text_case", "UPPERCASE")
-    text_zone   = l.get("text_zone", "left")
+def _text_style(ref_analysis: dict) -> dict:
+    """Estilo tipográfico das camadas de texto derivado da referência (ou padrões)."""
+    a = schemas.RefAnalysis.coerce(ref_analysis)
+    t, text_zone = a.typography, a.layout.text_zone
 
     # Posição horizontal baseada na zona de texto da referência
     if "right" in text_zone:
@@ -255,72 +279,295 @@ async def _generate_text_elements(
     else:
         base_x = 60
 
-    fill_color   = text_colors[0] if text_colors else "#FFFFFF"
-    stroke_color = stroke_cols[0] if stroke_cols else "#000000"
-    stroke_w     = 4 if has_stroke else 0
+    return {
+        # Sem referência, Anton; com referência, a fonte dela (Impact se não informada)
+        "font":       t.headline_font if ref_analysis else "Anton",
+        "fill":       t.text_colors[0] if t.text_colors else "#FFFFFF",
+        "stroke":     t.stroke_colors[0] if t.stroke_colors else "#000000",
+        "stroke_w":   4 if t.has_stroke else 0,
+        "line_count": max(1, min(3, t.line_count)),
+        "upper":      t.text_case == "UPPERCASE",
+        "text_zone":  text_zone,
+        "base_x":     base_x,
+    }
+
 
+def _provisional_style() -> dict:
+    """Estilo para escrever o copy antes da análise da referência terminar.
+
+    Pede o máximo de linhas (3) em capitalização mista, escritas em camadas: a
+    linha 1 sozinha já é a headline completa e cada linha seguinte só complementa.
+    Assim _style_text_elements pode ficar só com as primeiras `line_count` linhas
+    da referência sem cortar a frase no meio, e aplica a caixa dela depois — caixa
+    alta é recuperável a partir de texto misto, o contrário não.
+    """
+    return {**_text_style({}), "line_count": 3, "upper": False, "layered": True}
+
+
+async def _generate_copy(
+    engine: engines.Engine, objective: str, user_prompt: str, style: dict
+) -> list[schemas.CopyLine]:
+    """Copywriting das linhas de texto. Depende só do objetivo, do prompt e do estilo
+    (que pode ser provisório — ver _style_text_elements)."""
     ctx = OBJECTIVE_CONTEXT.get(objective, "")
-    case_hint = "EM CAIXA ALTA (UPPERCASE)" if "UPPER" in text_case else "em capitalização mista"
+    case_hint = "EM CAIXA ALTA" if style["upper"] else "em capitalização mista"
+    line_count = style["line_count"]
+    layered = (
+        "\nA linha 1 precisa funcionar SOZINHA como headline completa; cada linha seguinte é um "
+        "complemento opcional (a thumbnail pode usar só as primeiras). Nunca quebre uma frase entre linhas."
+        if style.get("layered") else ""
+    )
 
     prompt = f"""Você é especialista em copywriting viral para thumbnails de YouTube.
 
 Objetivo da thumbnail: {ctx}
 Instrução do criador: {user_prompt if user_prompt.strip() else "(sem instrução adicional)"}
-Número de linhas de texto: {line_count}
-Estilo: textos {case_hint}, curtos, chocantes, que geram clique
 
-Crie exatamente {line_count} texto(s) impactante(s) para esta thumbnail.
-Canvas: 1280x720 pixels. Zona de texto: {text_zone} (x base: {base_x}px).
+Crie exatamente {line_count} linha(s) de texto {case_hint}: curtas (máximo 4 palavras), chocantes, que geram clique.
+Canvas 1280x720, zona de texto: {style["text_zone"]}. Linha 1 é o título (~130px, y~80);
+as seguintes são menores (~85px em y~260, ~60px em y~380).{layered}"""
 
-LINHA 1 (título principal): maior, fonte ~120-140px, y~80
-LINHA 2 (subtítulo, se houver): menor, fonte ~75-90px, y~260
-LINHA 3 (complemento, se houver): menor ainda, fonte ~60px, y~380
+    try:
+        raw = await engine.vision.complete(prompt, temperature=0.8,
+                                           schema=schemas.response_schema(list[schemas.CopyLine]))
+    except HTTPException:  # upstream fora do ar ou resposta não-200: segue sem copy
+        return []
+    return (schemas.parse(list[schemas.CopyLine], raw) or [])[:3]
 
-Retorne APENAS JSON válido, sem markdown:
-[{{"id":"t0","text":"TEXTO","x":{base_x},"y":80,"fontSize":130,"fontFamily":"{font}","fill":"{fill_color}","stroke":"{stroke_color}","strokeWidth":{stroke_w},"fontWeight":"bold"}}]
 
-Máximo 4 palavras por linha. Sem pontuação desnecessária."""
+CANVAS_W, CANVAS_H = 1280, 720
+TEXT_MARGIN = 40
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{VISION_MODEL}:generateContent?key={api_key}"
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "generationConfig": {"temperature": 0.8},
-    }
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.post(url, json=payload)
-        if resp.status_code != 200:
-            return []
-        data = resp.json()
 
-    raw = ""
-    for candidate in data.get("candidates", []):
-        for part in candidate.get("content", {}).get("parts", []):
-            if "text" in part:
-                raw = part["text"]
-                break
+def _style_text_elements(copy: list[schemas.CopyLine], style: dict) -> list[dict]:
+    """Aplica o estilo final às linhas geradas.
+
+    O copy pode ter sido escrito com um estilo provisório (antes da análise da
+    referência terminar): fonte, cores, contorno e x vêm sempre do estilo final;
+    y/fontSize/peso vêm do copy. Linhas além do line_count final são descartadas —
+    o copy provisório é escrito em camadas para isso (ver _provisional_style).
+
+    O fontSize sugerido é um teto: o solver de fonts.py reduz o tamanho (e quebra
+    em até 2 linhas) até o texto caber entre x e a margem direita, e as linhas
+    seguintes descem se a anterior cresceu.
+    """
+    box_width = CANVAS_W - style["base_x"] - TEXT_MARGIN
+    elements: list[dict] = []
+    next_y = 0.0
+    for i, el in enumerate(copy[:style["line_count"]]):
+        text = el.text.upper() if style["upper"] else el.text
+        weight = el.fontWeight
+        size = int(el.fontSize if el.fontSize is not None else 130 - i * 40)
+        y = max(el.y if el.y is not None else 80.0 + i * 180, next_y)
+        fit = fonts.fit_text(
+            text, box_width, CANVAS_H - TEXT_MARGIN - y,
+            family=style["font"], weight=weight, max_lines=2,
+            min_size=min(size, 32), max_size=size, stroke_width=style["stroke_w"],
+        )
+        elements.append({
+            "id": f"t{i}",
+            "text": fit.text,
+            "x": float(style["base_x"]),
+            "y": y,
+            "fontSize": float(fit.font_size),
+            "fontFamily": style["font"],
+            "fill": style["fill"],
+            "stroke": style["stroke"],
+            "strokeWidth": float(style["stroke_w"]),
+            "fontWeight": weight,
+        })
+        next_y = y + fit.height + fit.font_size * 0.15
+    return elements
+
+
+async def _generate_text_elements(
+    engine: engines.Engine, objective: str, user_prompt: str, ref_analysis: dict
+) -> list[dict]:
+    """Gera elementos de texto editáveis a partir do objetivo + prompt + referência.
+    Não depende da imagem gerada — evita duplicação de texto no canvas.
+    """
+    style = _text_style(ref_analysis)
+    copy = await _generate_copy(engine, objective, user_prompt, style)
+    return await imaging.run(_style_text_elements, copy, style)
+
+
+# ---------------------------------------------------------------------------
+# Pipeline de geração (grafo de dependências)
+# ---------------------------------------------------------------------------
+#
+#   normalized ──► ref_analysis ──► prompt_built ──► image
+#       │               │                              ▲
+#       └───────────────┼──────────────────────────────┘
+#                       └──────────────┐
+#   copy ──────────────────────────────┴──► text_elements
+#
+# O copy começa com o estilo provisório (_provisional_style: 3 linhas, caixa mista)
+# em paralelo à análise da referência; text_elements corta as linhas e aplica a
+# caixa do estilo final.
+
+@dataclass
+class GenerateInputs:
+    """Entradas resolvidas de uma geração (uploads já lidos ou recuperados por id)."""
+    objective: str
+    prompt: str = ""
+    similarity: int = 60
+    person_bytes: bytes | None = None
+    person_mime: str | None = None
+    ref_bytes: bytes | None = None
+    ref_mime: str | None = None
+    extra_bytes: bytes | None = None
+    extra_mime: str | None = None
+    engine: str | None = None          # gemini · stub (padrão: GENERATION_ENGINE)
+
+
+async def _normalize_inputs(inp: GenerateInputs) -> GenerateInputs:
+    """Normaliza (EXIF, tamanho, metadados, recodificação) as três imagens em paralelo."""
+    (person_bytes, person_mime), (ref_bytes, ref_mime), (extra_bytes, extra_mime) = await asyncio.gather(
+        imaging.normalize(inp.person_bytes, inp.person_mime),
+        imaging.normalize(inp.ref_bytes, inp.ref_mime),
+        imaging.normalize(inp.extra_bytes, inp.extra_mime),
+    )
+    return replace(
+        inp,
+        person_bytes=person_bytes, person_mime=person_mime,
+        ref_bytes=ref_bytes, ref_mime=ref_mime,
+        extra_bytes=extra_bytes, extra_mime=extra_mime,
+    )
+
+
+def _build_pipeline(engine: engines.Engine, inp: GenerateInputs) -> Pipeline:
+    async def normalized() -> GenerateInputs:
+        return await _normalize_inputs(inp)
+
+    async def ref_analysis(normalized: GenerateInputs) -> dict:
+        if normalized.ref_bytes and normalized.ref_mime:
+            return await _analyze_reference(engine, normalized.ref_bytes, normalized.ref_mime)
+        return {}
+
+    async def prompt_built(ref_analysis: dict) -> str:
+        return _build_prompt(
+            inp.objective, inp.prompt, ref_analysis,
+            similarity=max(0, min(100, inp.similarity)),
+            has_extra=bool(inp.extra_bytes),
+            has_person=bool(inp.person_bytes),
+        )
+
+    async def image(prompt_built: str, normalized: GenerateInputs) -> bytes:
+        n = normalized
+        return await _generate_image(engine, prompt_built, n)
+
+    async def copy() -> list[schemas.CopyLine]:
+        return await _generate_copy(engine, inp.objective, inp.prompt, _provisional_style())
+
+    async def text_elements(copy: list[schemas.CopyLine], ref_analysis: dict) -> list[dict]:
+        # Gera textos a partir do prompt/objetivo — não da imagem — evitando duplicação
+        # Medição de fontes (e o scan do registro, se ainda frio) fora do event loop
+        return await imaging.run(_style_text_elements, copy, _text_style(ref_analysis))
+
+    return (
+        Pipeline()
+        .stage("normalized", normalized)
+        .stage("ref_analysis", ref_analysis, "normalized")
+        .stage("copy", copy)
+        .stage("prompt_built", prompt_built, "ref_analysis")
+        .stage("image", image, "prompt_built", "normalized")
+        .stage("text_elements", text_elements, "copy", "ref_analysis")
+    )
+
+
+async def _publish(image_bytes: bytes) -> str:
+    with metrics.stage("publish"):
+        return await IMAGES.publish(image_bytes)
+
+
+async def _image_event(image_bytes: bytes) -> dict:
+    return {"url": await _publish(image_bytes)}
+
 
-    match = re.search(r'\[[\s\S]*\]', raw)
-    if match:
+# ---------------------------------------------------------------------------
+# Lote de variantes (A/B): uma análise, N gerações de imagem em paralelo
+# ---------------------------------------------------------------------------
+
+BATCH_MAX_VARIANTS = 8
+
+
+def _batch_variants(inp: GenerateInputs, n: int, similarities: str, objectives: str) -> list[dict]:
+    """Expande `n` + listas opcionais (separadas por vírgula) em variantes.
+    As listas são percorridas ciclicamente; o tamanho do lote é max(n, len(listas))."""
+    try:
+        sims = [int(v) for v in similarities.split(",") if v.strip()]
+    except ValueError:
+        raise HTTPException(400, "similarities deve ser uma lista de inteiros separados por vírgula.")
+    objs = [v.strip() for v in objectives.split(",") if v.strip()]
+
+    count = max(n, len(sims), len(objs))
+    if not 1 <= count <= BATCH_MAX_VARIANTS:
+        raise HTTPException(400, f"O lote deve ter entre 1 e {BATCH_MAX_VARIANTS} variantes.")
+    return [
+        {
+            "objective": objs[i % len(objs)] if objs else inp.objective,
+            "similarity": max(0, min(100, sims[i % len(sims)] if sims else inp.similarity)),
+        }
+        for i in range(count)
+    ]
+
+
+async def _run_batch(engine: engines.Engine, inp: GenerateInputs, variants: list[dict], emit: sse.Emit) -> None:
+    """Emite ref_analysis, um `variant` (ou `variant_error`) por imagem na ordem em que
+    terminam e, por fim, `done`. Falhas individuais não derrubam o lote."""
+    provisional = _provisional_style()
+
+    async def safe_copy(objective: str) -> list[schemas.CopyLine]:
         try:
-            elements = json.loads(match.group())
-            return [
-                {
-                    "id": el.get("id", f"t{i}"),
-                    "text": str(el.get("text", "")),
-                    "x": float(el.get("x", base_x)),
-                    "y": float(el.get("y", 80 + i * 180)),
-                    "fontSize": float(el.get("fontSize", 130 - i * 40)),
-                    "fontFamily": str(el.get("fontFamily", font)),
-                    "fill": str(el.get("fill", fill_color)),
-                    "stroke": el.get("stroke") or stroke_color,
-                    "strokeWidth": float(el.get("strokeWidth", stroke_w)),
-                    "fontWeight": str(el.get("fontWeight", "bold")),
-                }
-                for i, el in enumerate(elements[:3])
-            ]
+            return await _generate_copy(engine, objective, inp.prompt, provisional)
         except Exception:
-            pass
-    return []
+            return []
+
+    # Copy por objetivo distinto, em paralelo à análise (estilo provisório, reconciliado depois)
+    copies = {
+        objective: asyncio.create_task(safe_copy(objective))
+        for objective in {v["objective"] for v in variants}
+    }
+    try:
+        n = await _normalize_inputs(inp)
+        ref_analysis: dict = {}
+        if n.ref_bytes and n.ref_mime:
+            with metrics.stage("ref_analysis"):
+                ref_analysis = await _analyze_reference(engine, n.ref_bytes, n.ref_mime)
+        await emit("ref_analysis", ref_analysis)
+        style = _text_style(ref_analysis)
+
+        sem = asyncio.Semaphore(int(os.getenv("BATCH_CONCURRENCY", "4")))
+
+        async def variant(index: int, v: dict) -> bool:
+            try:
+                full_prompt = _build_prompt(
+                    v["objective"], inp.prompt, ref_analysis,
+                    similarity=v["similarity"],
+                    has_extra=bool(n.extra_bytes),
+                    has_person=bool(n.person_bytes),
+                )
+                async with sem:
+                    with metrics.stage("image"):
+                        image_bytes = await _generate_image(engine, full_prompt, n)
+                elements = await imaging.run(_style_text_elements, await copies[v["objective"]], style)
+                await emit("variant", {
+                    "index": index, **v,
+                    "url": await _publish(image_bytes),
+                    "elements": elements,
+                })
+                return True
+            except HTTPException as exc:
+                await emit("variant_error", {"index": index, **v, "status": exc.status_code, "detail": exc.detail})
+            except Exception as exc:
+                await emit("variant_error", {"index": index, **v, "status": 502, "detail": str(exc)})
+            return False
+
+        ok = await asyncio.gather(*(variant(i, v) for i, v in enumerate(variants)))
+        await emit("done", {"succeeded": sum(ok), "failed": len(ok) - sum(ok)})
+    finally:
+        for task in copies.values():
+            task.cancel()
 
 
 # ---------------------------------------------------------------------------
@@ -328,75 +575,234 @@ Máximo 4 palavras por linha. Sem pontuação desnecessária."""
 # ---------------------------------------------------------------------------
 
 @app.get("/api/categories")
-def get_categories():
-    return CATEGORIES
+def get_categories(request: Request):
+    return CATALOG.categories_response(request)
+
+
+@app.get("/api/templates/{category}")
+def get_templates(category: str, request: Request):
+    return CATALOG.templates_response(category, request)
 
 
 @app.post("/api/upload")
 async def upload_image(file: UploadFile = File(...)):
-    content = await file.read()
-    mime = file.content_type or "image/jpeg"
-    b64 = base64.b64encode(content).decode()
-    return {"url": f"data:{mime};base64,{b64}"}
+    """Grava a imagem no storage e retorna sua URL (ou data URL no modo serverless)
+    e um `id` (hash do conteúdo) aceito por /api/generate no lugar do arquivo."""
+    content, mime = await uploads.read(file)
+    image_id = await IMAGES.remember(content, mime)
+    return {"id": image_id, "url": IMAGES.url(image_id, content, mime)}
 
 
-@app.post("/api/generate")
-async def generate_thumbnail(
+@app.get("/api/images/{image_hash}")
+async def get_image(image_hash: str, request: Request):
+    return await IMAGES.response(image_hash, request)
+
+
+async def _read_upload(file: UploadFile | None, image_id: str | None) -> tuple[bytes | None, str | None]:
+    """Arquivo enviado no multipart ou handle (`*_id`) devolvido por /api/upload."""
+    if file and file.filename:
+        return await uploads.read(file)
+    if image_id:
+        blob = await IMAGES.load(image_id)
+        if blob is None:
+            raise HTTPException(404, f"Upload {image_id[:12]}… não encontrado — envie a imagem novamente.")
+        return blob
+    return None, None
+
+
+async def _generate_inputs(
     objective: str = Form(...),
     prompt: str = Form(""),
+    similarity: int = Form(60),
     person_image: UploadFile = File(None),
+    person_image_id: str = Form(None),
     reference_image: UploadFile = File(None),
+    reference_image_id: str = Form(None),
     extra_elements: UploadFile = File(None),
-    similarity: int = Form(60),
-):
-    api_key = _api_key()
-
-    if not prompt.strip() and not (person_image and person_image.filename) and not (reference_image and reference_image.filename):
+    extra_elements_id: str = Form(None),
+    engine: str = Form(None),
+) -> GenerateInputs:
+    """Dependência compartilhada pelas rotas de geração: lê uploads ou resolve ids."""
+    person_bytes, person_mime = await _read_upload(person_image, person_image_id)
+    ref_bytes, ref_mime = await _read_upload(reference_image, reference_image_id)
+    extra_bytes, extra_mime = await _read_upload(extra_elements, extra_elements_id)
+
+    if not prompt.strip() and not person_bytes and not ref_bytes:
         raise HTTPException(400, "Envie pelo menos um prompt ou uma imagem.")
 
-    person_bytes: bytes | None = None
-    person_mime: str | None = None
-    if person_image and person_image.filename:
-        person_bytes = await person_image.read()
-        person_mime = person_image.content_type or "image/jpeg"
-
-    ref_bytes: bytes | None = None
-    ref_mime: str | None = None
-    if reference_image and reference_image.filename:
-        ref_bytes = await reference_image.read()
-        ref_mime = reference_image.content_type or "image/jpeg"
-
-    extra_bytes: bytes | None = None
-    extra_mime: str | None = None
-    if extra_elements and extra_elements.filename:
-        extra_bytes = await extra_elements.read()
-        extra_mime = extra_elements.content_type or "image/png"
-
-    ref_analysis: dict = {}
-    if ref_bytes and ref_mime:
-        ref_analysis = await _analyze_reference(api_key, ref_bytes, ref_mime)
-
-    full_prompt = _build_prompt(
-        objective, prompt, ref_analysis,
-        similarity=max(0, min(100, similarity)),
-        has_extra=bool(extra_bytes),
-        has_person=bool(person_bytes),
+    return GenerateInputs(
+        objective, prompt, similarity,
+        person_bytes, person_mime, ref_bytes, ref_mime, extra_bytes, extra_mime, engine,
     )
 
-    image_bytes = await _generate_image(
-        api_key, full_prompt, person_bytes, person_mime,
-        ref_bytes, ref_mime, extra_bytes, extra_mime,
-    )
 
-    b64 = base64.b64encode(image_bytes).decode()
-    image_url = f"data:image/jpeg;base64,{b64}"
+@app.post("/api/generate")
+async def generate_thumbnail(
+    response: Response,
+    inputs: GenerateInputs = Depends(_generate_inputs),
+    idempotency_key: str | None = Header(None, alias=idempotency.HEADER),
+):
+    """Com Idempotency-Key, reenvios devolvem a resposta guardada (ou aguardam a em andamento)."""
+    async def run() -> dict:
+        results = await _build_pipeline(_engine(inputs.engine), inputs).run()
+        return {
+            "url": await _publish(results["image"]),
+            "elements": results["text_elements"],
+            "ref_analysis": results["ref_analysis"],
+        }
+
+    if idempotency_key is None:
+        return await run()
+    body, replayed = await IDEMPOTENCY.run(idempotency_key, idempotency.fingerprint(inputs), run)
+    if replayed:
+        response.headers[idempotency.REPLAYED_HEADER] = "true"
+    return body
+
+
+@app.post("/api/generate/stream")
+async def generate_thumbnail_stream(inputs: GenerateInputs = Depends(_generate_inputs)):
+    """Mesmo pipeline de /api/generate, emitindo um evento SSE por estágio:
+    ref_analysis → prompt_built / text_elements → image → done (ou error)."""
+    pipeline = _build_pipeline(_engine(inputs.engine), inputs)
+    return sse.sse_response(sse.stream_pipeline(pipeline, {
+        "ref_analysis":  lambda analysis: analysis,
+        "prompt_built":  lambda full_prompt: {"prompt": full_prompt},
+        "text_elements": lambda elements: {"elements": elements},
+        "image":         _image_event,
+    }))
+
+
+@app.post("/api/generate/batch")
+async def generate_batch(
+    inputs: GenerateInputs = Depends(_generate_inputs),
+    n: int = Form(4),
+    similarities: str = Form(""),
+    objectives: str = Form(""),
+):
+    """Gera N variantes de uma ideia para teste A/B, via SSE.
+    `similarities`/`objectives` (ex.: "30,60,90") variam os parâmetros por variante."""
+    variants = _batch_variants(inputs, n, similarities, objectives)
+    engine = _engine(inputs.engine)
+    return sse.sse_response(sse.stream_events(
+        lambda emit: _run_batch(engine, inputs, variants, emit)
+    ))
+
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(
+    inputs: GenerateInputs = Depends(_generate_inputs),
+    webhook_url: str = Form(None),
+):
+    """Modo assíncrono de /api/generate: devolve o id do job na hora.
+    Acompanhe em GET /api/jobs/{id}; com `webhook_url`, o job concluído é enviado por POST."""
+    engine = _engine(inputs.engine)
+
+    async def run(progress: jobs.Progress) -> dict:
+        results = await _build_pipeline(engine, inputs).run(on_done=lambda name, _: progress(name))
+        return {
+            "url": await _publish(results["image"]),
+            "elements": results["text_elements"],
+            "ref_analysis": results["ref_analysis"],
+        }
+
+    job = await JOBS.submit(run, webhook_url)
+    return {**job, "status_url": f"/api/jobs/{job['id']}"}
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job não encontrado.")
+    return job
+
+
+@app.get("/api/jobs")
+def jobs_stats():
+    """Profundidade da fila e workers ocupados."""
+    return JOBS.stats()
+
+
+async def _prewarm_headlines() -> None:
+    topics = headlines.prewarm_topics()
+    if not topics:
+        return
+    try:
+        engine = _engine()
+    except HTTPException:  # sem GOOGLE_API_KEY: nada a aquecer
+        return
+    await HEADLINES.prewarm(engine, topics)
+
+
+@app.post("/api/headlines")
+async def get_headlines(
+    topic: str = Body(...),
+    category: str = Body("dinheiro"),
+    count: int = Body(headlines.DEFAULT_COUNT),
+    engine: str = Body(None),
+):
+    """Lote ranqueado de headlines para {topic, category}; acertos vêm do cache."""
+    items, cached = await HEADLINES.generate(_engine(engine), topic, category, count)
+    return {"headlines": items, "cached": cached}
 
-    # Gera textos a partir do prompt/objetivo — não da imagem — evitando duplicação
-    elements = await _generate_text_elements(api_key, objective, prompt, ref_analysis)
 
-    return {"url": image_url, "elements": elements, "ref_analysis": ref_analysis}
+@app.post("/api/headlines/stream")
+async def stream_headlines(
+    topic: str = Body(...),
+    category: str = Body("dinheiro"),
+    count: int = Body(headlines.DEFAULT_COUNT),
+    engine: str = Body(None),
+):
+    """Versão SSE de /api/headlines: um evento `headline` por linha escrita pelo modelo."""
+    resolved = _engine(engine)
+    return sse.sse_response(sse.stream_events(
+        lambda emit: HEADLINES.stream(resolved, topic, category, count, emit)
+    ))
+
+
+@metrics.collector
+def _cache_metrics() -> list[tuple[str, str, dict[str, str], float]]:
+    samples = []
+    for name, stats in (("ref_analysis", REF_CACHE.stats()), ("headlines", HEADLINES.stats()),
+                        ("idempotency", IDEMPOTENCY.stats())):
+        labels = {"cache": name}
+        samples += [
+            ("thumb_cache_hits_total", "counter", labels, stats["hits"]),
+            ("thumb_cache_disk_hits_total", "counter", labels, stats["disk_hits"]),
+            ("thumb_cache_misses_total", "counter", labels, stats["misses"]),
+            ("thumb_cache_entries", "gauge", labels, stats["entries"]),
+        ]
+    samples.append(("thumb_idempotent_replays_total", "counter", {}, IDEMPOTENCY.replayed))
+    index = REF_INDEX.stats()
+    samples += [
+        ("thumb_ref_phash_hits_total", "counter", {}, index["hits"]),
+        ("thumb_ref_phash_misses_total", "counter", {}, index["misses"]),
+        ("thumb_ref_phash_entries", "gauge", {}, index["entries"]),
+    ]
+    return samples
+
+
+metrics.collector(JOBS.prometheus)
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    """Métricas no formato texto do Prometheus (estágios, upstream, caches)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/api/health")
 def health():
-    return {"status": "ok", "version": "0.4.0", "model": _gen_model()}
+    return {
+        "status": "ok",
+        "version": "0.4.0",
+        "model": _gen_model(),
+        "engine": engines.engine_name(),
+        "ref_cache": REF_CACHE.stats(),
+        "ref_phash": REF_INDEX.stats(),
+        "headlines_cache": HEADLINES.stats(),
+        "gemini": gemini.stats(),
+        "jobs": JOBS.stats(),
+        "idempotency": IDEMPOTENCY.stats(),
+        "fonts": fonts.registry().stats(),
+    }
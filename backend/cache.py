@@ -0,0 +1,220 @@
+"""
+Caches endereçados por conteúdo.
+Tier em memória (LRU + TTL) com tier opcional em sqlite que sobrevive a reinícios.
+Usado para o design system extraído das referências (_analyze_reference).
+Inclui também SingleFlight, que coalesce chamadas idênticas em andamento.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+
+def digest(*parts: bytes | str) -> str:
+    """sha256 de várias partes, com separador para evitar colisões por concatenação."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Tier 1 — memória
+# ---------------------------------------------------------------------------
+
+class LRUCache:
+    """LRU com TTL por entrada. Seguro para uso a partir de threads."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key: str) -> Any | None:
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# ---------------------------------------------------------------------------
+# Tier 2 — sqlite (opcional)
+# ---------------------------------------------------------------------------
+
+class SqliteStore:
+    """Chave → JSON com expiração em tempo de relógio (persistente entre processos)."""
+
+    def __init__(self, path: str | Path, table: str = "cache"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires < time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(f"DELETE FROM {self.table} WHERE expires < ?", (time.time(),))
+            self._conn.commit()
+        return cur.rowcount
+
+
+# ---------------------------------------------------------------------------
+# Cache de dois tiers com contadores
+# ---------------------------------------------------------------------------
+
+class TieredCache:
+    """Memória na frente, sqlite atrás. Hits no disco são promovidos para a memória."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400.0,
+                 db_path: str | Path | None = None, table: str = "cache"):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries, ttl)
+        self.disk = SqliteStore(db_path, table) if db_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any | None:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.hits += 1
+                self.disk_hits += 1
+                self.memory.set(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value, self.ttl)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": len(self.memory),
+            "disk": bool(self.disk),
+        }
+
+    @classmethod
+    def from_env(cls, prefix: str, table: str, max_entries: int = 256,
+                 ttl: float = 86400.0) -> "TieredCache":
+        """Lê {prefix}_MAX_ENTRIES, {prefix}_TTL e {prefix}_DB (caminho sqlite; vazio = só memória)."""
+        return cls(
+            max_entries=int(os.getenv(f"{prefix}_MAX_ENTRIES", max_entries)),
+            ttl=float(os.getenv(f"{prefix}_TTL", ttl)),
+            db_path=os.getenv(f"{prefix}_DB") or None,
+            table=table,
+        )
+
+
+# ---------------------------------------------------------------------------
+# Single-flight — chamadas idênticas simultâneas compartilham um único future
+# ---------------------------------------------------------------------------
+
+class SingleFlight:
+    """Coalesce corrotinas pela chave enquanto estão em andamento.
+
+    O trabalho roda numa task própria: se quem iniciou for cancelado (cliente
+    desconectou), os demais continuam aguardando o mesmo resultado.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Marca a exceção como consumida mesmo se todos os chamadores desistiram
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,135 @@
+"""
+Catálogo de templates (backend/data/templates.json).
+Carregado e validado uma vez; as respostas de /api/categories e
+/api/templates/{category} são serializadas, comprimidas (gzip e, se o pacote
+`brotli` estiver instalado, br) e etiquetadas com ETag forte na carga.
+Requisições condicionais recebem 304 sem tocar no JSON.
+"""
+
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # opcional — sem ele servimos gzip/identity
+    brotli = None
+
+_TEXT_ELEMENT_FIELDS = {
+    "id": str, "text": str, "x": (int, float), "y": (int, float),
+    "fontSize": (int, float), "fontFamily": str, "fill": str,
+}
+
+
+# ---------------------------------------------------------------------------
+# Validação
+# ---------------------------------------------------------------------------
+
+def _validate(data: dict) -> None:
+    """Levanta ValueError com a primeira inconsistência encontrada."""
+    categories = data.get("categories")
+    templates = data.get("templates")
+    if not isinstance(categories, list) or not isinstance(templates, list):
+        raise ValueError("templates.json precisa de listas 'categories' e 'templates'")
+
+    category_ids = set()
+    for cat in categories:
+        if not isinstance(cat.get("id"), str) or not isinstance(cat.get("name"), str):
+            raise ValueError(f"categoria inválida: {cat!r}")
+        if cat["id"] in category_ids:
+            raise ValueError(f"categoria duplicada: {cat['id']}")
+        category_ids.add(cat["id"])
+
+    template_ids = set()
+    for tpl in templates:
+        tid = tpl.get("id")
+        if not isinstance(tid, str):
+            raise ValueError(f"template sem id: {tpl!r:.80}")
+        if tid in template_ids:
+            raise ValueError(f"template duplicado: {tid}")
+        template_ids.add(tid)
+        if tpl.get("category") not in category_ids:
+            raise ValueError(f"template {tid}: categoria desconhecida {tpl.get('category')!r}")
+        for el in tpl.get("textElements", []):
+            for field, kind in _TEXT_ELEMENT_FIELDS.items():
+                if not isinstance(el.get(field), kind):
+                    raise ValueError(f"template {tid}: textElement {el.get('id')!r} com '{field}' inválido")
+            if el.get("stroke") is not None and not isinstance(el["stroke"], str):
+                raise ValueError(f"template {tid}: textElement {el['id']!r} com 'stroke' inválido")
+
+
+# ---------------------------------------------------------------------------
+# Respostas pré-computadas
+# ---------------------------------------------------------------------------
+
+class _Precomputed:
+    """Corpo JSON + variantes comprimidas + ETags (uma por codificação)."""
+
+    def __init__(self, payload) -> None:
+        self.identity = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(self.identity).hexdigest()[:32]
+        self.bodies: dict[str, bytes] = {"identity": self.identity}
+        self.etags: dict[str, str] = {"identity": f'"{digest}"'}
+
+        self.bodies["gzip"] = gzip.compress(self.identity, compresslevel=9, mtime=0)
+        self.etags["gzip"] = f'"{digest}-gz"'
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(self.identity, quality=11)
+            self.etags["br"] = f'"{digest}-br"'
+
+    def negotiate(self, accept_encoding: str) -> str:
+        accepted = {token.split(";")[0].strip().lower() for token in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and encoding in accepted:
+                return encoding
+        return "identity"
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        encoding = self.negotiate(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": self.etags[encoding],
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        # Qualquer ETag nossa serve: o conteúdo é o mesmo em todas as codificações
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or any(tag in if_none_match for tag in self.etags.values()):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.bodies[encoding], media_type="application/json", headers=headers)
+
+
+class TemplateCatalog:
+    def __init__(self, data: dict, cache_control: str = "public, max-age=300"):
+        _validate(data)
+        self.categories: list[dict] = data["categories"]
+        self.templates: list[dict] = data["templates"]
+        self.by_id: dict[str, dict] = {tpl["id"]: tpl for tpl in self.templates}
+        self.by_category: dict[str, list[dict]] = {cat["id"]: [] for cat in self.categories}
+        for tpl in self.templates:
+            self.by_category[tpl["category"]].append(tpl)
+
+        self.cache_control = cache_control
+        self._categories_response = _Precomputed(self.categories)
+        self._category_responses = {
+            cid: _Precomputed(templates) for cid, templates in self.by_category.items()
+        }
+
+    @classmethod
+    def load(cls, path: str | Path) -> "TemplateCatalog":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def categories_response(self, request: Request) -> Response:
+        return self._categories_response.response(request, self.cache_control)
+
+    def templates_response(self, category: str, request: Request) -> Response:
+        pre = self._category_responses.get(category)
+        if pre is None:
+            raise HTTPException(404, f"Categoria '{category}' não encontrada")
+        return pre.response(request, self.cache_control)
@@ -0,0 +1,373 @@
+"""
+Motores de geração: interfaces ImageGenerator / VisionModel e implementações.
+
+- Gemini: as chamadas REST de sempre, via gemini.post (pool, retries, breaker).
+- stub: motor local e determinístico, sem rede nem cota. Compõe a pessoa, a paleta
+  da referência e o texto com Pillow; responde às chamadas de visão/texto com JSON
+  medido localmente (refdesign/textlayout). A latência e a taxa de erros são
+  configuráveis, para medir e dimensionar o pipeline inteiro offline.
+
+O motor vem de GENERATION_ENGINE (gemini por padrão) ou do campo `engine` da
+requisição.
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import re
+from dataclasses import dataclass
+from typing import AsyncIterator, Protocol
+
+import numpy as np
+from fastapi import HTTPException
+from PIL import Image, ImageDraw, ImageOps
+
+import fonts
+import gemini
+import imaging
+import metrics
+import refdesign
+import textlayout
+
+ENGINES = ("gemini", "stub")
+
+Blob = tuple[bytes, str]
+
+
+class VisionModel(Protocol):
+    name: str
+
+    async def describe(self, prompt: str, image_bytes: bytes, mime: str,
+                       schema: dict | None = None) -> str:
+        """Prompt + imagem → resposta textual (JSON no formato `schema`, se houver)."""
+
+    async def complete(self, prompt: str, temperature: float = 0.8,
+                       schema: dict | None = None) -> str:
+        """Prompt só-texto → resposta textual (JSON no formato `schema`, se houver)."""
+
+    def stream(self, prompt: str, temperature: float = 0.8) -> AsyncIterator[str]:
+        """Como complete(), em trechos de texto à medida que o modelo escreve."""
+
+
+class ImageGenerator(Protocol):
+    name: str
+
+    async def generate(self, prompt: str, person: Blob | None = None,
+                       reference: Blob | None = None, extra: Blob | None = None) -> bytes:
+        """Prompt + imagens de entrada → bytes da thumbnail gerada."""
+
+
+@dataclass
+class Engine:
+    name: str
+    vision: VisionModel
+    image: ImageGenerator
+
+
+def engine_name(requested: str | None = None) -> str:
+    """Motor pedido na requisição ou em GENERATION_ENGINE; 400 se desconhecido."""
+    name = (requested or os.getenv("GENERATION_ENGINE", "gemini")).strip().lower()
+    if name not in ENGINES:
+        raise HTTPException(400, f"engine deve ser um de: {', '.join(ENGINES)}.")
+    return name
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+# ---------------------------------------------------------------------------
+
+def _inline(data: bytes, mime: str) -> dict:
+    # Codificado em blocos por gemini.post durante o envio
+    return {"inline_data": {"mime_type": mime, "data": gemini.Base64(data)}}
+
+
+def _config(temperature: float, schema: dict | None) -> dict:
+    """generationConfig; com schema, o Gemini responde só JSON nesse formato."""
+    config: dict = {"temperature": temperature}
+    if schema is not None:
+        config["responseMimeType"] = "application/json"
+        config["responseSchema"] = schema
+    return config
+
+
+def _first_text(data: dict) -> str:
+    for candidate in data.get("candidates", []):
+        for part in candidate.get("content", {}).get("parts", []):
+            if "text" in part:
+                return part["text"]
+    return ""
+
+
+@dataclass
+class GeminiVision:
+    api_key: str
+    name: str
+
+    async def describe(self, prompt: str, image_bytes: bytes, mime: str,
+                       schema: dict | None = None) -> str:
+        payload = {
+            "contents": [{"parts": [{"text": prompt}, _inline(image_bytes, mime)]}],
+            "generationConfig": _config(0.1, schema),
+        }
+        resp = await gemini.post(self.api_key, self.name, payload, gemini.vision_timeout(), coalesce=True)
+        if resp.status_code != 200:
+            raise HTTPException(502, f"Gemini Vision erro: {resp.text[:400]}")
+        return _first_text(resp.json())
+
+    async def complete(self, prompt: str, temperature: float = 0.8,
+                       schema: dict | None = None) -> str:
+        payload = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": _config(temperature, schema),
+        }
+        resp = await gemini.post(self.api_key, self.name, payload, gemini.text_timeout(), coalesce=True)
+        if resp.status_code != 200:
+            raise HTTPException(502, f"Gemini erro: {resp.text[:400]}")
+        return _first_text(resp.json())
+
+    async def stream(self, prompt: str, temperature: float = 0.8) -> AsyncIterator[str]:
+        payload = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": temperature},
+        }
+        async for chunk in gemini.stream(self.api_key, self.name, payload, gemini.text_timeout()):
+            text = _first_text(chunk)
+            if text:
+                yield text
+
+
+@dataclass
+class GeminiImage:
+    api_key: str
+    name: str
+
+    async def generate(self, prompt: str, person: Blob | None = None,
+                       reference: Blob | None = None, extra: Blob | None = None) -> bytes:
+        parts: list[dict] = [{"text": prompt}]
+        for blob in (person, reference, extra):
+            if blob and blob[0] and blob[1]:
+                parts.append(_inline(*blob))
+        payload = {
+            "contents": [{"parts": parts}],
+            "generationConfig": {"responseModalities": ["IMAGE", "TEXT"]},
+        }
+        resp = await gemini.post(self.api_key, self.name, payload, gemini.image_timeout(),
+                                 max_retries=gemini.image_max_retries())
+        if resp.status_code != 200:
+            raise HTTPException(502, f"Gemini erro: {resp.text[:400]}")
+        data = resp.json()
+
+        for candidate in data.get("candidates", []):
+            for part in candidate.get("content", {}).get("parts", []):
+                img_data = part.get("inlineData") or part.get("inline_data")
+                if img_data:
+                    with metrics.stage("b64_decode"):
+                        return base64.b64decode(img_data["data"])
+
+        finish = data.get("candidates", [{}])[0].get("finishReason", "N/A")
+        raise HTTPException(502, f"Gemini não retornou imagem. finishReason={finish}")
+
+
+def gemini_engine(api_key: str, vision_model: str, image_model: str) -> Engine:
+    return Engine("gemini", GeminiVision(api_key, vision_model), GeminiImage(api_key, image_model))
+
+
+# ---------------------------------------------------------------------------
+# Stub local
+# ---------------------------------------------------------------------------
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+class _Faults:
+    """Latência (média ± jitter, em ms) e erros injetados, com semente fixa."""
+
+    def __init__(self, latency_env: str):
+        self.latency = _env_float(latency_env, 0.0) / 1000
+        self.jitter = _env_float("STUB_JITTER_MS", 0.0) / 1000
+        self.error_rate = _env_float("STUB_ERROR_RATE", 0.0)
+        self.status = int(_env_float("STUB_ERROR_STATUS", 502))
+        self.random = random.Random(os.getenv("STUB_SEED", "0"))
+
+    async def __call__(self) -> None:
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise HTTPException(self.status, "Stub: falha injetada (STUB_ERROR_RATE)")
+
+
+def _seed(*parts: bytes | str) -> random.Random:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode() if isinstance(part, str) else part)
+    return random.Random(h.digest())
+
+
+def _headline(prompt: str) -> str:
+    """Até 4 palavras da instrução do criador, ou um título fixo."""
+    # main.py quebra a linha depois do rótulo, api/index.py não; instrução vazia não
+    # pode pular para a linha seguinte do prompt
+    match = re.search(r"INSTRU[ÇC][ÃA]O DO CRIADOR:[^\S\n]*\n?(.*)", prompt)
+    words = re.findall(r"[\wÀ-ú$%]+", match.group(1)) if match else []
+    return " ".join(words[:4]).upper() or "THUMBNAIL"
+
+
+def _open(blob: Blob | None) -> Image.Image | None:
+    if not blob or not blob[0]:
+        return None
+    try:
+        return ImageOps.exif_transpose(Image.open(io.BytesIO(blob[0]))).convert("RGBA")
+    except Exception:
+        return None
+
+
+def compose(prompt: str, person: Blob | None = None, reference: Blob | None = None,
+            extra: Blob | None = None) -> bytes:
+    """Thumbnail 1280x720 determinística: fundo com a paleta da referência, pessoa à
+    direita, elemento extra no canto e título à esquerda (a menos que o prompt peça
+    imagem sem texto)."""
+    w, h = textlayout.CANVAS_W, textlayout.CANVAS_H
+    rng = _seed(prompt, person[0] if person else b"", reference[0] if reference else b"")
+
+    ref = _open(reference)
+    if ref is not None:
+        rgb = np.asarray(ref.convert("RGB").resize((160, 90)), dtype=np.float32)
+        top, _ = refdesign.background(rgb)
+        colors = [c for c, _ in refdesign.palette(rgb, k=4)]
+        bottom = max(colors, key=lambda c: float(np.linalg.norm(c - top)))
+        top, bottom = tuple(int(v) for v in top), tuple(int(v) for v in bottom)
+    else:
+        top = tuple(rng.randrange(0, 80) for _ in range(3))
+        bottom = tuple(rng.randrange(60, 200) for _ in range(3))
+    gradient = Image.linear_gradient("L").resize((w, h))
+    canvas = Image.composite(Image.new("RGB", (w, h), bottom), Image.new("RGB", (w, h), top), gradient)
+
+    subject = _open(person)
+    if subject is not None:
+        subject.thumbnail((w // 2, h))
+        canvas.paste(subject, (w - subject.width - 40, h - subject.height), subject)
+    item = _open(extra)
+    if item is not None:
+        item.thumbnail((w // 5, h // 4))
+        canvas.paste(item, (w // 2 - item.width // 2, 40), item)
+
+    if "SEM TEXTO" not in prompt:
+        draw = ImageDraw.Draw(canvas)
+        fit = fonts.fit_text(_headline(prompt), w // 2 - 60, h - 160, family="Impact",
+                             weight="bold", max_lines=3, min_size=40, max_size=130, stroke_width=8)
+        font = fonts.registry().font(fit.face, fit.font_size)
+        draw.multiline_text((60, 80), fit.text, font=font, fill="#FFD700",
+                            stroke_width=4, stroke_fill="#000000", spacing=fit.font_size // 6)
+
+    out = io.BytesIO()
+    canvas.save(out, format="PNG", optimize=False)
+    return out.getvalue()
+
+
+def _items(schema: dict | None) -> dict | None:
+    """Schema dos itens de uma resposta em lista (ou None se não for lista)."""
+    if schema is None or schema["type"] != "ARRAY":
+        return None
+    return schema["items"]
+
+
+def _count(pattern: str, prompt: str) -> int:
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else 1
+
+
+def _describe(prompt: str, image_bytes: bytes, schema: dict | None) -> str:
+    """Respostas no formato do schema pedido; o prompt só dá a quantidade de itens."""
+    items = _items(schema)
+    if items is not None and items["type"] == "STRING":
+        # list[str]: transcrição das faixas recortadas
+        n = _count(r"(\d+) faixas", prompt)
+        return json.dumps([f"TEXTO {i + 1}" for i in range(n)])
+    if items is not None:
+        # list[TextElement]: extração completa com geometria
+        result = textlayout.analyze(image_bytes)
+        for line in result.lines:
+            line.text = line.text or "TEXTO"
+        return json.dumps(result.elements(), ensure_ascii=False)
+    analysis = refdesign.merge(refdesign.measure(image_bytes), {
+        "typography": {"headline_font": "Impact", "headline_weight": "bold",
+                       "text_case": "UPPERCASE", "text_shadow": False},
+        "layout": {"person_crop": "torso-up"},
+        "atmosphere": "Análise local (motor stub): alto contraste, cores medidas na imagem.",
+    })
+    return json.dumps(analysis, ensure_ascii=False)
+
+
+_WORDS = ["GANHEI", "SEGREDO", "NINGUÉM", "CONTA", "RÁPIDO", "AGORA", "ERRO", "FATAL", "MÉTODO", "REAL"]
+
+
+def _complete(prompt: str, schema: dict | None = None) -> str:
+    """Sem schema: uma headline por linha; list[CopyLine]: linhas de copy; list[str]: textos."""
+    rng = _seed(prompt)
+    items = _items(schema)
+    if items is None:
+        n = _count(r"Escreva (\d+) headlines", prompt)
+        return "\n".join(" ".join(rng.sample(_WORDS, 3)) for _ in range(n))
+    n = _count(r"Crie exatamente (\d+)", prompt)
+    if items["type"] == "STRING":
+        return json.dumps([" ".join(rng.sample(_WORDS, 2)) for _ in range(n)], ensure_ascii=False)
+    return json.dumps([
+        {"id": f"t{i}", "text": " ".join(rng.sample(_WORDS, 2)), "y": 80 + i * 180,
+         "fontSize": 130 - i * 40, "fontWeight": "bold"}
+        for i in range(n)
+    ], ensure_ascii=False)
+
+
+class StubVision:
+    name = "stub"
+
+    def __init__(self) -> None:
+        self._faults = _Faults("STUB_VISION_LATENCY_MS")
+
+    async def describe(self, prompt: str, image_bytes: bytes, mime: str,
+                       schema: dict | None = None) -> str:
+        await self._faults()
+        return await imaging.run(_describe, prompt, image_bytes, schema)
+
+    async def complete(self, prompt: str, temperature: float = 0.8,
+                       schema: dict | None = None) -> str:
+        await self._faults()
+        return _complete(prompt, schema)
+
+    async def stream(self, prompt: str, temperature: float = 0.8) -> AsyncIterator[str]:
+        await self._faults()
+        for line in _complete(prompt).splitlines(keepends=True):
+            yield line
+            await asyncio.sleep(0)
+
+
+class StubImage:
+    name = "stub"
+
+    def __init__(self) -> None:
+        self._faults = _Faults("STUB_IMAGE_LATENCY_MS")
+
+    async def generate(self, prompt: str, person: Blob | None = None,
+                       reference: Blob | None = None, extra: Blob | None = None) -> bytes:
+        await self._faults()
+        return await imaging.run(compose, prompt, person, reference, extra)
+
+
+_stub: Engine | None = None
+
+
+def stub_engine() -> Engine:
+    """Um stub por processo: a sequência de latências/erros segue a semente."""
+    global _stub
+    if _stub is None:
+        _stub = Engine("stub", StubVision(), StubImage())
+    return _stub
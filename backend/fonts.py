@@ -0,0 +1,378 @@
+"""
+Registro de fontes, métricas de glifos em cache e solver de encaixe de texto.
+
+O registro indexa as fontes em disco por família e peso (Anton, Impact,
+Bebas Neue…). As larguras de avanço e o kerning são medidos uma única vez, num
+tamanho de referência, e escalados linearmente. Assim o solver testa tamanhos
+e quebras de linha só com aritmética, sem desenhar nada, e resolve milhares de
+layouts por segundo.
+
+Quando a família pedida não existe, a troca é explícita: usamos a primeira
+fallback disponível (THUMB_FONT_FALLBACKS), registramos a família em `missing`
+e emitimos um RuntimeWarning uma vez.
+"""
+
+import os
+import re
+import threading
+import warnings
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from PIL import ImageFont
+
+# Métricas de texto do Fabric.js (IText) — o editor posiciona com elas
+FABRIC_LINE_HEIGHT = 1.16
+FABRIC_FONT_SIZE_MULT = 1.13
+FABRIC_FONT_SIZE_FRACTION = 0.222
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+_FONT_DIRS = [
+    PROJECT_ROOT / "execution" / "fonts",
+    Path.home() / ".fonts",
+    Path.home() / ".local" / "share" / "fonts",
+    Path("/usr/share/fonts"),
+    Path("/usr/local/share/fonts"),
+    Path("/Library/Fonts"),
+    Path("/System/Library/Fonts"),
+    Path("C:/Windows/Fonts"),
+]
+
+DEFAULT_FALLBACKS = "Anton,Impact,Bebas Neue,Oswald,Arial,DejaVu Sans"
+
+# Tamanho em que as métricas são medidas antes de escalar
+_REF_SIZE = 256
+
+_WEIGHTS = [
+    ("thin", 100), ("hairline", 100), ("extralight", 200), ("ultralight", 200),
+    ("light", 300), ("medium", 500), ("semibold", 600), ("demibold", 600),
+    ("extrabold", 800), ("ultrabold", 800), ("heavy", 800), ("black", 900),
+    ("bold", 700),
+]
+_WEIGHT_NAMES = {"normal": 400, "regular": 400, "bold": 700}
+
+
+def _norm(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def parse_weight(value: str | int | float | None) -> int:
+    """'bold' / '800' / 700 → peso numérico (400 se não reconhecido)."""
+    if value is None:
+        return 400
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip().lower()
+    if value.isdigit():
+        return int(value)
+    return _WEIGHT_NAMES.get(value, 400)
+
+
+def _style_weight(style: str) -> tuple[int, bool]:
+    """Peso e itálico a partir do nome do estilo ('Bold Italic', 'ExtraBold'...)."""
+    s = _norm(style)
+    italic = "italic" in s or "oblique" in s
+    for token, weight in _WEIGHTS:
+        if token in s:
+            return weight, italic
+    return 400, italic
+
+
+# ---------------------------------------------------------------------------
+# Métricas
+# ---------------------------------------------------------------------------
+
+class FontMetrics:
+    """Avanços por caractere e kerning por par, medidos em _REF_SIZE.
+
+    Caches preenchidos sob demanda; medir um caractere novo custa uma chamada
+    ao FreeType, e daí em diante é consulta de dicionário.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.font = _load(path, _REF_SIZE)
+        ascent, descent = self.font.getmetrics()
+        self.ascent = ascent / _REF_SIZE
+        self.descent = descent / _REF_SIZE
+        self._advance: dict[str, float] = {}
+        self._kern: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _char(self, ch: str) -> float:
+        adv = self._advance.get(ch)
+        if adv is None:
+            with self._lock:
+                adv = self.font.getlength(ch) / _REF_SIZE
+                self._advance[ch] = adv
+        return adv
+
+    def _pair(self, pair: str) -> float:
+        kern = self._kern.get(pair)
+        if kern is None:
+            with self._lock:
+                kern = self.font.getlength(pair) / _REF_SIZE - self._char(pair[0]) - self._char(pair[1])
+                self._kern[pair] = kern
+        return kern
+
+    def width(self, text: str, size: float = 1.0) -> float:
+        """Largura do texto em px no tamanho `size` (1.0 = em unitário)."""
+        if not text:
+            return 0.0
+        total = sum(self._char(ch) for ch in text)
+        total += sum(self._pair(text[i:i + 2]) for i in range(len(text) - 1))
+        return total * size
+
+
+@lru_cache(maxsize=512)
+def _load(path: Optional[str], size: int) -> ImageFont.FreeTypeFont:
+    if path:
+        return ImageFont.truetype(path, size=size)
+    return ImageFont.load_default(size=size)
+
+
+# ---------------------------------------------------------------------------
+# Registro
+# ---------------------------------------------------------------------------
+
+@dataclass
+class FontFace:
+    family: str
+    weight: int
+    italic: bool
+    path: Optional[str]          # None = fonte embutida do Pillow
+    requested: str = ""
+    fallback: bool = False
+
+
+@dataclass
+class FontRegistry:
+    dirs: list[Path] = field(default_factory=list)
+    fallbacks: list[str] = field(default_factory=list)
+    # família normalizada → [(peso, itálico, caminho, nome da família)]
+    _faces: dict[str, list[tuple[int, bool, str, str]]] = field(default_factory=dict)
+    _metrics: dict[Optional[str], FontMetrics] = field(default_factory=dict)
+    missing: set[str] = field(default_factory=set)
+    _scanned: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @classmethod
+    def from_env(cls) -> "FontRegistry":
+        """THUMB_FONTS_DIR (pastas extras, separadas por os.pathsep) e THUMB_FONT_FALLBACKS."""
+        extra = [Path(p) for p in os.getenv("THUMB_FONTS_DIR", "").split(os.pathsep) if p]
+        fallbacks = [f.strip() for f in os.getenv("THUMB_FONT_FALLBACKS", DEFAULT_FALLBACKS).split(",")]
+        return cls(dirs=extra + _FONT_DIRS, fallbacks=[f for f in fallbacks if f])
+
+    def scan(self) -> None:
+        with self._lock:
+            if self._scanned:
+                return
+            for directory in self.dirs:
+                if not directory.is_dir():
+                    continue
+                for path in sorted(directory.rglob("*")):
+                    if path.suffix.lower() in (".ttf", ".otf", ".ttc"):
+                        self._add(path)
+            self._scanned = True
+
+    def _add(self, path: Path) -> None:
+        try:
+            family, style = ImageFont.truetype(str(path), size=12).getname()
+        except OSError:
+            return
+        family = family or path.stem
+        weight, italic = _style_weight(style or "")
+        # Arquivos "Família-Bold" com nome interno genérico
+        if weight == 400:
+            weight, italic_from_name = _style_weight(path.stem.split("-")[-1])
+            italic = italic or italic_from_name
+        entry = (weight, italic, str(path), family)
+        for key in {_norm(family), _norm(path.stem)}:
+            faces = self._faces.setdefault(key, [])
+            if all(f[2] != entry[2] for f in faces):
+                faces.append(entry)
+
+    def families(self) -> list[str]:
+        self.scan()
+        return sorted({f[3] for faces in self._faces.values() for f in faces})
+
+    def _match(self, family: str, weight: int, italic: bool) -> Optional[FontFace]:
+        faces = self._faces.get(_norm(family))
+        if not faces:
+            return None
+        best = min(faces, key=lambda f: (f[1] != italic, abs(f[0] - weight), f[0] < weight))
+        return FontFace(best[3], best[0], best[1], best[2])
+
+    def resolve(self, family: str, weight: str | int = 400, italic: bool = False) -> FontFace:
+        """Face mais próxima (peso/itálico) da família; fallback explícito se não houver.
+
+        `family` também pode ser o caminho de um arquivo .ttf/.otf.
+        """
+        self.scan()
+        w = parse_weight(weight)
+        if family.lower().endswith((".ttf", ".otf", ".ttc")) and os.path.isfile(family):
+            return FontFace(Path(family).stem, w, italic, family, requested=family)
+        face = self._match(family, w, italic)
+        if face is not None:
+            face.requested = family
+            return face
+
+        if family not in self.missing:
+            self.missing.add(family)
+            warnings.warn(f"fonte '{family}' não encontrada; usando fallback", RuntimeWarning, stacklevel=2)
+        for name in self.fallbacks:
+            face = self._match(name, w, italic)
+            if face is not None:
+                face.requested, face.fallback = family, True
+                return face
+        path = os.getenv("THUMB_FONT_PATH") or None
+        return FontFace(family, w, italic, path, requested=family, fallback=True)
+
+    def font(self, face: FontFace, size: int) -> ImageFont.FreeTypeFont:
+        try:
+            return _load(face.path, max(1, int(size)))
+        except OSError:
+            return _load(None, max(1, int(size)))
+
+    def metrics(self, face: FontFace) -> FontMetrics:
+        m = self._metrics.get(face.path)
+        if m is None:
+            try:
+                m = FontMetrics(face.path)
+            except OSError:
+                m = FontMetrics(None)
+            self._metrics[face.path] = m
+        return m
+
+    def stats(self) -> dict:
+        return {
+            "families": len({f[3] for faces in self._faces.values() for f in faces}),
+            "measured_faces": len(self._metrics),
+            "missing": sorted(self.missing),
+        }
+
+
+_registry: Optional[FontRegistry] = None
+
+
+def registry() -> FontRegistry:
+    """Registro do processo, criado sob demanda (depois do load_dotenv)."""
+    global _registry
+    if _registry is None:
+        _registry = FontRegistry.from_env()
+    return _registry
+
+
+# ---------------------------------------------------------------------------
+# Solver de encaixe
+# ---------------------------------------------------------------------------
+
+@dataclass
+class TextFit:
+    font_size: int
+    lines: list[str]
+    width: float                 # largura da maior linha, contorno incluso
+    height: float                # altura do bloco no layout do Fabric
+    face: FontFace
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+def block_height(font_size: float, line_count: int) -> float:
+    """Altura de um IText do Fabric: a última linha não leva o lineHeight."""
+    em = font_size * FABRIC_FONT_SIZE_MULT
+    return em * (FABRIC_LINE_HEIGHT * (line_count - 1) + 1) if line_count else 0.0
+
+
+def _wrap(words: list[str], widths: list[float], space: float, limit: float,
+          max_lines: int) -> Optional[list[list[int]]]:
+    """Quebra gulosa em unidades de em; None se não couber em max_lines."""
+    lines: list[list[int]] = []
+    current: list[int] = []
+    current_w = 0.0
+    for i, w in enumerate(widths):
+        if w > limit:
+            return None
+        if current and current_w + space + w > limit:
+            lines.append(current)
+            if len(lines) >= max_lines:
+                return None
+            current, current_w = [], 0.0
+        current_w = current_w + space + w if current else w
+        current.append(i)
+    if current:
+        lines.append(current)
+    return lines
+
+
+def fit_text(
+    text: str,
+    box_width: float,
+    box_height: float,
+    family: str = "Anton",
+    weight: str | int = "bold",
+    max_lines: int = 3,
+    min_size: int = 24,
+    max_size: int = 200,
+    stroke_width: float = 0.0,
+    uppercase: bool = False,
+    registry_: Optional[FontRegistry] = None,
+) -> TextFit:
+    """Maior fontSize (busca binária) cujo texto, com quebras gulosas, cabe na caixa.
+
+    Quebras de linha já presentes no texto são respeitadas. Se nem `min_size`
+    couber, devolve o layout em `min_size` (o chamador decide se corta o texto).
+    """
+    reg = registry_ or registry()
+    face = reg.resolve(family, weight)
+    metrics = reg.metrics(face)
+    if uppercase:
+        text = text.upper()
+
+    paragraphs = [p.split() for p in text.split("\n")]
+    words = [w for p in paragraphs for w in p]
+    widths = [metrics.width(w) for w in words]
+    space = metrics.width(" ")
+    breaks = [len(p) for p in paragraphs]
+
+    def layout(size: int) -> Optional[list[list[int]]]:
+        # O contorno do Fabric é centrado no traço: metade sobra para cada lado
+        limit = (box_width - stroke_width) / size
+        if limit <= 0:
+            return None
+        lines: list[list[int]] = []
+        offset = 0
+        for count in breaks:
+            part = _wrap(words[offset:offset + count], widths[offset:offset + count],
+                         space, limit, max_lines - len(lines))
+            if part is None:
+                return None
+            lines += [[offset + i for i in line] for line in part] or [[]]
+            offset += count
+        if len(lines) > max_lines or block_height(size, len(lines)) + stroke_width > box_height:
+            return None
+        return lines
+
+    lo, hi = min_size, max(min_size, max_size)
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        lines = layout(mid)
+        if lines is not None:
+            best, lo = (mid, lines), mid + 1
+        else:
+            hi = mid - 1
+
+    if best is None:
+        size = min_size
+        lines = [[i for i in range(len(words))]]
+    else:
+        size, lines = best
+    line_texts = [" ".join(words[i] for i in line) for line in lines]
+    width = max((metrics.width(t, size) for t in line_texts), default=0.0) + stroke_width
+    return TextFit(size, line_texts, width, block_height(size, len(line_texts)) + stroke_width, face)
@@ -0,0 +1,536 @@
+"""
+Cliente HTTP compartilhado para a API Gemini (generativelanguage.googleapis.com).
+Um único httpx.AsyncClient por processo: pool de conexões, keep-alive e HTTP/2,
+criado/fechado no lifespan do FastAPI. Usado por backend/main.py e api/index.py.
+
+`post()` é a porta de entrada de todas as chamadas: retries com backoff
+exponencial + jitter (respeitando Retry-After), token bucket por chave/modelo,
+circuit breaker por modelo, métricas por tentativa e, opcionalmente,
+coalescência (single-flight) de chamadas idênticas em andamento.
+
+Imagens entram no payload como `Base64(bytes)`: o corpo JSON é montado em
+pedaços na hora do envio (base64 em blocos, com Content-Length calculado), sem
+materializar a string base64 nem o JSON inteiro em memória.
+"""
+
+import asyncio
+import base64
+import email.utils
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import httpx
+from fastapi import HTTPException
+
+import metrics
+from cache import SingleFlight
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+
+_client: httpx.AsyncClient | None = None
+
+
+# ---------------------------------------------------------------------------
+# Configuração (lida do ambiente sob demanda — depois do load_dotenv())
+# ---------------------------------------------------------------------------
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _timeout(total_env: str, total_default: float) -> httpx.Timeout:
+    return httpx.Timeout(
+        _env_float(total_env, total_default),
+        connect=_env_float("GEMINI_CONNECT_TIMEOUT", 10.0),
+    )
+
+
+def vision_timeout() -> httpx.Timeout:
+    """Timeout das chamadas de visão (análise de referência / extração)."""
+    return _timeout("GEMINI_VISION_TIMEOUT", 60.0)
+
+
+def image_timeout() -> httpx.Timeout:
+    """Timeout da geração de imagem — a chamada mais lenta do pipeline."""
+    return _timeout("GEMINI_IMAGE_TIMEOUT", 180.0)
+
+
+def text_timeout() -> httpx.Timeout:
+    """Timeout das chamadas só-texto (copywriting)."""
+    return _timeout("GEMINI_TEXT_TIMEOUT", 30.0)
+
+
+def image_max_retries() -> int:
+    """Geração de imagem é cara e lenta: por padrão só um retry."""
+    return _env_int("GEMINI_IMAGE_MAX_RETRIES", 1)
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("GEMINI_HTTP2", "1").lower() in ("0", "false", "no"):
+        return False
+    try:
+        import h2  # noqa: F401 — extra opcional do httpx (httpx[http2])
+    except ImportError:
+        return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Ciclo de vida do cliente
+# ---------------------------------------------------------------------------
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=_env_int("GEMINI_MAX_CONNECTIONS", 20),
+        max_keepalive_connections=_env_int("GEMINI_MAX_KEEPALIVE", 10),
+        keepalive_expiry=_env_float("GEMINI_KEEPALIVE_EXPIRY", 60.0),
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=vision_timeout(),
+        http2=_http2_enabled(),
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Retorna o cliente do processo, criando-o se o lifespan não rodou (ex.: serverless)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Lifespan do FastAPI: abre o pool na subida e fecha no desligamento."""
+    get_client()
+    try:
+        yield
+    finally:
+        await close_client()
+
+
+def model_url(model: str, api_key: str, method: str = "generateContent") -> str:
+    # GEMINI_BASE_URL aponta para outro servidor (ex.: o mock de bench/)
+    base = os.getenv("GEMINI_BASE_URL", GEMINI_BASE_URL).rstrip("/")
+    return f"{base}/{model}:{method}?key={api_key}"
+
+
+# ---------------------------------------------------------------------------
+# Corpo da requisição
+# ---------------------------------------------------------------------------
+
+class Base64:
+    """Bytes que vão como string base64 no JSON, codificados só durante o envio."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __len__(self) -> int:
+        return 4 * ((len(self.data) + 2) // 3)
+
+
+_B64_CHUNK = 3 * 64 * 1024          # múltiplo de 3: blocos concatenam sem padding no meio
+_PLACEHOLDER = re.compile(r'"\\u0000b64:(\d+)"')
+
+
+def encode_body(payload: dict) -> tuple[list[bytes | Base64], int]:
+    """Payload → pedaços do corpo JSON (bytes já prontos e Base64 pendentes) + tamanho total."""
+    blobs: list[Base64] = []
+
+    def detach(node):
+        if isinstance(node, Base64):
+            blobs.append(node)
+            return f"\0b64:{len(blobs) - 1}"
+        if isinstance(node, dict):
+            return {k: detach(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [detach(v) for v in node]
+        return node
+
+    text = json.dumps(detach(payload), ensure_ascii=False, separators=(",", ":"))
+    parts: list[bytes | Base64] = []
+    pos = 0
+    for match in _PLACEHOLDER.finditer(text):
+        parts.append(text[pos:match.start() + 1].encode())   # até a aspa de abertura
+        parts.append(blobs[int(match.group(1))])
+        pos = match.end() - 1                                  # a partir da aspa de fechamento
+    parts.append(text[pos:].encode())
+    return parts, sum(len(part) for part in parts)
+
+
+async def _body_chunks(parts: list[bytes | Base64]):
+    for part in parts:
+        if isinstance(part, Base64):
+            view = memoryview(part.data)
+            for i in range(0, len(view), _B64_CHUNK):
+                yield base64.b64encode(view[i:i + _B64_CHUNK])
+        else:
+            yield part
+
+
+def _request_args(payload: dict) -> tuple[dict, int]:
+    """kwargs de httpx para enviar o payload em streaming (novo iterador a cada tentativa)."""
+    parts, length = encode_body(payload)
+    headers = {"Content-Type": "application/json", "Content-Length": str(length)}
+    return {"content": _body_chunks(parts), "headers": headers}, length
+
+
+# ---------------------------------------------------------------------------
+# Resiliência: rate limit, circuit breaker, retries
+# ---------------------------------------------------------------------------
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class GeminiUnavailable(HTTPException):
+    """Upstream indisponível (circuito aberto ou falha de conexão após retries)."""
+
+    def __init__(self, detail: str, status_code: int = 503):
+        super().__init__(status_code, detail)
+
+
+class TokenBucket:
+    """Limita a taxa de requisições; um 429 com Retry-After bloqueia o bucket inteiro."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def penalize(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """closed → open após `threshold` falhas seguidas; após `cooldown` s libera
+    uma chamada de teste (half-open) que fecha ou reabre o circuito."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+_buckets: dict[tuple[str, str], TokenBucket] = {}
+_breakers: dict[str, CircuitBreaker] = {}
+_metrics: dict[str, dict] = defaultdict(lambda: {
+    "calls": 0, "attempts": 0, "retries": 0, "rejected": 0, "errors": 0,
+    "status": Counter(), "latency_ms_total": 0.0, "bytes_sent": 0, "bytes_received": 0,
+})
+
+
+def _bucket(api_key: str, model: str) -> TokenBucket:
+    # A chave nunca é guardada em claro (nem aparece nas métricas)
+    key = (hashlib.sha256(api_key.encode()).hexdigest()[:16], model)
+    if key not in _buckets:
+        _buckets[key] = TokenBucket(
+            rate=_env_float("GEMINI_RATE_PER_SEC", 5.0),
+            burst=_env_int("GEMINI_RATE_BURST", 10),
+        )
+    return _buckets[key]
+
+
+def _breaker(model: str) -> CircuitBreaker:
+    if model not in _breakers:
+        _breakers[model] = CircuitBreaker(
+            threshold=_env_int("GEMINI_BREAKER_THRESHOLD", 5),
+            cooldown=_env_float("GEMINI_BREAKER_COOLDOWN", 30.0),
+        )
+    return _breakers[model]
+
+
+def _retry_after(resp: httpx.Response | None) -> float | None:
+    """Retry-After em segundos (formato numérico ou data HTTP)."""
+    if resp is None:
+        return None
+    value = resp.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def _backoff(attempt: int) -> float:
+    """Full jitter: U(0, min(max, base * 2^attempt))."""
+    base = _env_float("GEMINI_BACKOFF_BASE", 0.5)
+    cap = _env_float("GEMINI_BACKOFF_MAX", 8.0)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+_flights = SingleFlight()
+
+
+def _flight_key(api_key: str, model: str, method: str, payload: dict) -> str:
+    """Hash de modelo + prompt + digests das imagens inline (sem serializar o base64 inteiro)."""
+    h = hashlib.sha256()
+    for part in (api_key, model, method):
+        h.update(part.encode())
+        h.update(b"\0")
+    for content in payload.get("contents", []):
+        for part in content.get("parts", []):
+            inline = part.get("inline_data") or part.get("inlineData")
+            if inline:
+                h.update(inline.get("mime_type", "").encode())
+                data = inline["data"]
+                h.update(hashlib.sha256(data.data if isinstance(data, Base64) else data.encode()).digest())
+            else:
+                h.update(json.dumps(part, sort_keys=True, ensure_ascii=False).encode())
+            h.update(b"\0")
+    config = {k: v for k, v in payload.items() if k != "contents"}
+    h.update(json.dumps(config, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+async def post(api_key: str, model: str, payload: dict, timeout: httpx.Timeout,
+               method: str = "generateContent", max_retries: int | None = None,
+               coalesce: bool = False) -> httpx.Response:
+    """POST resiliente para `model:method`.
+
+    Retorna a resposta final — inclusive não-200 não-retentáveis ou o último
+    429/5xx quando as tentativas acabam; o tratamento fica com quem chama.
+    Levanta GeminiUnavailable se o circuito estiver aberto ou a conexão falhar
+    em todas as tentativas.
+
+    Com `coalesce=True`, chamadas idênticas simultâneas compartilham a mesma
+    requisição upstream. Não use onde respostas diferentes são desejadas
+    (ex.: variantes de imagem).
+    """
+    if coalesce:
+        key = _flight_key(api_key, model, method, payload)
+        return await _flights.do(
+            key, lambda: _post(api_key, model, payload, timeout, method, max_retries)
+        )
+    return await _post(api_key, model, payload, timeout, method, max_retries)
+
+
+async def _post(api_key: str, model: str, payload: dict, timeout: httpx.Timeout,
+                method: str, max_retries: int | None) -> httpx.Response:
+    m = _metrics[model]
+    m["calls"] += 1
+    breaker = _breaker(model)
+    if not breaker.allow():
+        m["rejected"] += 1
+        raise GeminiUnavailable(f"Gemini ({model}) instável — tente novamente em instantes.")
+    trial = breaker.trial_in_flight  # esta chamada é o teste do half-open
+
+    bucket = _bucket(api_key, model)
+    url = model_url(model, api_key, method)
+    retries = _env_int("GEMINI_MAX_RETRIES", 2) if max_retries is None else max_retries
+    max_wait = _env_float("GEMINI_RETRY_AFTER_MAX", 30.0)
+
+    resp: httpx.Response | None = None
+    error: Exception | None = None
+    try:
+        for attempt in range(retries + 1):
+            await bucket.acquire()
+            m["attempts"] += 1
+            started = time.monotonic()
+            try:
+                body, length = _request_args(payload)
+                resp = await get_client().post(url, **body, timeout=timeout)
+            except httpx.TransportError as exc:  # conexão, TLS, timeouts
+                resp, error = None, exc
+                m["errors"] += 1
+            m["latency_ms_total"] += (time.monotonic() - started) * 1000
+
+            if resp is not None:
+                m["status"][resp.status_code] += 1
+                m["bytes_sent"] += length
+                m["bytes_received"] += len(resp.content)
+                if resp.status_code not in RETRYABLE_STATUS:
+                    breaker.record_success()
+                    return resp
+
+            if attempt == retries:
+                break
+            delay = _backoff(attempt)
+            retry_after = _retry_after(resp)
+            if retry_after is not None:
+                if retry_after > max_wait:
+                    break
+                delay = max(delay, retry_after)
+                bucket.penalize(retry_after)
+            m["retries"] += 1
+            await asyncio.sleep(delay)
+    except (asyncio.CancelledError, HTTPException):
+        raise
+    except Exception:
+        # Falha fora do status HTTP (decodificação, redirects, corpo inválido…)
+        m["errors"] += 1
+        breaker.record_failure()
+        raise
+    finally:
+        # Nunca deixa o teste do half-open preso (cliente desconectou, exceção inesperada)
+        if trial:
+            breaker.trial_in_flight = False
+
+    breaker.record_failure()
+    if resp is not None:
+        return resp
+    raise GeminiUnavailable(f"Falha de conexão com o Gemini: {error!r}", status_code=502)
+
+
+async def stream(api_key: str, model: str, payload: dict,
+                 timeout: httpx.Timeout) -> AsyncIterator[dict]:
+    """streamGenerateContent (SSE): devolve cada pedaço da resposta assim que chega.
+
+    Passa pelo mesmo rate limit e circuit breaker de post(), mas sem retries —
+    parte da resposta pode já ter sido repassada ao cliente. Não-200 vira 502.
+    """
+    m = _metrics[model]
+    m["calls"] += 1
+    breaker = _breaker(model)
+    if not breaker.allow():
+        m["rejected"] += 1
+        raise GeminiUnavailable(f"Gemini ({model}) instável — tente novamente em instantes.")
+    trial = breaker.trial_in_flight
+
+    started = time.monotonic()
+    url = model_url(model, api_key, "streamGenerateContent") + "&alt=sse"
+    try:
+        await _bucket(api_key, model).acquire()
+        m["attempts"] += 1
+        started = time.monotonic()
+        body, length = _request_args(payload)
+        async with get_client().stream("POST", url, **body, timeout=timeout) as resp:
+            m["status"][resp.status_code] += 1
+            m["bytes_sent"] += length
+            if resp.status_code != 200:
+                body = await resp.aread()
+                m["bytes_received"] += len(body)
+                if resp.status_code in RETRYABLE_STATUS:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise HTTPException(502, f"Gemini erro: {body[:400].decode(errors='replace')}")
+            breaker.record_success()
+            async for line in resp.aiter_lines():
+                m["bytes_received"] += len(line) + 1
+                if line.startswith("data:"):
+                    yield json.loads(line[5:])
+    except httpx.TransportError as exc:
+        m["errors"] += 1
+        breaker.record_failure()
+        raise GeminiUnavailable(f"Falha de conexão com o Gemini: {exc!r}", status_code=502)
+    except (asyncio.CancelledError, HTTPException):
+        raise
+    except Exception:
+        m["errors"] += 1
+        breaker.record_failure()
+        raise
+    finally:
+        if trial:
+            breaker.trial_in_flight = False
+        m["latency_ms_total"] += (time.monotonic() - started) * 1000
+
+
+def stats() -> dict:
+    """Métricas por modelo + estado dos circuitos (exposto em /api/health)."""
+    return {
+        "models": {
+            model: {
+                **{k: v for k, v in m.items() if k != "status"},
+                "status": {str(code): n for code, n in m["status"].items()},
+                "circuit": _breaker(model).state,
+            }
+            for model, m in _metrics.items()
+        },
+        "single_flight": {
+            "leaders": _flights.leaders,
+            "coalesced": _flights.shared,
+            "in_flight": len(_flights),
+        },
+    }
+
+
+@metrics.collector
+def _prometheus() -> list[tuple[str, str, dict[str, str], float]]:
+    samples = []
+    for model, m in list(_metrics.items()):
+        labels = {"model": model}
+        for key in ("calls", "attempts", "retries", "rejected", "errors", "bytes_sent", "bytes_received"):
+            samples.append((f"thumb_upstream_{key}_total", "counter", labels, m[key]))
+        samples.append(("thumb_upstream_latency_seconds_total", "counter", labels, m["latency_ms_total"] / 1000))
+        for code, n in m["status"].items():
+            samples.append(("thumb_upstream_responses_total", "counter", {**labels, "status": str(code)}, n))
+        samples.append(("thumb_upstream_circuit_open", "gauge", labels, float(_breaker(model).state != "closed")))
+    samples.append(("thumb_upstream_coalesced_total", "counter", {}, _flights.shared))
+    samples.append(("thumb_upstream_in_flight", "gauge", {}, len(_flights)))
+    return samples
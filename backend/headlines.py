@@ -0,0 +1,169 @@
+"""
+Sugestões de headline para a aba IA do editor (/api/headlines).
+
+Uma única chamada ao modelo de texto devolve um lote já ranqueado (da mais
+forte para a mais fraca), uma headline por linha — o mesmo formato serve à
+resposta completa e ao modo streaming, que repassa cada linha assim que ela
+termina de chegar.
+
+Os lotes ficam num TieredCache pela chave normalizada (tema sem acentos/caixa/
+pontuação nas pontas, categoria, quantidade, motor), então um acerto responde
+sem ir ao upstream. HEADLINES_PREWARM lista temas comuns para aquecer o cache
+em todas as categorias na subida do servidor.
+"""
+
+import os
+import re
+import unicodedata
+from typing import AsyncIterator
+
+from fastapi import HTTPException
+
+import metrics
+from cache import SingleFlight, TieredCache, digest
+from engines import Engine
+from sse import Emit
+
+# Muda quando o prompt ou o parser mudam (invalida o cache persistido)
+VERSION = "1"
+
+DEFAULT_COUNT = 8
+MAX_COUNT = 12
+MAX_WORDS = 6
+MAX_TOPIC_CHARS = 200
+
+_PROMPT = """Você é especialista em copywriting viral para thumbnails de YouTube.
+
+Tema do vídeo: {topic}
+Objetivo da thumbnail: {context}
+
+Escreva {n} headlines diferentes para esta thumbnail, da mais forte para a mais fraca
+(a primeira é a que você apostaria para o maior CTR).
+Regras: EM CAIXA ALTA, no máximo 5 palavras, sem hashtags nem emojis, uma ideia diferente por linha.
+
+Responda APENAS com as headlines, uma por linha, sem numeração, aspas ou markdown."""
+
+_BULLET = re.compile(r'^\s*(?:[-*•]+|\d{1,2}\s*[.):-])\s*')
+
+
+def normalize(topic: str, category: str) -> tuple[str, str]:
+    """Forma canônica usada na chave do cache: sem acentos, caixa ou pontuação nas pontas."""
+    text = unicodedata.normalize("NFKD", topic.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.split()).strip(" .,;:!?\"'"), category.strip().casefold()
+
+
+def clean(line: str) -> str | None:
+    """Uma linha da resposta → headline, ou None se for ruído (markdown, vazia, longa demais)."""
+    text = _BULLET.sub("", line.strip()).strip(' \t"“”\'[],')
+    if not text or text.startswith("```") or len(text.split()) > MAX_WORDS:
+        return None
+    return text.upper()
+
+
+class _Ranked:
+    """Acumula as headlines na ordem do modelo, sem repetições."""
+
+    def __init__(self, n: int):
+        self.n = n
+        self.items: list[str] = []
+        self._seen: set[str] = set()
+
+    def add(self, line: str) -> str | None:
+        text = clean(line)
+        if text is None or len(self.items) >= self.n:
+            return None
+        key = normalize(text, "")[0]
+        if key in self._seen:
+            return None
+        self._seen.add(key)
+        self.items.append(text)
+        return text
+
+
+async def _lines(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Trechos de texto em streaming → linhas completas."""
+    buffer = ""
+    async for chunk in chunks:
+        buffer += chunk
+        *done, buffer = buffer.split("\n")
+        for line in done:
+            yield line
+    if buffer:
+        yield buffer
+
+
+class HeadlineService:
+    def __init__(self, store: TieredCache, contexts: dict[str, str]):
+        self.store = store
+        self.contexts = contexts
+        self._flights = SingleFlight()
+
+    def _request(self, engine: Engine, topic: str, category: str, n: int) -> tuple[str, str, int]:
+        topic = " ".join(topic.split())[:MAX_TOPIC_CHARS]
+        if not topic:
+            raise HTTPException(400, "Informe o tema do vídeo.")
+        n = max(1, min(MAX_COUNT, n))
+        key = digest(*normalize(topic, category), str(n), engine.vision.name, VERSION)
+        prompt = _PROMPT.format(topic=topic, n=n,
+                                context=self.contexts.get(category.strip().casefold(), "(livre)"))
+        return key, prompt, n
+
+    async def generate(self, engine: Engine, topic: str, category: str,
+                       n: int = DEFAULT_COUNT) -> tuple[list[str], bool]:
+        """Lote ranqueado e se veio do cache. Pedidos iguais simultâneos dividem a chamada."""
+        key, prompt, n = self._request(engine, topic, category, n)
+        cached = self.store.get(key)
+        if cached is not None:
+            return cached, True
+
+        async def run() -> list[str]:
+            with metrics.stage("headlines"):
+                raw = await engine.vision.complete(prompt, temperature=0.9)
+            ranked = _Ranked(n)
+            for line in raw.splitlines():
+                ranked.add(line)
+            if ranked.items:
+                self.store.set(key, ranked.items)
+            return ranked.items
+
+        return await self._flights.do(key, run), False
+
+    async def stream(self, engine: Engine, topic: str, category: str, n: int, emit: Emit) -> None:
+        """Emite `headline` ({rank, text}) à medida que o modelo escreve e termina com `done`."""
+        key, prompt, n = self._request(engine, topic, category, n)
+        cached = self.store.get(key)
+        if cached is None:
+            ranked = _Ranked(n)
+            with metrics.stage("headlines"):
+                async for line in _lines(engine.vision.stream(prompt, temperature=0.9)):
+                    text = ranked.add(line)
+                    if text is not None:
+                        await emit("headline", {"rank": len(ranked.items), "text": text})
+            if ranked.items:
+                self.store.set(key, ranked.items)
+            await emit("done", {"headlines": ranked.items, "cached": False})
+            return
+        for rank, text in enumerate(cached, 1):
+            await emit("headline", {"rank": rank, "text": text})
+        await emit("done", {"headlines": cached, "cached": True})
+
+    async def prewarm(self, engine: Engine, topics: list[str]) -> int:
+        """Aquece o cache para cada tema × categoria, em sequência (não disputa o upstream)."""
+        warmed = 0
+        for topic in topics:
+            for category in self.contexts:
+                try:
+                    _, cached = await self.generate(engine, topic, category)
+                except HTTPException:
+                    continue
+                warmed += not cached
+        return warmed
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+def prewarm_topics() -> list[str]:
+    """HEADLINES_PREWARM: temas separados por vírgula (vazio = sem pré-aquecimento)."""
+    return [t.strip() for t in os.getenv("HEADLINES_PREWARM", "").split(",") if t.strip()]
@@ -0,0 +1,98 @@
+"""
+Idempotency-Key para /api/generate.
+
+Reenvios de conexões móveis instáveis e timeouts de proxy repetiam o pipeline
+inteiro (e pagavam outra geração de imagem). Com o header `Idempotency-Key`:
+
+- resposta já concluída para a chave → devolvida na hora, com
+  `Idempotent-Replayed: true`;
+- mesma chave ainda em andamento → o pedido novo se junta ao que está rodando
+  (SingleFlight: a geração segue mesmo se o cliente original desconectou);
+- mesma chave com outro conteúdo (prompt, imagens, motor) → 422.
+
+Só respostas de sucesso são guardadas: um erro pode ser tentado de novo com a
+mesma chave. O armazenamento é um TieredCache (IDEMPOTENCY_TTL,
+IDEMPOTENCY_MAX_ENTRIES; IDEMPOTENCY_DB em sqlite sobrevive a reinícios) e guarda
+a resposta compactada por ImageStorage.pack: no modo data URL a imagem fica fora
+do cache, num LRU limitado em memória. Se ela já saiu de lá, o pedido roda de
+novo — mesma chave e mesmo conteúdo, então o resultado é equivalente.
+"""
+
+import time
+from dataclasses import fields
+from typing import Any, Awaitable, Callable
+
+from fastapi import HTTPException
+
+from cache import SingleFlight, TieredCache, digest
+from storage import ImageStorage
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(inputs: Any) -> str:
+    """Hash de todos os campos de um dataclass de entradas (bytes das imagens inclusos)."""
+    values = (getattr(inputs, f.name) for f in fields(inputs))
+    return digest(*(v if isinstance(v, bytes) else repr(v) for v in values))
+
+
+class IdempotencyStore:
+    def __init__(self, store: TieredCache, images: ImageStorage):
+        self.store = store
+        self.images = images
+        self._flights = SingleFlight()
+        self._inflight: dict[str, str] = {}   # chave → fingerprint do pedido em andamento
+        self.replayed = 0
+
+    @classmethod
+    def from_env(cls, images: ImageStorage) -> "IdempotencyStore":
+        return cls(TieredCache.from_env("IDEMPOTENCY", table="idempotency", max_entries=1024), images)
+
+    @staticmethod
+    def check_key(key: str) -> str:
+        key = key.strip()
+        if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+            raise HTTPException(400, f"{HEADER} deve ter de 1 a {MAX_KEY_LENGTH} caracteres imprimíveis.")
+        return key
+
+    @staticmethod
+    def _conflict() -> HTTPException:
+        return HTTPException(422, f"{HEADER} já usada com outra requisição — gere uma chave nova.")
+
+    async def run(self, key: str, fingerprint: str,
+                  fn: Callable[[], Awaitable[dict]]) -> tuple[dict, bool]:
+        """Resposta de `fn()` para a chave e se foi reaproveitada (concluída ou em andamento)."""
+        key = self.check_key(key)
+        stored = self.store.get(key)
+        if stored is not None:
+            if stored["fingerprint"] != fingerprint:
+                raise self._conflict()
+            response = self.images.unpack(stored["response"])
+            if response is not None:
+                self.replayed += 1
+                return response, True
+
+        running = self._inflight.get(key)
+        if running is not None and running != fingerprint:
+            raise self._conflict()
+
+        async def execute() -> dict:
+            try:
+                response = await fn()
+                self.store.set(key, {"fingerprint": fingerprint, "response": self.images.pack(response),
+                                     "created": time.time()})
+                return response
+            finally:
+                self._inflight.pop(key, None)
+
+        replayed = running is not None
+        if replayed:
+            self.replayed += 1
+        else:
+            self._inflight[key] = fingerprint
+        return await self._flights.do(key, execute), replayed
+
+    def stats(self) -> dict[str, Any]:
+        return {**self.store.stats(), "inflight": len(self._inflight), "replayed": self.replayed}
@@ -0,0 +1,87 @@
+"""
+Normalização das imagens enviadas antes das chamadas ao Gemini.
+Aplica a orientação EXIF, reduz para uma aresta máxima, remove metadados e
+recodifica em JPEG/WebP com qualidade ajustável. Roda num thread pool dedicado
+para não bloquear o event loop.
+"""
+
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+_EXIF_ORIENTATION = 0x0112
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def _settings() -> dict:
+    return {
+        "max_edge":    int(os.getenv("IMAGE_MAX_EDGE", "1536")),
+        "quality":     int(os.getenv("IMAGE_QUALITY", "85")),
+        "format":      os.getenv("IMAGE_FORMAT", "jpeg").lower(),
+        # Imagens pequenas, sem rotação e já no tamanho certo passam intactas
+        "passthrough": int(os.getenv("IMAGE_PASSTHROUGH_BYTES", str(512 * 1024))),
+    }
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        workers = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="imaging")
+    return _executor
+
+
+def normalize_image(data: bytes, mime: str, settings: dict | None = None) -> tuple[bytes, str]:
+    """Versão síncrona. Retorna (bytes, mime); se a imagem não puder ser decodificada,
+    devolve a original — o Gemini decide se aceita."""
+    s = settings or _settings()
+    try:
+        im = Image.open(io.BytesIO(data))
+        rotated = im.getexif().get(_EXIF_ORIENTATION, 1) not in (0, 1)
+        oversized = max(im.size) > s["max_edge"]
+        if not rotated and not oversized and len(data) <= s["passthrough"]:
+            return data, mime
+        if oversized and im.format == "JPEG":
+            # Decodifica o JPEG já reduzido (DCT scaling) — bem mais barato que decodificar 12 MP
+            im.draft("RGB", (s["max_edge"], s["max_edge"]))
+        im.load()
+    except Exception:
+        return data, mime
+
+    im = ImageOps.exif_transpose(im)
+    if oversized:
+        im.thumbnail((s["max_edge"], s["max_edge"]), Image.Resampling.LANCZOS)
+
+    has_alpha = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+    out = io.BytesIO()
+    # Sem `exif=`/`icc_profile=` no save: metadados ficam para trás
+    if s["format"] == "webp" or has_alpha:
+        # WebP preserva transparência (logos/stickers em extra_elements)
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        im.save(out, format="WEBP", quality=s["quality"], method=4)
+        new_mime = "image/webp"
+    else:
+        im = im.convert("RGB")
+        im.save(out, format="JPEG", quality=s["quality"], optimize=True, progressive=True)
+        new_mime = "image/jpeg"
+
+    # Recodificar nunca deve aumentar o payload de uma imagem que não precisou girar/reduzir
+    if not rotated and not oversized and out.tell() >= len(data):
+        return data, mime
+    return out.getvalue(), new_mime
+
+
+async def normalize(data: bytes | None, mime: str | None) -> tuple[bytes | None, str | None]:
+    if not data:
+        return data, mime
+    return await run(normalize_image, data, mime or "image/jpeg", _settings())
+
+
+async def run(fn, *args):
+    """Executa trabalho de CPU com Pillow/NumPy no pool de imagem, fora do event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool(), fn, *args)
@@ -0,0 +1,315 @@
+"""
+Fila de jobs assíncronos para a geração (/api/jobs).
+
+POST /api/jobs devolve um id na hora; um pool fixo de workers (JOBS_WORKERS)
+roda o pipeline e GET /api/jobs/{id} mostra estado, estágio atual e resultado.
+O número de workers é também o teto de gerações simultâneas no upstream; com a
+fila cheia (JOBS_MAX_QUEUE) o pedido é recusado com 503 + Retry-After.
+
+Os jobs ficam num TieredCache (memória; sqlite em JOBS_DB sobrevive a
+reinícios e pode ser compartilhado por vários workers do uvicorn), com o
+resultado compactado por ImageStorage.pack — no modo data URL a imagem fica num
+LRU limitado em memória, não no cache. Cada job guarda o processo dono, que
+renova um heartbeat no store; um job na fila ou rodando cujo dono parou de
+bater (o processo caiu) é devolvido como `failed` (interrompido) — as entradas
+não são persistidas.
+
+Ao terminar, se houver `webhook_url`, o job é enviado por POST (JSON, até 3
+tentativas). Com JOBS_WEBHOOK_SECRET o corpo vai assinado em
+X-Thumb-Signature: sha256=<hmac>. JOBS_WEBHOOK_HOSTS restringe os destinos;
+sem essa lista, hosts que resolvem para endereços não públicos (loopback, rede
+privada, link-local como o metadata da nuvem, reservados) são recusados. A
+entrega conecta no IP validado (Host e SNI do hostname original), sem nova
+consulta DNS entre a checagem e a conexão.
+
+Em serverless (api/index.py na Vercel) a função termina com a resposta: use
+um processo uvicorn comum para o modo job.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable
+from urllib.parse import urlparse
+
+import httpx
+from fastapi import HTTPException
+
+from cache import TieredCache
+from storage import ImageStorage
+
+Progress = Callable[[str], None]
+Runner = Callable[[Progress], Awaitable[dict]]
+
+ACTIVE = ("queued", "running")
+WEBHOOK_ATTEMPTS = 3
+HEARTBEAT_INTERVAL = 10.0
+# Dono sem heartbeat há mais que isso é considerado morto
+OWNER_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+log = logging.getLogger(__name__)
+
+
+def _public(job: dict) -> dict:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+class JobQueue:
+    def __init__(self, store: TieredCache, images: ImageStorage, workers: int = 4, max_queue: int = 100,
+                 webhook_hosts: set[str] | None = None, webhook_secret: str = ""):
+        self.store = store
+        self.images = images
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.webhook_hosts = webhook_hosts
+        self.webhook_secret = webhook_secret
+        self._queue: asyncio.Queue[tuple[str, Runner]] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._active: set[str] = set()
+        self.owner = uuid.uuid4().hex   # id deste processo nos jobs que ele roda
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls, images: ImageStorage) -> "JobQueue":
+        hosts = {h.strip().lower() for h in os.getenv("JOBS_WEBHOOK_HOSTS", "").split(",") if h.strip()}
+        return cls(
+            TieredCache.from_env("JOBS", table="jobs", max_entries=1024),
+            images,
+            workers=int(os.getenv("JOBS_WORKERS", "4")),
+            max_queue=int(os.getenv("JOBS_MAX_QUEUE", "100")),
+            webhook_hosts=hosts or None,
+            webhook_secret=os.getenv("JOBS_WEBHOOK_SECRET", ""),
+        )
+
+    # -- API -----------------------------------------------------------------
+
+    async def _public_address(self, host: str, port: int) -> str:
+        """Resolve o host; 400 se algum endereço não for público. Devolve o primeiro."""
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except (OSError, ValueError):
+            raise HTTPException(400, f"webhook_url: host {host} não resolve.")
+        addresses = []
+        for *_, sockaddr in infos:
+            ip = ipaddress.ip_address(sockaddr[0].split("%", 1)[0])
+            ip = getattr(ip, "ipv4_mapped", None) or ip
+            if not ip.is_global:
+                raise HTTPException(400, f"webhook_url: {host} aponta para endereço não público.")
+            addresses.append(str(ip))
+        if not addresses:
+            raise HTTPException(400, f"webhook_url: host {host} não resolve.")
+        return addresses[0]
+
+    async def _webhook_target(self, url: str) -> tuple[str, str | None]:
+        """(URL validada, IP público para conectar). IP None = host da allowlist."""
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise HTTPException(400, "webhook_url deve ser uma URL http(s).")
+        host = parsed.hostname.lower()
+        if self.webhook_hosts is not None:
+            if host not in self.webhook_hosts:
+                raise HTTPException(400, f"webhook_url: host {parsed.hostname} não permitido (JOBS_WEBHOOK_HOSTS).")
+            return url, None
+        try:
+            port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        except ValueError:
+            raise HTTPException(400, "webhook_url com porta inválida.")
+        return url, await self._public_address(host, port)
+
+    async def check_webhook(self, url: str | None) -> str | None:
+        """400 para URL inválida ou (sem JOBS_WEBHOOK_HOSTS) host com endereço não público."""
+        if not url:
+            return None
+        return (await self._webhook_target(url))[0]
+
+    async def submit(self, run: Runner, webhook_url: str | None = None) -> dict:
+        """Enfileira `run(progress)`; 503 se a fila estiver cheia."""
+        webhook_url = await self.check_webhook(webhook_url)
+        queue = self._ensure_workers()
+        if queue.qsize() >= self.max_queue:
+            raise HTTPException(503, "Fila de geração cheia — tente novamente em instantes.",
+                                headers={"Retry-After": "10"})
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "stage": None,
+            "stages": [],
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "result": None,
+            "error": None,
+            "webhook": {"url": webhook_url, "status": None} if webhook_url else None,
+            "_owner": self.owner,
+        }
+        self.store.set(job["id"], job)
+        self._active.add(job["id"])
+        queue.put_nowait((job["id"], run))
+        return _public(job)
+
+    def _read(self, key: str) -> Any | None:
+        """Direto do sqlite quando há um: outro worker pode ter atualizado o valor."""
+        if self.store.disk is not None:
+            return self.store.disk.get(key)
+        return self.store.get(key)
+
+    def _owner_alive(self, owner: str | None) -> bool:
+        if owner == self.owner:
+            return True
+        beat = self._read(f"_owner:{owner}") if owner else None
+        return beat is not None and time.time() - beat["seen"] < OWNER_TIMEOUT
+
+    def get(self, job_id: str) -> dict | None:
+        job = self.store.get(job_id)
+        if job is not None and job.get("_owner") != self.owner:
+            job = self._read(job_id)
+        if job is None or "status" not in job:
+            return None
+        lost = (job_id not in self._active if job.get("_owner") == self.owner
+                else not self._owner_alive(job.get("_owner")))
+        if job["status"] in ACTIVE and lost:
+            # Ficou no sqlite de um processo que não existe mais
+            job = {**job, "status": "failed", "finished": job.get("finished") or time.time(),
+                   "error": {"status": 500, "detail": "Job interrompido por reinício do servidor."}}
+            self.store.set(job_id, job)
+        if job["status"] == "queued":
+            job = {**job, "position": self._position(job_id)}
+        if job.get("result") is not None:
+            result = self.images.unpack(job["result"])
+            if result is None:
+                job = {**job, "result": None,
+                       "error": {"status": 410, "detail": "A imagem do resultado expirou — gere novamente."}}
+            else:
+                job = {**job, "result": result}
+        return _public(job)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": self.running,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def prometheus(self) -> list[tuple[str, str, dict[str, str], float]]:
+        """Para metrics.collector: profundidade da fila e jobs em andamento/concluídos."""
+        s = self.stats()
+        return [
+            ("thumb_jobs_queued", "gauge", {}, s["queued"]),
+            ("thumb_jobs_running", "gauge", {}, s["running"]),
+            ("thumb_jobs_finished_total", "counter", {"status": "succeeded"}, s["completed"]),
+            ("thumb_jobs_finished_total", "counter", {"status": "failed"}, s["failed"]),
+        ]
+
+    # -- Workers -------------------------------------------------------------
+
+    def _ensure_workers(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Primeiro uso (ou novo loop, p.ex. em testes): fila e workers nascem aqui
+            self._loop, self._queue, self._tasks = loop, asyncio.Queue(), []
+        if len(self._tasks) < self.workers + 1 or any(t.done() for t in self._tasks):
+            alive = [t for t in self._tasks if not t.done()]
+            if not any(t.get_name() == "jobs-heartbeat" for t in alive):
+                alive.append(contextvars.Context().run(asyncio.create_task, self._heartbeat(),
+                                                       name="jobs-heartbeat"))
+            for _ in range(self.workers + 1 - len(alive)):
+                # Contexto vazio: o worker não herda os timings da requisição que o criou
+                alive.append(contextvars.Context().run(asyncio.create_task, self._worker(self._queue)))
+            self._tasks = alive
+        return self._queue
+
+    async def _heartbeat(self) -> None:
+        """Marca este processo como vivo para os outros workers que leem o mesmo JOBS_DB."""
+        while True:
+            self.store.set(f"_owner:{self.owner}", {"seen": time.time()})
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    def _position(self, job_id: str) -> int | None:
+        pending = [item[0] for item in list(self._queue._queue)] if self._queue else []
+        return pending.index(job_id) + 1 if job_id in pending else None
+
+    def _update(self, job_id: str, **changes: Any) -> dict:
+        job = {**(self.store.get(job_id) or {"id": job_id}), **changes}
+        self.store.set(job_id, job)
+        return job
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            job_id, run = await queue.get()
+            self.running += 1
+            job = self._update(job_id, status="running", started=time.time())
+            stages: list[str] = list(job.get("stages") or [])
+
+            def progress(stage: str) -> None:
+                stages.append(stage)
+                self._update(job_id, stage=stage, stages=list(stages))
+
+            try:
+                result = await run(progress)
+                job = {**self._update(job_id, status="succeeded", result=self.images.pack(result),
+                                      finished=time.time()), "result": result}
+                self.completed += 1
+            except HTTPException as exc:
+                job = self._update(job_id, status="failed", finished=time.time(),
+                                   error={"status": exc.status_code, "detail": exc.detail})
+                self.failed += 1
+            except Exception as exc:
+                job = self._update(job_id, status="failed", finished=time.time(),
+                                   error={"status": 500, "detail": str(exc) or type(exc).__name__})
+                self.failed += 1
+            finally:
+                self.running -= 1
+                self._active.discard(job_id)
+                queue.task_done()
+            if job.get("webhook"):
+                try:
+                    await self._notify(job)
+                except Exception as exc:
+                    # Nada da entrega pode derrubar o worker
+                    log.exception("entrega do webhook do job %s falhou", job_id)
+                    self._update(job_id, webhook={**job["webhook"], "status": f"error: {type(exc).__name__}"})
+
+    async def _notify(self, job: dict) -> None:
+        body = json.dumps(_public({k: v for k, v in job.items() if k != "webhook"}),
+                          ensure_ascii=False).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.webhook_secret:
+            digest = hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Thumb-Signature"] = f"sha256={digest}"
+        status: int | str = "error"
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            for attempt in range(WEBHOOK_ATTEMPTS):
+                try:
+                    # Revalida a cada tentativa e conecta no IP checado: sem janela para rebinding
+                    url, address = await self._webhook_target(job["webhook"]["url"])
+                    request = client.build_request("POST", url, content=body, headers=headers)
+                    if address is not None:
+                        request.url = request.url.copy_with(host=address)
+                        request.extensions["sni_hostname"] = urlparse(url).hostname
+                    resp = await client.send(request)
+                    status = resp.status_code
+                    if resp.status_code < 500:
+                        break
+                except HTTPException as exc:
+                    status = f"error: {exc.detail}"
+                    break
+                except Exception as exc:
+                    log.warning("webhook do job %s falhou: %r", job["id"], exc)
+                    status = f"error: {type(exc).__name__}"
+                if attempt < WEBHOOK_ATTEMPTS - 1:
+                    await asyncio.sleep(2 ** attempt)
+        self._update(job["id"], webhook={**job["webhook"], "status": status})
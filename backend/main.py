@@ -1,19 +1,41 @@
 """
 Backend — Gerador de Thumb v0.4
 FastAPI: análise de referência → geração Gemini → extração de elementos editáveis.
-Imagens retornadas como base64 data URLs (compatível com Vercel serverless).
+Imagens gravadas por hash e servidas em /api/images/{hash} (IMAGE_STORAGE=dataurl mantém data URLs).
 """
 
-import base64
-import json
+import asyncio
+import logging
 import os
-import re
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
 from pathlib import Path
 
-import httpx
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import Body, Depends, FastAPI, File, Form, Header, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+import cache
+import catalog
+import engines
+import fonts
+import gemini
+import headlines
+import idempotency
+import imaging
+import jobs
+import metrics
+import phash
+import refdesign
+import schemas
+import sse
+import storage
+import textlayout
+import uploads
+from pipeline import Pipeline
+
+log = logging.getLogger(__name__)
 
 load_dotenv()
 
@@ -21,8 +43,26 @@ load_dotenv()
 # App setup
 # ---------------------------------------------------------------------------
 
-app = FastAPI(title="Gerador de Thumb API", version="0.4.0")
+@asynccontextmanager
+async def _lifespan(app):
+    """Pool HTTP do Gemini, scan das fontes e pré-aquecimento das headlines (HEADLINES_PREWARM)."""
+    async with gemini.lifespan(app):
+        # O registro de fontes percorre as pastas do sistema: fora do event loop
+        await imaging.run(fonts.registry().scan)
+        if textlayout.mode() == "auto" and not await imaging.run(textlayout.ocr_available):
+            log.warning("OCR local indisponível (pytesseract/tesseract/idioma %s): cada geração "
+                        "fará uma transcrição extra no Gemini", os.getenv("TEXT_OCR_LANG", "por"))
+        warm = asyncio.create_task(_prewarm_headlines())
+        try:
+            yield
+        finally:
+            warm.cancel()
+
 
+app = FastAPI(title="Gerador de Thumb API", version="0.4.0", lifespan=_lifespan)
+
+# Antes do CORS: o último adicionado fica por fora, e o 413 precisa dos headers CORS
+app.add_middleware(uploads.BodyLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -30,6 +70,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.ServerTimingMiddleware)
 
 BASE_DIR = Path(__file__).parent
 
@@ -37,8 +78,7 @@ BASE_DIR = Path(__file__).parent
 # Data
 # ---------------------------------------------------------------------------
 
-with open(BASE_DIR / "data" / "templates.json", "r", encoding="utf-8") as f:
-    CATEGORIES = json.load(f)["categories"]
+CATALOG = catalog.TemplateCatalog.load(BASE_DIR / "data" / "templates.json")
 
 OBJECTIVE_CONTEXT: dict[str, str] = {
     "dinheiro":      "Resultado financeiro expressivo. Transmite riqueza, conquista e prova social. Usa números grandes, cifrão em destaque, expressão de surpresa ou orgulho.",
@@ -52,7 +92,7 @@ OBJECTIVE_CONTEXT: dict[str, str] = {
 }
 
 # ---------------------------------------------------------------------------
-# Gemini helpers
+# Motores (Gemini ou stub local)
 # ---------------------------------------------------------------------------
 
 def _api_key() -> str:
@@ -67,77 +107,97 @@ def _gen_model() -> str:
 VISION_MODEL = "gemini-2.5-flash"
 
 
-async def _vision_call(api_key: str, prompt: str, image_bytes: bytes, mime: str) -> str:
-    """Chama Gemini Vision (texto) e retorna a resposta textual."""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{VISION_MODEL}:generateContent?key={api_key}"
-    payload = {
-        "contents": [{
-            "parts": [
-                {"text": prompt},
-                {"inline_data": {"mime_type": mime, "data": base64.b64encode(image_bytes).decode()}},
-            ]
-        }],
-        "generationConfig": {"temperature": 0.1},
-    }
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(url, json=payload)
-        resp.raise_for_status()
-        data = resp.json()
-
-    for candidate in data.get("candidates", []):
-        for part in candidate.get("content", {}).get("parts", []):
-            if "text" in part:
-                return part["text"]
-    return ""
+def _engine(name: str | None = None) -> engines.Engine:
+    """Motor da requisição (campo `engine`) ou de GENERATION_ENGINE."""
+    if engines.engine_name(name) == "stub":
+        return engines.stub_engine()
+    return engines.gemini_engine(_api_key(), VISION_MODEL, _gen_model())
 
 
 # ---------------------------------------------------------------------------
 # Step 1 — Analyze reference thumbnail (design system)
 # ---------------------------------------------------------------------------
 
-async def _analyze_reference(api_key: str, ref_bytes: bytes, ref_mime: str) -> dict:
-    """Extrai o design system da thumbnail de referência via Gemini Vision."""
-    prompt = """Você é um especialista em design de thumbnails virais para YouTube.
-
-Analise esta thumbnail de referência e extraia o sistema visual completo.
-Retorne APENAS JSON válido, sem markdown, sem explicações adicionais.
-
-{
-  "typography": {
-    "headline_font": "família da fonte principal (ex: Impact, Arial Black, Bebas Neue)",
-    "headline_weight": "bold ou normal",
-    "text_case": "UPPERCASE ou Mixed Case",
-    "has_stroke": true ou false,
-    "stroke_thickness": "thin/medium/thick",
-    "text_colors": ["#hex1", "#hex2"],
-    "stroke_colors": ["#hex"],
-    "line_count": número de linhas de texto visíveis,
-    "text_shadow": true ou false
-  },
-  "layout": {
-    "person_position": "left/right/center/fullwidth",
-    "person_crop": "full-body/torso-up/face-close",
-    "person_size": "small/medium/large/dominant",
-    "text_zone": "left/right/top/bottom/center-overlay",
-    "composition_type": "person-left-text-right/person-right-text-left/person-center-text-overlay/split"
-  },
-  "colors": {
-    "background_main": "#hex ou descrição",
-    "background_type": "solid/gradient/scene",
-    "accent_1": "#hex",
-    "accent_2": "#hex"
-  },
-  "atmosphere": "Descreva em 2-3 frases o clima visual: contraste, intensidade, tipo de impacto emocional que a thumbnail provoca."
-}"""
-
-    text = await _vision_call(api_key, prompt, ref_bytes, ref_mime)
-    match = re.search(r'\{[\s\S]*\}', text)
-    if match:
+_REF_PROMPT = """Você é um especialista em design de thumbnails virais para YouTube.
+Extraia o sistema visual desta thumbnail de referência: tipografia, layout, cores e atmosfera."""
+
+# Versão do prompt entra na chave do cache: editar o prompt invalida as análises antigas
+_REF_PROMPT_VERSION = cache.digest(_REF_PROMPT)[:12]
+
+REF_CACHE = cache.TieredCache.from_env("REF_CACHE", table="ref_analysis")
+
+# pHash da referência → chave de uma análise já feita para uma imagem equivalente
+REF_INDEX = phash.PerceptualIndex.from_env("REF_CACHE", table="ref_phash")
+
+# Imagens servidas por /api/images/{hash}; IMAGE_STORAGE=dataurl volta ao base64 inline
+IMAGES = storage.ImageStorage.from_env(default_mode="local")
+
+# Fila do modo assíncrono (/api/jobs)
+JOBS = jobs.JobQueue.from_env(IMAGES)
+
+# Respostas de /api/generate por Idempotency-Key
+IDEMPOTENCY = idempotency.IdempotencyStore.from_env(IMAGES)
+
+# Lotes de headlines por (tema, categoria) normalizados
+HEADLINES = headlines.HeadlineService(
+    cache.TieredCache.from_env("HEADLINES_CACHE", table="headlines", max_entries=1024, ttl=7 * 86400),
+    OBJECTIVE_CONTEXT,
+)
+
+
+async def _vision_as(engine: engines.Engine, model: type[schemas.LenientModel], prompt: str,
+                     image_bytes: bytes, mime: str) -> dict:
+    """Gemini Vision com resposta estruturada no schema de `model` ({} se não validar)."""
+    text = await engine.vision.describe(prompt, image_bytes, mime, schemas.response_schema(model))
+    parsed = schemas.parse(model, text)
+    return parsed.model_dump() if parsed is not None else {}
+
+
+async def _analyze_reference(engine: engines.Engine, ref_bytes: bytes, ref_mime: str) -> dict:
+    """Extrai o design system da thumbnail de referência. Cores, texto e layout são
+    medidos localmente (refdesign); o Gemini Vision só completa fonte, corte da
+    pessoa e atmosfera. REF_ANALYSIS_MODE=remote volta ao prompt completo."""
+    mode = refdesign.mode()
+    key = cache.digest(ref_bytes, engine.vision.name, _REF_PROMPT_VERSION, mode, refdesign.VERSION)
+    cached = REF_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    # Mesma thumbnail recomprimida/redimensionada/screenshot: reaproveita a análise
+    namespace = cache.digest(engine.vision.name, _REF_PROMPT_VERSION, mode, refdesign.VERSION)
+    with metrics.stage("ref_phash"):
+        fingerprint = await imaging.run(phash.phash, ref_bytes)
+        similar = REF_INDEX.lookup(fingerprint, namespace)
+    if similar is not None:
+        cached = REF_CACHE.get(similar)
+        if cached is not None:
+            REF_CACHE.set(key, cached)
+            return cached
+        REF_INDEX.discard(namespace, similar)
+
+    measured = None
+    if mode != "remote":
         try:
-            return json.loads(match.group())
+            with metrics.stage("ref_local"):
+                measured = await imaging.run(refdesign.measure, ref_bytes)
         except Exception:
-            pass
-    return {}
+            pass  # imagem ilegível para o Pillow — o Gemini decide
+
+    if measured is None:
+        analysis = await _vision_as(engine, schemas.RefAnalysis, _REF_PROMPT, ref_bytes, ref_mime)
+        complete = bool(analysis)
+    elif mode == "local":
+        analysis, complete = measured, True
+    else:
+        preview, preview_mime = await imaging.run(refdesign.preview, ref_bytes, ref_mime)
+        style = await _vision_as(engine, schemas.RefStyle, refdesign.STYLE_PROMPT, preview, preview_mime)
+        analysis, complete = refdesign.merge(measured, style), bool(style)
+
+    # Só cacheia análises completas — falhas voltam a consultar o Gemini
+    if complete:
+        REF_CACHE.set(key, analysis)
+        REF_INDEX.add(fingerprint, namespace, key)
+    return analysis
 
 
 # ---------------------------------------------------------------------------
@@ -149,10 +209,8 @@ def _build_prompt(objective: str, user_prompt: str, ref_analysis: dict) -> str:
 
     ref_section = ""
     if ref_analysis:
-        t = ref_analysis.get("typography", {})
-        l = ref_analysis.get("layout", {})
-        c = ref_analysis.get("colors", {})
-        atm = ref_analysis.get("atmosphere", "")
+        a = schemas.RefAnalysis.coerce(ref_analysis)
+        t, l, c = a.typography, a.layout, a.colors
 
         ref_section = f"""
 ═══════════════════════════════════════════
@@ -160,27 +218,27 @@ DESIGN SYSTEM DA REFERÊNCIA — SIGA RIGOROSAMENTE:
 ═══════════════════════════════════════════
 
 TIPOGRAFIA:
-- Fonte principal: {t.get('headline_font', 'Impact')}
-- Peso: {t.get('headline_weight', 'bold')} | Caixa: {t.get('text_case', 'UPPERCASE')}
-- Contorno no texto: {"SIM" if t.get('has_stroke') else "NÃO"}, espessura: {t.get('stroke_thickness', 'medium')}
-- Cores do texto: {', '.join(t.get('text_colors', ['#FFFFFF']))}
-- Cores do contorno: {', '.join(t.get('stroke_colors', ['#000000']))}
-- Linhas de texto: {t.get('line_count', 2)}
-- Sombra no texto: {"SIM" if t.get('text_shadow') else "NÃO"}
+- Fonte principal: {t.headline_font}
+- Peso: {t.headline_weight} | Caixa: {t.text_case}
+- Contorno no texto: {"SIM" if t.has_stroke else "NÃO"}, espessura: {t.stroke_thickness}
+- Cores do texto: {', '.join(t.text_colors)}
+- Cores do contorno: {', '.join(t.stroke_colors)}
+- Linhas de texto: {t.line_count}
+- Sombra no texto: {"SIM" if t.text_shadow else "NÃO"}
 
 LAYOUT E COMPOSIÇÃO:
-- Tipo de composição: {l.get('composition_type', 'person-right-text-left')}
-- Posição da pessoa: {l.get('person_position', 'right')}
-- Corte da pessoa: {l.get('person_crop', 'torso-up')}
-- Tamanho da pessoa: {l.get('person_size', 'large')}
-- Zona do texto: {l.get('text_zone', 'left')}
+- Tipo de composição: {l.composition_type}
+- Posição da pessoa: {l.person_position}
+- Corte da pessoa: {l.person_crop}
+- Tamanho da pessoa: {l.person_size}
+- Zona do texto: {l.text_zone}
 
 CORES:
-- Fundo: {c.get('background_main', '#0D0D1A')} ({c.get('background_type', 'solid')})
-- Destaque 1: {c.get('accent_1', '#FFD700')}
-- Destaque 2: {c.get('accent_2', '#FFFFFF')}
+- Fundo: {c.background_main} ({c.background_type})
+- Destaque 1: {c.accent_1}
+- Destaque 2: {c.accent_2}
 
-ATMOSFERA: {atm}
+ATMOSFERA: {a.atmosphere}
 ═══════════════════════════════════════════
 """
 
@@ -204,96 +262,135 @@ Gere apenas a imagem final da thumbnail. Nenhum texto explicativo."""
 
 
 # ---------------------------------------------------------------------------
-# Step 3 — Generate image
+# Step 3 — Extract editable elements from generated image
 # ---------------------------------------------------------------------------
 
-async def _generate_image(api_key: str, prompt: str,
-                           person_bytes: bytes, person_mime: str,
-                           ref_bytes: bytes | None, ref_mime: str | None) -> bytes:
-    model = _gen_model()
-    url = (f"https://generativelanguage.googleapis.com/v1beta/models/"
-           f"{model}:generateContent?key={api_key}")
-
-    parts: list[dict] = [
-        {"text": prompt},
-        {"inline_data": {"mime_type": person_mime, "data": base64.b64encode(person_bytes).decode()}},
+_ELEMENTS_PROMPT = """Liste cada linha de texto visível nesta thumbnail (1280x720 px), de cima para baixo.
+Coordenadas exatas em pixels: elas posicionam objetos editáveis sobre a imagem."""
+
+_TRANSCRIBE_PROMPT = """Esta imagem tem {n} faixas horizontais empilhadas, cada uma com uma linha de texto.
+Transcreva o texto de cada faixa exatamente como aparece, de cima para baixo."""
+
+
+async def _extract_elements_remote(engine: engines.Engine, image_bytes: bytes) -> list[dict]:
+    """Extração completa via Gemini Vision (texto + geometria aproximada)."""
+    schema = schemas.response_schema(list[schemas.TextElement])
+    text = await engine.vision.describe(_ELEMENTS_PROMPT, image_bytes, "image/jpeg", schema)
+    elements = schemas.parse(list[schemas.TextElement], text) or []
+    return [
+        {
+            **el.model_dump(),
+            "id": el.id or f"text_{i}",
+            "y": el.y if el.y is not None else 100.0 + i * 120,
+            "stroke": el.stroke or None,
+        }
+        for i, el in enumerate(elements)
     ]
-    if ref_bytes and ref_mime:
-        parts.append({"inline_data": {"mime_type": ref_mime, "data": base64.b64encode(ref_bytes).decode()}})
 
-    payload = {
-        "contents": [{"parts": parts}],
-        "generationConfig": {"responseModalities": ["IMAGE", "TEXT"]},
-    }
 
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        resp = await client.post(url, json=payload)
-        if resp.status_code != 200:
-            raise HTTPException(502, f"Gemini erro: {resp.text[:400]}")
-        data = resp.json()
+async def _transcribe_lines(engine: engines.Engine, local: textlayout.LocalResult) -> bool:
+    """Lê o texto das linhas detectadas localmente numa chamada curta (só os recortes)."""
+    n = len(local.lines)
+    strip = await imaging.run(textlayout.strip, local)
+    text = await engine.vision.describe(_TRANSCRIBE_PROMPT.format(n=n), strip, "image/jpeg",
+                                        schemas.response_schema(list[str]))
+    texts = schemas.parse(list[str], text)
+    if texts is None or len(texts) != n:
+        return False
+    for line, value in zip(local.lines, texts):
+        line.text = value.strip()
+    return True
+
 
-    for candidate in data.get("candidates", []):
-        for part in candidate.get("content", {}).get("parts", []):
-            img_data = part.get("inlineData") or part.get("inline_data")
-            if img_data:
-                return base64.b64decode(img_data["data"])
+async def _extract_elements(engine: engines.Engine, image_bytes: bytes) -> list[dict]:
+    """Analisa a imagem gerada e extrai elementos de texto como objetos Fabric.js.
 
-    finish = data.get("candidates", [{}])[0].get("finishReason", "N/A")
-    raise HTTPException(502, f"Gemini não retornou imagem. finishReason={finish}")
+    A geometria e as cores vêm da análise local (textlayout). O Gemini Vision só
+    faz a extração completa quando a confiança local fica abaixo de
+    TEXT_LOCAL_MIN_CONFIDENCE; mesmo assim as coordenadas são ajustadas às medidas locais.
+    """
+    mode = textlayout.mode()
+    if mode == "remote":
+        return await _extract_elements_remote(engine, image_bytes)
+
+    try:
+        with metrics.stage("text_local"):
+            local = await imaging.run(textlayout.analyze, image_bytes)
+    except Exception:
+        local = None  # imagem ilegível para o Pillow — o Gemini decide
+
+    if local is not None and (mode == "local" or local.confidence >= textlayout.min_confidence()):
+        if local.lines and not local.transcribed and mode != "local":
+            if not await _transcribe_lines(engine, local):
+                return textlayout.snap(await _extract_elements_remote(engine, image_bytes), local)
+        return local.elements()
+
+    return textlayout.snap(await _extract_elements_remote(engine, image_bytes), local)
 
 
 # ---------------------------------------------------------------------------
-# Step 4 — Extract editable elements from generated image
+# Pipeline: referência → prompt → imagem → elementos editáveis
 # ---------------------------------------------------------------------------
 
-async def _extract_elements(api_key: str, image_bytes: bytes) -> list[dict]:
-    """Analisa a imagem gerada e extrai elementos de texto como objetos Fabric.js."""
-    prompt = """Analise esta thumbnail (1280x720 pixels) e identifique TODOS os textos visíveis.
-
-Para cada texto, retorne coordenadas EXATAS em pixels no espaço 1280x720.
-Retorne APENAS um array JSON válido, sem markdown ou explicações.
-
-Formato de cada elemento:
-{
-  "id": "elemento_N",
-  "text": "texto exato como aparece na imagem",
-  "x": posição X do início do texto (pixels, 0-1280),
-  "y": posição Y do topo do texto (pixels, 0-720),
-  "fontSize": tamanho da fonte em pixels (ex: 120 para texto grande),
-  "fontFamily": "Impact",
-  "fill": "#RRGGBB cor do texto",
-  "stroke": "#RRGGBB cor do contorno ou null se não houver",
-  "strokeWidth": espessura do contorno em pixels (0 se sem contorno),
-  "fontWeight": "normal ou bold"
-}
+@dataclass
+class GenerateInputs:
+    """Entradas resolvidas de uma geração (uploads já lidos ou recuperados por id)."""
+    objective: str
+    prompt: str
+    person_bytes: bytes
+    person_mime: str
+    ref_bytes: bytes | None = None
+    ref_mime: str | None = None
+    engine: str | None = None          # gemini · stub (padrão: GENERATION_ENGINE)
 
-Identifique cada linha de texto separadamente.
-Seja preciso — as coordenadas posicionam objetos editáveis sobre a imagem.
-Se não houver texto, retorne []."""
 
-    text = await _vision_call(api_key, prompt, image_bytes, "image/jpeg")
-    match = re.search(r'\[[\s\S]*\]', text)
-    if match:
-        try:
-            elements = json.loads(match.group())
-            clean = []
-            for i, el in enumerate(elements):
-                clean.append({
-                    "id": el.get("id", f"text_{i}"),
-                    "text": str(el.get("text", "")),
-                    "x": float(el.get("x", 60)),
-                    "y": float(el.get("y", 100 + i * 120)),
-                    "fontSize": float(el.get("fontSize", 80)),
-                    "fontFamily": str(el.get("fontFamily", "Impact")),
-                    "fill": str(el.get("fill", "#FFFFFF")),
-                    "stroke": el.get("stroke") or None,
-                    "strokeWidth": float(el.get("strokeWidth", 0)),
-                    "fontWeight": str(el.get("fontWeight", "normal")),
-                })
-            return clean
-        except Exception:
-            pass
-    return []
+async def _normalize_inputs(inp: GenerateInputs) -> GenerateInputs:
+    """Normaliza (EXIF, tamanho, metadados, recodificação) as imagens em paralelo."""
+    (person_bytes, person_mime), (ref_bytes, ref_mime) = await asyncio.gather(
+        imaging.normalize(inp.person_bytes, inp.person_mime),
+        imaging.normalize(inp.ref_bytes, inp.ref_mime),
+    )
+    return replace(inp, person_bytes=person_bytes, person_mime=person_mime,
+                   ref_bytes=ref_bytes, ref_mime=ref_mime)
+
+
+def _build_pipeline(engine: engines.Engine, inp: GenerateInputs) -> Pipeline:
+    async def normalized() -> GenerateInputs:
+        return await _normalize_inputs(inp)
+
+    async def ref_analysis(normalized: GenerateInputs) -> dict:
+        if normalized.ref_bytes and normalized.ref_mime:
+            return await _analyze_reference(engine, normalized.ref_bytes, normalized.ref_mime)
+        return {}
+
+    async def prompt_built(ref_analysis: dict) -> str:
+        return _build_prompt(inp.objective, inp.prompt, ref_analysis)
+
+    async def image(prompt_built: str, normalized: GenerateInputs) -> bytes:
+        n = normalized
+        reference = (n.ref_bytes, n.ref_mime) if n.ref_bytes and n.ref_mime else None
+        return await engine.image.generate(prompt_built, (n.person_bytes, n.person_mime), reference)
+
+    async def text_elements(image: bytes) -> list[dict]:
+        return await _extract_elements(engine, image)
+
+    return (
+        Pipeline()
+        .stage("normalized", normalized)
+        .stage("ref_analysis", ref_analysis, "normalized")
+        .stage("prompt_built", prompt_built, "ref_analysis")
+        .stage("image", image, "prompt_built", "normalized")
+        .stage("text_elements", text_elements, "image")
+    )
+
+
+async def _publish(image_bytes: bytes) -> str:
+    with metrics.stage("publish"):
+        return await IMAGES.publish(image_bytes)
+
+
+async def _image_event(image_bytes: bytes) -> dict:
+    return {"url": await _publish(image_bytes)}
 
 
 # ---------------------------------------------------------------------------
@@ -301,63 +398,214 @@ Se não houver texto, retorne []."""
 # ---------------------------------------------------------------------------
 
 @app.get("/api/categories")
-def get_categories():
-    return CATEGORIES
+def get_categories(request: Request):
+    return CATALOG.categories_response(request)
+
+
+@app.get("/api/templates/{category}")
+def get_templates(category: str, request: Request):
+    return CATALOG.templates_response(category, request)
 
 
 @app.post("/api/upload")
 async def upload_image(file: UploadFile = File(...)):
-    """Retorna a imagem como base64 data URL (sem escrita em disco)."""
-    content = await file.read()
-    mime = file.content_type or "image/jpeg"
-    b64 = base64.b64encode(content).decode()
-    return {"url": f"data:{mime};base64,{b64}"}
+    """Grava a imagem no storage e retorna sua URL (ou data URL no modo serverless)
+    e um `id` (hash do conteúdo) aceito por /api/generate no lugar do arquivo."""
+    content, mime = await uploads.read(file)
+    image_id = await IMAGES.remember(content, mime)
+    return {"id": image_id, "url": IMAGES.url(image_id, content, mime)}
 
 
-@app.post("/api/generate")
-async def generate_thumbnail(
+@app.get("/api/images/{image_hash}")
+async def get_image(image_hash: str, request: Request):
+    return await IMAGES.response(image_hash, request)
+
+
+async def _read_upload(file: UploadFile | None, image_id: str | None) -> tuple[bytes | None, str | None]:
+    """Arquivo enviado no multipart ou handle (`*_id`) devolvido por /api/upload."""
+    if file and file.filename:
+        return await uploads.read(file)
+    if image_id:
+        blob = await IMAGES.load(image_id)
+        if blob is None:
+            raise HTTPException(404, f"Upload {image_id[:12]}… não encontrado — envie a imagem novamente.")
+        return blob
+    return None, None
+
+
+async def _generate_inputs(
     objective: str = Form(...),
     prompt: str = Form(...),
-    person_image: UploadFile = File(...),
+    person_image: UploadFile = File(None),
+    person_image_id: str = Form(None),
     reference_image: UploadFile = File(None),
-):
-    api_key = _api_key()
+    reference_image_id: str = Form(None),
+    engine: str = Form(None),
+) -> GenerateInputs:
+    """Dependência compartilhada pelas rotas de geração: lê uploads ou resolve ids."""
+    person_bytes, person_mime = await _read_upload(person_image, person_image_id)
+    if not person_bytes:
+        raise HTTPException(400, "Envie person_image ou person_image_id.")
+    ref_bytes, ref_mime = await _read_upload(reference_image, reference_image_id)
 
-    person_bytes = await person_image.read()
-    person_mime = person_image.content_type or "image/jpeg"
+    return GenerateInputs(objective, prompt, person_bytes, person_mime, ref_bytes, ref_mime, engine)
 
-    ref_bytes: bytes | None = None
-    ref_mime: str | None = None
-    if reference_image and reference_image.filename:
-        ref_bytes = await reference_image.read()
-        ref_mime = reference_image.content_type or "image/jpeg"
 
-    # ── 1. Analisa o design system da referência ──────────────────
-    ref_analysis: dict = {}
-    if ref_bytes and ref_mime:
-        ref_analysis = await _analyze_reference(api_key, ref_bytes, ref_mime)
+@app.post("/api/generate")
+async def generate_thumbnail(
+    response: Response,
+    inputs: GenerateInputs = Depends(_generate_inputs),
+    idempotency_key: str | None = Header(None, alias=idempotency.HEADER),
+):
+    """Com Idempotency-Key, reenvios devolvem a resposta guardada (ou aguardam a em andamento)."""
+    async def run() -> dict:
+        # ── 1. Analisa a referência  2. Monta o prompt  3. Gera a thumbnail
+        # ── 4. Extrai elementos de texto editáveis da imagem gerada
+        results = await _build_pipeline(_engine(inputs.engine), inputs).run()
+        return {
+            "url": await _publish(results["image"]),
+            "elements": results["text_elements"],
+            "ref_analysis": results["ref_analysis"],
+        }
+
+    if idempotency_key is None:
+        return await run()
+    body, replayed = await IDEMPOTENCY.run(idempotency_key, idempotency.fingerprint(inputs), run)
+    if replayed:
+        response.headers[idempotency.REPLAYED_HEADER] = "true"
+    return body
+
+
+@app.post("/api/generate/stream")
+async def generate_thumbnail_stream(inputs: GenerateInputs = Depends(_generate_inputs)):
+    """Versão SSE de /api/generate: um evento por estágio concluído."""
+    pipeline = _build_pipeline(_engine(inputs.engine), inputs)
+    return sse.sse_response(sse.stream_pipeline(pipeline, {
+        "ref_analysis":  lambda analysis: analysis,
+        "prompt_built":  lambda full_prompt: {"prompt": full_prompt},
+        "image":         _image_event,
+        "text_elements": lambda elements: {"elements": elements},
+    }))
+
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(
+    inputs: GenerateInputs = Depends(_generate_inputs),
+    webhook_url: str = Form(None),
+):
+    """Modo assíncrono de /api/generate: devolve o id do job na hora.
+    Acompanhe em GET /api/jobs/{id}; com `webhook_url`, o job concluído é enviado por POST."""
+    engine = _engine(inputs.engine)
+
+    async def run(progress: jobs.Progress) -> dict:
+        results = await _build_pipeline(engine, inputs).run(on_done=lambda name, _: progress(name))
+        return {
+            "url": await _publish(results["image"]),
+            "elements": results["text_elements"],
+            "ref_analysis": results["ref_analysis"],
+        }
+
+    job = await JOBS.submit(run, webhook_url)
+    return {**job, "status_url": f"/api/jobs/{job['id']}"}
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job não encontrado.")
+    return job
+
+
+@app.get("/api/jobs")
+def jobs_stats():
+    """Profundidade da fila e workers ocupados."""
+    return JOBS.stats()
+
+
+async def _prewarm_headlines() -> None:
+    topics = headlines.prewarm_topics()
+    if not topics:
+        return
+    try:
+        engine = _engine()
+    except HTTPException:  # sem GOOGLE_API_KEY: nada a aquecer
+        return
+    await HEADLINES.prewarm(engine, topics)
+
+
+@app.post("/api/headlines")
+async def get_headlines(
+    topic: str = Body(...),
+    category: str = Body("dinheiro"),
+    count: int = Body(headlines.DEFAULT_COUNT),
+    engine: str = Body(None),
+):
+    """Lote ranqueado de headlines para {topic, category}; acertos vêm do cache."""
+    items, cached = await HEADLINES.generate(_engine(engine), topic, category, count)
+    return {"headlines": items, "cached": cached}
 
-    # ── 2. Monta prompt enriquecido ───────────────────────────────
-    full_prompt = _build_prompt(objective, prompt, ref_analysis)
 
-    # ── 3. Gera a thumbnail ───────────────────────────────────────
-    image_bytes = await _generate_image(
-        api_key, full_prompt, person_bytes, person_mime, ref_bytes, ref_mime
-    )
+@app.post("/api/headlines/stream")
+async def stream_headlines(
+    topic: str = Body(...),
+    category: str = Body("dinheiro"),
+    count: int = Body(headlines.DEFAULT_COUNT),
+    engine: str = Body(None),
+):
+    """Versão SSE de /api/headlines: um evento `headline` por linha escrita pelo modelo."""
+    resolved = _engine(engine)
+    return sse.sse_response(sse.stream_events(
+        lambda emit: HEADLINES.stream(resolved, topic, category, count, emit)
+    ))
+
+
+@metrics.collector
+def _cache_metrics() -> list[tuple[str, str, dict[str, str], float]]:
+    samples = []
+    for name, stats in (("ref_analysis", REF_CACHE.stats()), ("headlines", HEADLINES.stats()),
+                        ("idempotency", IDEMPOTENCY.stats())):
+        labels = {"cache": name}
+        samples += [
+            ("thumb_cache_hits_total", "counter", labels, stats["hits"]),
+            ("thumb_cache_disk_hits_total", "counter", labels, stats["disk_hits"]),
+            ("thumb_cache_misses_total", "counter", labels, stats["misses"]),
+            ("thumb_cache_entries", "gauge", labels, stats["entries"]),
+        ]
+    samples.append(("thumb_idempotent_replays_total", "counter", {}, IDEMPOTENCY.replayed))
+    index = REF_INDEX.stats()
+    samples += [
+        ("thumb_ref_phash_hits_total", "counter", {}, index["hits"]),
+        ("thumb_ref_phash_misses_total", "counter", {}, index["misses"]),
+        ("thumb_ref_phash_entries", "gauge", {}, index["entries"]),
+    ]
+    return samples
+
 
-    # ── 4. Retorna como base64 data URL (sem escrita em disco) ────
-    b64 = base64.b64encode(image_bytes).decode()
-    image_url = f"data:image/jpeg;base64,{b64}"
+metrics.collector(JOBS.prometheus)
 
-    # ── 5. Extrai elementos de texto editáveis ────────────────────
-    elements = await _extract_elements(api_key, image_bytes)
 
-    return {"url": image_url, "elements": elements, "ref_analysis": ref_analysis}
+@app.get("/api/metrics")
+def get_metrics():
+    """Métricas no formato texto do Prometheus (estágios, upstream, caches)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/api/health")
 def health():
-    return {"status": "ok", "version": "0.4.0", "model": _gen_model()}
+    return {
+        "status": "ok",
+        "version": "0.4.0",
+        "model": _gen_model(),
+        "engine": engines.engine_name(),
+        "ocr": textlayout.ocr_available(),
+        "ref_cache": REF_CACHE.stats(),
+        "ref_phash": REF_INDEX.stats(),
+        "headlines_cache": HEADLINES.stats(),
+        "gemini": gemini.stats(),
+        "jobs": JOBS.stats(),
+        "idempotency": IDEMPOTENCY.stats(),
+    }
 
 
 if __name__ == "__main__":
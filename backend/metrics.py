@@ -0,0 +1,147 @@
+"""
+Instrumentação por estágio: timers monotônicos, exposição Prometheus e Server-Timing.
+
+`stage(nome)` mede um trecho com time.perf_counter e registra a duração em dois
+lugares: no histograma do processo (/api/metrics) e na lista da requisição
+atual, que o ServerTimingMiddleware devolve no header `Server-Timing`. O custo
+por medição é um lock e algumas somas, então dá para deixar ligado em produção.
+
+Contadores que já existem em outros módulos (chamadas/retries/status/bytes do
+gemini.py, hits dos caches) são lidos só na hora do scrape, via `collector`.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator
+
+# Segundos: cobre desde normalização (ms) até a geração de imagem (dezenas de s)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+_lock = threading.Lock()
+# estágio → [contagem por bucket..., +Inf], soma, contagem
+_stages: dict[str, tuple[list[int], list[float]]] = {}
+_counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+_collectors: list[Callable[[], list[tuple[str, str, dict[str, str], float]]]] = []
+
+_request_timings: ContextVar[list[tuple[str, float]] | None] = ContextVar("request_timings", default=None)
+
+
+def observe(name: str, seconds: float) -> None:
+    """Registra uma duração já medida (histograma + Server-Timing da requisição)."""
+    with _lock:
+        buckets, totals = _stages.setdefault(name, ([0] * (len(BUCKETS) + 1), [0.0, 0.0]))
+        buckets[bisect_left(BUCKETS, seconds)] += 1
+        totals[0] += seconds
+        totals[1] += 1
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Mede o bloco. Falhas também contam; cancelamentos (BaseException) não."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        observe(name, time.perf_counter() - started)
+        raise
+    observe(name, time.perf_counter() - started)
+
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def collector(fn: Callable[[], list[tuple[str, str, dict[str, str], float]]]):
+    """Registra fn() → [(métrica, tipo, labels, valor)], chamada a cada scrape."""
+    _collectors.append(fn)
+    return fn
+
+
+# ---------------------------------------------------------------------------
+# Exposição
+# ---------------------------------------------------------------------------
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict[str, str] | tuple[tuple[str, str], ...]) -> str:
+    items = labels.items() if isinstance(labels, dict) else labels
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def render() -> str:
+    """Formato texto do Prometheus (version 0.0.4)."""
+    lines = [
+        "# HELP thumb_stage_seconds Duração dos estágios do pipeline.",
+        "# TYPE thumb_stage_seconds histogram",
+    ]
+    with _lock:
+        stages = {name: (list(b), list(t)) for name, (b, t) in _stages.items()}
+        counters = dict(_counters)
+    for name, (buckets, (total, count)) in sorted(stages.items()):
+        cumulative = 0
+        for bound, n in zip((*BUCKETS, "+Inf"), buckets):
+            cumulative += n
+            lines.append(f"thumb_stage_seconds_bucket{_labels({'stage': name, 'le': str(bound)})} {cumulative}")
+        lines.append(f"thumb_stage_seconds_sum{_labels({'stage': name})} {total:.6f}")
+        lines.append(f"thumb_stage_seconds_count{_labels({'stage': name})} {int(count)}")
+
+    samples: dict[str, tuple[str, list[str]]] = {}
+    for (name, labels), value in counters.items():
+        samples.setdefault(name, ("counter", []))[1].append(f"{name}{_labels(labels)} {value:g}")
+    for fn in _collectors:
+        for name, kind, labels, value in fn():
+            samples.setdefault(name, (kind, []))[1].append(f"{name}{_labels(labels)} {value:g}")
+    for name, (kind, rows) in sorted(samples.items()):
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(rows)
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(timings: list[tuple[str, float]]) -> str:
+    """Agrega por nome (um estágio pode rodar várias vezes) no formato do header."""
+    totals: dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+class ServerTimingMiddleware:
+    """ASGI: abre a lista de timings da requisição e a publica em `Server-Timing`.
+
+    O header sai com o início da resposta; em respostas SSE ele traz só o que
+    terminou até ali (leitura dos uploads).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings: list[tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and timings:
+                value = server_timing(timings + [("total", time.perf_counter() - started)])
+                message["headers"] = [*message.get("headers", []), (b"server-timing", value.encode()),
+                                      (b"timing-allow-origin", b"*")]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
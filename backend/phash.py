@@ -0,0 +1,282 @@
+"""
+Hash perceptual e índice de vizinhos por distância de Hamming.
+
+A mesma thumbnail de referência chega recomprimida, redimensionada ou como
+screenshot: o sha256 dos bytes muda, o design system não. `phash` reduz a imagem
+a 32x32 em tons de cinza, aplica a DCT 2D (duas multiplicações de matriz em
+NumPy) e compara as 8x8 frequências mais baixas com a mediana → 64 bits que
+quase não mudam com compressão, escala ou pequenas bordas.
+
+O pHash não vê cor: a mesma arte com outra paleta teria o mesmo hash e herdaria
+as cores erradas. Junto vai uma assinatura de cor (RGB médio de cada quadrante);
+um vizinho só vale se nenhum canal diferir mais que COLOR_TOLERANCE.
+
+`PerceptualIndex` é um multi-index hash: os 64 bits viram 4 blocos de 16, cada
+um com sua tabela. Pelo princípio da casa dos pombos, dois hashes a distância
+≤ r coincidem em algum bloco com distância ≤ r // 4; a busca visita só esses
+vizinhos (1 + 16 sondagens por tabela com r ≤ 7) e confere a distância real dos
+candidatos. Com centenas de milhares de entradas cada balde tem poucos
+elementos, então a consulta fica bem abaixo de 1 ms.
+
+O índice acompanha o cache que ele aponta: no máximo `max_entries` entradas (as
+menos usadas saem primeiro) e validade `ttl`. Com {prefix}_DB (o mesmo sqlite do
+cache) ele é persistido e recarregado na subida.
+"""
+
+import io
+import os
+import sqlite3
+import threading
+import time
+from itertools import combinations
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+_SIZE = 32
+_LOW = 8
+_BLOCKS = 4
+_BLOCK_BITS = 64 // _BLOCKS
+_BLOCK_MASK = (1 << _BLOCK_BITS) - 1
+
+# Diferença máxima (0-255) por canal/quadrante entre assinaturas de cor
+COLOR_TOLERANCE = 24
+
+
+class Fingerprint(NamedTuple):
+    hash: int        # pHash de 64 bits (tons de cinza)
+    color: bytes     # RGB médio dos 4 quadrantes (12 bytes)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    m[0] /= np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+
+_DCT = _dct_matrix(_SIZE)
+
+
+def phash_image(im: Image.Image) -> Fingerprint:
+    small = im.convert("RGB").resize((_SIZE, _SIZE), Image.Resampling.BOX)
+    pixels = np.asarray(small.convert("L"), dtype=np.float32)
+    low = (_DCT @ pixels @ _DCT.T)[:_LOW, :_LOW].ravel()
+    # O termo DC (brilho médio) fica de fora da mediana
+    bits = low > np.median(low[1:])
+    rgb = np.asarray(small, dtype=np.float32).reshape(2, _SIZE // 2, 2, _SIZE // 2, 3)
+    color = rgb.mean(axis=(1, 3)).round().astype(np.uint8).tobytes()
+    return Fingerprint(int.from_bytes(np.packbits(bits).tobytes(), "big"), color)
+
+
+def phash(image_bytes: bytes) -> Fingerprint | None:
+    """pHash + assinatura de cor, ou None se o Pillow não conseguir abrir a imagem."""
+    try:
+        im = Image.open(io.BytesIO(image_bytes))
+        im.draft("RGB", (_SIZE * 4, _SIZE * 4))  # JPEG: decodifica já reduzido
+        return phash_image(im)
+    except Exception:
+        return None
+
+
+def _same_colors(a: bytes, b: bytes) -> bool:
+    return len(a) == len(b) and all(abs(x - y) <= COLOR_TOLERANCE for x, y in zip(a, b))
+
+
+def _blocks(h: int) -> list[int]:
+    return [(h >> (i * _BLOCK_BITS)) & _BLOCK_MASK for i in range(_BLOCKS)]
+
+
+def _neighbors(value: int, radius: int):
+    """Todos os valores de 16 bits a distância ≤ radius de `value`."""
+    yield value
+    for r in range(1, radius + 1):
+        for bits in combinations(range(_BLOCK_BITS), r):
+            flipped = value
+            for b in bits:
+                flipped ^= 1 << b
+            yield flipped
+
+
+def _signed(h: int) -> int:
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+class PerceptualIndex:
+    """Fingerprint → chave do cache, com busca por raio de Hamming dentro de um namespace."""
+
+    def __init__(self, radius: int = 6, max_entries: int = 256, ttl: float = 86400.0,
+                 db_path: str | Path | None = None, table: str = "phash"):
+        self.radius = radius
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.table = table
+        self._tables: list[dict[int, list[int]]] = [{} for _ in range(_BLOCKS)]
+        self._entries: dict[int, dict[str, str]] = {}     # hash → {namespace: chave}
+        # (namespace, chave) → (fingerprint, expira); ordem = menos usada primeiro
+        self._keys: dict[tuple[str, str], tuple[Fingerprint, float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if columns and "color" not in columns:
+                # Formato antigo (sem cor/validade): o índice é derivado, recria
+                self._conn.execute(f"DROP TABLE {table}")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(namespace TEXT NOT NULL, key TEXT NOT NULL, hash INTEGER NOT NULL, "
+                "color BLOB NOT NULL, expires REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(f"DELETE FROM {table} WHERE expires < ?", (time.time(),))
+            self._conn.commit()
+            rows = self._conn.execute(
+                f"SELECT namespace, key, hash, color, expires FROM {table} ORDER BY rowid"
+            ).fetchall()
+            for namespace, key, h, color, expires in rows:
+                self._insert(Fingerprint(h & ((1 << 64) - 1), bytes(color)), namespace, key, expires)
+            self._evict()
+
+    @classmethod
+    def from_env(cls, prefix: str, table: str, max_entries: int = 256,
+                 ttl: float = 86400.0) -> "PerceptualIndex":
+        """Lê {prefix}_PHASH_RADIUS (bits, padrão 6) e os mesmos {prefix}_MAX_ENTRIES,
+        {prefix}_TTL e {prefix}_DB do cache. Com sqlite o cache guarda mais que a
+        memória: o teto passa a {prefix}_PHASH_MAX_ENTRIES (padrão 100000)."""
+        db_path = os.getenv(f"{prefix}_DB") or None
+        limit = int(os.getenv(f"{prefix}_MAX_ENTRIES", max_entries))
+        if db_path:
+            limit = int(os.getenv(f"{prefix}_PHASH_MAX_ENTRIES", "100000"))
+        return cls(
+            radius=int(os.getenv(f"{prefix}_PHASH_RADIUS", "6")),
+            max_entries=limit,
+            ttl=float(os.getenv(f"{prefix}_TTL", ttl)),
+            db_path=db_path,
+            table=table,
+        )
+
+    # -- Estrutura em memória (chamar com o lock) ---------------------------
+
+    def _insert(self, fp: Fingerprint, namespace: str, key: str, expires: float) -> str | None:
+        """Insere; devolve a chave antiga que ocupava o mesmo hash no namespace (agora fora)."""
+        previous = self._keys.get((namespace, key))
+        if previous is not None and previous[0].hash != fp.hash:
+            self._remove(namespace, key)
+        self._keys.pop((namespace, key), None)
+        self._keys[(namespace, key)] = (fp, expires)
+        slots = self._entries.setdefault(fp.hash, {})
+        if not slots:
+            for table, block in zip(self._tables, _blocks(fp.hash)):
+                table.setdefault(block, []).append(fp.hash)
+        replaced = slots.get(namespace)
+        slots[namespace] = key
+        if replaced is not None and replaced != key:
+            self._keys.pop((namespace, replaced), None)
+            return replaced
+        return None
+
+    def _remove(self, namespace: str, key: str) -> None:
+        entry = self._keys.pop((namespace, key), None)
+        if entry is None:
+            return
+        h = entry[0].hash
+        slots = self._entries.get(h, {})
+        if slots.get(namespace) == key:
+            del slots[namespace]
+        if not slots:
+            self._entries.pop(h, None)
+            for table, block in zip(self._tables, _blocks(h)):
+                bucket = table.get(block, [])
+                if h in bucket:
+                    bucket.remove(h)
+                if not bucket:
+                    table.pop(block, None)
+
+    def _evict(self) -> None:
+        """Tira as menos usadas acima do teto (memória e sqlite)."""
+        evicted = []
+        while len(self._keys) > self.max_entries:
+            namespace, key = next(iter(self._keys))
+            self._remove(namespace, key)
+            evicted.append((namespace, key))
+        if evicted and self._conn is not None:
+            self._conn.executemany(f"DELETE FROM {self.table} WHERE namespace = ? AND key = ?", evicted)
+            self._conn.commit()
+
+    # -- API -------------------------------------------------------------------
+
+    def add(self, fp: Fingerprint | None, namespace: str, key: str) -> None:
+        if fp is None or self.radius < 0:
+            return
+        expires = time.time() + self.ttl
+        with self._lock:
+            replaced = self._insert(fp, namespace, key, expires)
+            if self._conn is not None:
+                if replaced is not None:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE namespace = ? AND key = ?",
+                                       (namespace, replaced))
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (namespace, key, hash, color, expires) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, _signed(fp.hash), fp.color, expires),
+                )
+                self._conn.commit()
+            self._evict()
+
+    def lookup(self, fp: Fingerprint | None, namespace: str) -> str | None:
+        """Chave do vizinho mais próximo no namespace a distância ≤ radius e com as
+        mesmas cores (ou None)."""
+        if fp is None or self.radius < 0:
+            return None
+        now = time.time()
+        best: tuple[int, str] | None = None
+        expired: list[str] = []
+        seen: set[int] = set()
+        with self._lock:
+            for table, block in zip(self._tables, _blocks(fp.hash)):
+                for probe in _neighbors(block, self.radius // _BLOCKS):
+                    for candidate in table.get(probe, ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        key = self._entries[candidate].get(namespace)
+                        distance = (candidate ^ fp.hash).bit_count()
+                        if key is None or distance > self.radius or (best is not None and distance >= best[0]):
+                            continue
+                        stored, expires = self._keys[(namespace, key)]
+                        if expires < now:
+                            expired.append(key)
+                        elif _same_colors(stored.color, fp.color):
+                            best = (distance, key)
+            for key in expired:
+                self._remove(namespace, key)
+            if expired and self._conn is not None:
+                self._conn.executemany(f"DELETE FROM {self.table} WHERE namespace = ? AND key = ?",
+                                       [(namespace, key) for key in expired])
+                self._conn.commit()
+            if best is not None:
+                # Uso recente: vai para o fim da fila de despejo
+                self._keys[(namespace, best[1])] = self._keys.pop((namespace, best[1]))
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return best[1]
+
+    def discard(self, namespace: str, key: str) -> None:
+        """Remove uma chave cujo valor saiu do cache (expirou ou foi despejado)."""
+        with self._lock:
+            self._remove(namespace, key)
+            if self._conn is not None:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE namespace = ? AND key = ?",
+                                   (namespace, key))
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._keys), "max_entries": self.max_entries, "radius": self.radius,
+                "hits": self.hits, "misses": self.misses}
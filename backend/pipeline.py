@@ -0,0 +1,61 @@
+"""
+Executor mínimo de grafo de dependências para o pipeline de geração.
+Cada estágio é uma corrotina que recebe os resultados das dependências como
+kwargs; estágios independentes rodam em paralelo sob asyncio. A duração de
+cada estágio vai para metrics (histograma e Server-Timing).
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable
+
+import metrics
+
+StageFn = Callable[..., Awaitable[Any]]
+OnDone = Callable[[str, Any], Awaitable[None] | None]
+
+
+class Pipeline:
+    def __init__(self) -> None:
+        self._stages: dict[str, tuple[StageFn, tuple[str, ...]]] = {}
+
+    def stage(self, name: str, fn: StageFn, *deps: str) -> "Pipeline":
+        """Registra `fn(**{dep: resultado})`. Dependências devem ser registradas antes."""
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"estágio '{name}' depende de '{dep}', ainda não registrado")
+        self._stages[name] = (fn, deps)
+        return self
+
+    async def run(self, on_done: OnDone | None = None) -> dict[str, Any]:
+        """Executa o grafo. `on_done(nome, resultado)` é chamado quando cada estágio termina.
+
+        Se um estágio falha, os demais são cancelados e a exceção é propagada.
+        """
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def _run_stage(name: str) -> Any:
+            fn, deps = self._stages[name]
+            kwargs = {dep: await tasks[dep] for dep in deps}
+            try:
+                with metrics.stage(name):
+                    result = await fn(**kwargs)
+            except Exception:
+                metrics.inc("thumb_stage_failures_total", stage=name)
+                raise
+            if on_done is not None:
+                maybe = on_done(name, result)
+                if asyncio.iscoroutine(maybe):
+                    await maybe
+            return result
+
+        for name in self._stages:
+            tasks[name] = asyncio.create_task(_run_stage(name), name=f"stage:{name}")
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,246 @@
+"""
+Design system da thumbnail de referência medido localmente (só CPU).
+
+Quase todo o JSON de `_analyze_reference` pode ser medido na própria imagem:
+- paleta por k-means vetorizado sobre a imagem reduzida;
+- fundo estimado pelos pixels da moldura;
+- linhas de texto, cores de preenchimento e contorno via textlayout;
+- mapa de saliência (distância ao fundo, sem as linhas de texto) para achar a
+  pessoa e a zona do texto.
+
+O resultado tem o mesmo formato do JSON do Gemini. Sobram para o modelo só a
+atmosfera, o nome da fonte e o corte da pessoa (STYLE_PROMPT), com uma prévia
+pequena da imagem no lugar do original.
+"""
+
+import io
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+import imaging
+import textlayout
+
+# Muda quando as medidas mudam — entra na chave do cache da análise
+VERSION = "1"
+
+_WORK_W = 320          # largura da imagem usada para paleta e saliência
+_BORDER = 0.06         # espessura da moldura que estima o fundo (fração do lado)
+_K = 6                 # cores na paleta
+_SAMPLE = 6000         # pixels amostrados para o k-means
+_SALIENT = 70          # distância ao fundo (RGB) que marca um pixel como saliente
+_PREVIEW_EDGE = 512    # aresta da prévia enviada ao Gemini no modo auto
+
+STYLE_PROMPT = """Você é um especialista em design de thumbnails virais para YouTube.
+Cores, posições e contornos desta thumbnail já foram medidos: informe só a fonte,
+a caixa e a sombra do texto, o corte da pessoa e a atmosfera."""
+
+
+def mode() -> str:
+    """auto (medidas locais + STYLE_PROMPT) · local (nunca chama o Gemini) · remote (prompt completo)."""
+    return os.getenv("REF_ANALYSIS_MODE", "auto").lower()
+
+
+def _hex(rgb) -> str:
+    r, g, b = (int(round(float(c))) for c in rgb)
+    return f"#{r:02X}{g:02X}{b:02X}"
+
+
+def _saturation(rgb: np.ndarray) -> np.ndarray:
+    hi, lo = rgb.max(axis=-1), rgb.min(axis=-1)
+    return (hi - lo) / np.maximum(hi, 1)
+
+
+# ---------------------------------------------------------------------------
+# Paleta e fundo
+# ---------------------------------------------------------------------------
+
+def palette(rgb: np.ndarray, k: int = _K, iterations: int = 8) -> list[tuple[np.ndarray, float]]:
+    """k-means determinístico sobre uma amostra fixa dos pixels.
+    Retorna [(cor, fração)] da cor mais frequente para a menos frequente."""
+    pixels = rgb.reshape(-1, 3)
+    step = max(1, len(pixels) // _SAMPLE)
+    sample = pixels[::step]
+    # Inicialização pelo ponto mais distante (k-means++ sem sorteio)
+    centers = [sample[len(sample) // 2]]
+    dist = np.linalg.norm(sample - centers[0], axis=1)
+    for _ in range(1, k):
+        centers.append(sample[dist.argmax()])
+        dist = np.minimum(dist, np.linalg.norm(sample - centers[-1], axis=1))
+    centers = np.stack(centers).astype(np.float32)
+
+    for _ in range(iterations):
+        labels = np.linalg.norm(sample[:, None, :] - centers[None], axis=2).argmin(axis=1)
+        for j in range(k):
+            members = sample[labels == j]
+            if len(members):
+                centers[j] = members.mean(axis=0)
+    counts = np.bincount(labels, minlength=k) / len(sample)
+    order = np.argsort(-counts)
+    return [(centers[j], float(counts[j])) for j in order if counts[j] > 0]
+
+
+def background(rgb: np.ndarray) -> tuple[np.ndarray, str]:
+    """Cor mediana da moldura e tipo do fundo: solid, gradient ou scene."""
+    h, w = rgb.shape[:2]
+    b = max(2, int(min(h, w) * _BORDER))
+    sides = [rgb[:b].reshape(-1, 3), rgb[-b:].reshape(-1, 3),
+             rgb[:, :b].reshape(-1, 3), rgb[:, -b:].reshape(-1, 3)]
+    frame = np.concatenate(sides)
+    main = np.median(frame, axis=0)
+    spread = float(np.abs(frame - main).mean())
+    if spread < 12:
+        return main, "solid"
+    # Gradiente: cada lado é quase uniforme, mas os lados diferem entre si
+    side_spread = max(float(np.abs(s - np.median(s, axis=0)).mean()) for s in sides[:2])
+    if side_spread < 18:
+        return main, "gradient"
+    return main, "scene"
+
+
+# ---------------------------------------------------------------------------
+# Saliência: pessoa e zona do texto
+# ---------------------------------------------------------------------------
+
+def _zone(x_center: float, width: float) -> str:
+    if width > 0.75:
+        return "fullwidth"
+    if x_center < 0.4:
+        return "left"
+    if x_center > 0.6:
+        return "right"
+    return "center"
+
+
+def _subject(rgb: np.ndarray, bg: np.ndarray, text_boxes: list[tuple[int, int, int, int]]) -> dict:
+    """Região saliente fora das linhas de texto, em frações da imagem."""
+    h, w = rgb.shape[:2]
+    salient = np.linalg.norm(rgb - bg, axis=2) > _SALIENT
+    for x0, y0, x1, y1 in text_boxes:
+        salient[y0:y1, x0:x1] = False
+    cols = salient.mean(axis=0)
+    if cols.sum() * w < 0.02 * h * w:
+        return {}
+    # Colunas com massa relevante: descarta respingos e elementos pequenos
+    active = np.flatnonzero(cols > 0.25 * cols.max())
+    x0, x1 = int(active[0]), int(active[-1]) + 1
+    rows = np.flatnonzero(salient[:, x0:x1].any(axis=1))
+    y0, y1 = int(rows[0]), int(rows[-1]) + 1
+    centroid = float((cols * np.arange(w)).sum() / cols.sum()) / w
+    return {
+        "x_center": centroid,
+        "width": (x1 - x0) / w,
+        "area": (x1 - x0) * (y1 - y0) / (w * h),
+    }
+
+
+def _size(area: float) -> str:
+    if area < 0.15:
+        return "small"
+    if area < 0.3:
+        return "medium"
+    if area < 0.55:
+        return "large"
+    return "dominant"
+
+
+def _composition(person: str, text_zone: str) -> str:
+    if person == "left" and text_zone in ("right", "center"):
+        return "person-left-text-right"
+    if person == "right" and text_zone in ("left", "center"):
+        return "person-right-text-left"
+    if person in ("center", "fullwidth"):
+        return "person-center-text-overlay"
+    return "split"
+
+
+# ---------------------------------------------------------------------------
+# Análise
+# ---------------------------------------------------------------------------
+
+def _unique(colors: list[str], tolerance: float = 40) -> list[str]:
+    """Remove repetidas e quase iguais (o mesmo preto de contorno em duas linhas)."""
+    kept: list[str] = []
+    for color in colors:
+        rgb = np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)])
+        if all(np.linalg.norm(rgb - [int(k[i:i + 2], 16) for i in (1, 3, 5)]) > tolerance for k in kept):
+            kept.append(color)
+    return kept
+
+
+def measure_image(im: Image.Image) -> dict:
+    """Design system medido, no formato de `_analyze_reference` (sem atmosfera nem fonte)."""
+    im = im.convert("RGB")
+    text = textlayout.analyze_image(im)
+
+    work = im.resize((_WORK_W, round(_WORK_W * im.height / im.width)), Image.Resampling.BOX)
+    rgb = np.asarray(work, dtype=np.float32)
+    h, w = rgb.shape[:2]
+    bg, bg_type = background(rgb)
+    colors = palette(rgb)
+
+    fills = _unique([ln.fill for ln in text.lines])
+    strokes = _unique([ln.stroke for ln in text.lines if ln.stroke])
+    typography: dict = {"line_count": len(text.lines), "has_stroke": bool(strokes)}
+    if fills:
+        typography["text_colors"] = fills
+    if strokes:
+        typography["stroke_colors"] = strokes
+        ratio = max(ln.stroke_width / max(1.0, ln.font_size) for ln in text.lines)
+        typography["stroke_thickness"] = "thin" if ratio < 0.06 else "medium" if ratio < 0.14 else "thick"
+
+    # Caixas do texto na escala da imagem de trabalho
+    sx, sy = w / textlayout.CANVAS_W, h / textlayout.CANVAS_H
+    boxes = [(int(x0 * sx), int(y0 * sy), int(np.ceil(x1 * sx)), int(np.ceil(y1 * sy)))
+             for x0, y0, x1, y1 in (ln.box for ln in text.lines)]
+
+    layout: dict = {}
+    if boxes:
+        tx0, tx1 = min(b[0] for b in boxes), max(b[2] for b in boxes)
+        ty0, ty1 = min(b[1] for b in boxes), max(b[3] for b in boxes)
+        zone = _zone((tx0 + tx1) / 2 / w, (tx1 - tx0) / w)
+        if zone in ("center", "fullwidth"):
+            zone = "top" if ty1 < 0.45 * h else "bottom" if ty0 > 0.55 * h else "center-overlay"
+        layout["text_zone"] = zone
+    subject = _subject(rgb, bg, boxes)
+    if subject:
+        layout["person_position"] = _zone(subject["x_center"], subject["width"])
+        layout["person_size"] = _size(subject["area"])
+        if "text_zone" in layout:
+            layout["composition_type"] = _composition(layout["person_position"], layout["text_zone"])
+
+    # Destaques: cores saturadas da paleta que não são o fundo
+    accents = [c for c, share in colors
+               if np.linalg.norm(c - bg) > 60 and share > 0.01]
+    accents.sort(key=lambda c: -float(_saturation(c)))
+    palette_hex = _unique([_hex(c) for c in accents] + fills)
+    colors_out: dict = {"background_main": _hex(bg), "background_type": bg_type}
+    for i, color in enumerate(palette_hex[:2], start=1):
+        colors_out[f"accent_{i}"] = color
+
+    return {"typography": typography, "layout": layout, "colors": colors_out}
+
+
+def measure(image_bytes: bytes) -> dict:
+    return measure_image(Image.open(io.BytesIO(image_bytes)))
+
+
+def preview(image_bytes: bytes, mime: str) -> tuple[bytes, str]:
+    """Prévia pequena da referência para o STYLE_PROMPT — fonte e clima não
+    precisam de resolução."""
+    return imaging.normalize_image(image_bytes, mime, {
+        "max_edge": _PREVIEW_EDGE, "quality": 75, "format": "jpeg", "passthrough": 0,
+    })
+
+
+def merge(measured: dict, remote: dict | None) -> dict:
+    """Respostas do modelo completam as medidas; o que foi medido prevalece."""
+    out = json.loads(json.dumps(remote or {}))
+    for section, values in measured.items():
+        if isinstance(out.get(section), dict):
+            out[section].update(values)
+        else:
+            out[section] = dict(values)
+    return out
@@ -0,0 +1,181 @@
+"""
+Respostas estruturadas das chamadas de visão/texto.
+
+Cada resposta esperada do modelo é um modelo pydantic. `response_schema(T)`
+traduz o JSON Schema dele para o subconjunto OpenAPI de
+generationConfig.responseSchema — com responseMimeType application/json o
+Gemini devolve exatamente esse formato, então os prompts só descrevem a tarefa
+e `parse(T, texto)` valida a resposta direto, sem regex.
+
+Os modelos são tolerantes campo a campo (`LenientModel`): um valor inválido vira o
+padrão do campo em vez de derrubar a análise inteira — o mesmo efeito dos antigos
+`.get(chave, padrão)`, agora com tipos. Servem também para ler análises que vêm
+do cache ou das medidas locais.
+"""
+
+from functools import lru_cache
+from typing import Any, Literal, TypeVar
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, field_validator
+
+T = TypeVar("T")
+
+
+class LenientModel(BaseModel):
+    """Campo inválido → padrão do campo; chaves desconhecidas são ignoradas."""
+
+    model_config = ConfigDict(extra="ignore")
+
+    @field_validator("*", mode="wrap")
+    @classmethod
+    def _default_on_error(cls, value: Any, handler, info) -> Any:
+        try:
+            return handler(value)
+        except ValidationError:
+            return cls.model_fields[info.field_name].get_default(call_default_factory=True)
+
+    @classmethod
+    def coerce(cls, data: Any):
+        """Dict qualquer (cache, medidas, resposta antiga) → modelo, nunca falha."""
+        return cls.model_validate(data if isinstance(data, dict) else {})
+
+
+# ---------------------------------------------------------------------------
+# Análise da referência (design system)
+# ---------------------------------------------------------------------------
+
+class Typography(LenientModel):
+    headline_font: str = Field("Impact", description="família da fonte principal (ex: Impact, Bebas Neue)")
+    headline_weight: Literal["bold", "normal"] = "bold"
+    text_case: Literal["UPPERCASE", "Mixed Case"] = "UPPERCASE"
+    has_stroke: bool = True
+    stroke_thickness: Literal["thin", "medium", "thick"] = "medium"
+    text_colors: list[str] = Field(["#FFFFFF"], description="#RRGGBB")
+    stroke_colors: list[str] = Field(["#000000"], description="#RRGGBB")
+    line_count: int = 2
+    text_shadow: bool = False
+
+
+class Layout(LenientModel):
+    person_position: Literal["left", "right", "center", "fullwidth"] = "right"
+    person_crop: Literal["full-body", "torso-up", "face-close"] = "torso-up"
+    person_size: Literal["small", "medium", "large", "dominant"] = "large"
+    text_zone: Literal["left", "right", "top", "bottom", "center-overlay"] = "left"
+    composition_type: Literal["person-left-text-right", "person-right-text-left",
+                              "person-center-text-overlay", "split"] = "person-right-text-left"
+
+
+class Colors(LenientModel):
+    background_main: str = Field("#0D0D1A", description="#RRGGBB")
+    background_type: Literal["solid", "gradient", "scene"] = "solid"
+    accent_1: str = Field("#FFD700", description="#RRGGBB")
+    accent_2: str = Field("#FFFFFF", description="#RRGGBB")
+
+
+class RefAnalysis(LenientModel):
+    typography: Typography = Field(default_factory=Typography)
+    layout: Layout = Field(default_factory=Layout)
+    colors: Colors = Field(default_factory=Colors)
+    atmosphere: str = Field("", description="2-3 frases: contraste, intensidade, impacto emocional")
+
+
+# Só o que as medidas locais não cobrem (refdesign.STYLE_PROMPT)
+class StyleTypography(LenientModel):
+    headline_font: str = Field("Impact", description="família da fonte principal (ex: Impact, Bebas Neue)")
+    headline_weight: Literal["bold", "normal"] = "bold"
+    text_case: Literal["UPPERCASE", "Mixed Case"] = "UPPERCASE"
+    text_shadow: bool = False
+
+
+class StyleLayout(LenientModel):
+    person_crop: Literal["full-body", "torso-up", "face-close"] = "torso-up"
+
+
+class RefStyle(LenientModel):
+    typography: StyleTypography = Field(default_factory=StyleTypography)
+    layout: StyleLayout = Field(default_factory=StyleLayout)
+    atmosphere: str = Field("", description="2-3 frases: contraste, intensidade, impacto emocional")
+
+
+# ---------------------------------------------------------------------------
+# Elementos de texto e copy
+# ---------------------------------------------------------------------------
+
+class TextElement(LenientModel):
+    """Uma linha de texto da thumbnail, no formato de objeto do Fabric.js (canvas 1280x720)."""
+    id: str = ""
+    text: str = ""
+    x: float = Field(60.0, description="borda esquerda, px")
+    y: float | None = Field(None, description="topo da linha, px")
+    fontSize: float = Field(80.0, description="px")
+    fontFamily: str = "Impact"
+    fill: str = Field("#FFFFFF", description="#RRGGBB")
+    stroke: str | None = Field(None, description="#RRGGBB ou null")
+    strokeWidth: float = Field(0.0, description="px; 0 sem contorno")
+    fontWeight: Literal["normal", "bold"] = "normal"
+
+
+class CopyLine(LenientModel):
+    """Uma linha do copywriting; fonte, cores e x vêm do estilo da referência."""
+    text: str = ""
+    y: float | None = Field(None, description="topo da linha, px")
+    fontSize: float | None = Field(None, description="px")
+    fontWeight: Literal["normal", "bold"] = "bold"
+
+
+# ---------------------------------------------------------------------------
+# Schema de resposta e parse
+# ---------------------------------------------------------------------------
+
+_KEEP = ("description", "enum", "format")
+
+
+@lru_cache(maxsize=None)
+def _adapter(tp: Any) -> TypeAdapter:
+    return TypeAdapter(tp)
+
+
+@lru_cache(maxsize=None)
+def response_schema(tp: Any) -> dict:
+    """JSON Schema do pydantic → generationConfig.responseSchema (sem $ref/anyOf/defaults).
+
+    Todos os campos viram obrigatórios: o schema substitui o exemplo que os
+    prompts traziam, então o modelo deve preencher tudo.
+    """
+    schema = _adapter(tp).json_schema()
+    defs = schema.pop("$defs", {})
+
+    def convert(node: dict) -> dict:
+        if "$ref" in node:
+            node = {**defs[node["$ref"].rsplit("/", 1)[-1]], **{k: v for k, v in node.items() if k != "$ref"}}
+        if "anyOf" in node:
+            options = [o for o in node["anyOf"] if o.get("type") != "null"]
+            out = convert(options[0])
+            if len(options) < len(node["anyOf"]):
+                out["nullable"] = True
+            if "description" in node:
+                out["description"] = node["description"]
+            return out
+        out: dict = {"type": node.get("type", "string").upper()}
+        out.update({k: node[k] for k in _KEEP if k in node})
+        if out["type"] == "OBJECT":
+            props = node.get("properties", {})
+            out["properties"] = {name: convert(p) for name, p in props.items()}
+            out["required"] = list(props)
+            out["propertyOrdering"] = list(props)
+        elif out["type"] == "ARRAY":
+            out["items"] = convert(node.get("items", {}))
+        return out
+
+    return convert(schema)
+
+
+def parse(tp: type[T] | Any, text: str) -> T | None:
+    """Valida a resposta inteira como `tp`; None se não for JSON desse formato."""
+    text = text.strip()
+    if text.startswith("```"):  # motores sem modo JSON às vezes cercam com markdown
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        return _adapter(tp).validate_json(text)
+    except ValidationError:
+        return None
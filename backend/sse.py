@@ -0,0 +1,99 @@
+"""
+Server-Sent Events para o pipeline de geração.
+Cada estágio concluído vira um evento `event: <estágio>`; comentários de
+keep-alive evitam que proxies derrubem conexões longas.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from pipeline import Pipeline
+
+log = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # desliga buffering do nginx
+}
+
+
+def format_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+Emit = Callable[[str, Any], Awaitable[None]]
+
+
+async def stream_events(
+    producer: Callable[[Emit], Awaitable[None]],
+    keepalive: float = 15.0,
+) -> AsyncIterator[str]:
+    """Roda `producer(emit)` em background e repassa cada `emit(evento, dados)`.
+
+    HTTPException vira `event: error` ({"status", "detail"}); qualquer outra exceção
+    vai para o log e o cliente recebe só um 500 genérico (sem detalhes internos).
+    Se o cliente desconectar, o producer é cancelado.
+    """
+    queue: asyncio.Queue[str | None] = asyncio.Queue()
+
+    async def emit(event: str, data: Any) -> None:
+        await queue.put(format_event(event, data))
+
+    async def runner() -> None:
+        try:
+            await producer(emit)
+        except HTTPException as exc:
+            await emit("error", {"status": exc.status_code, "detail": exc.detail})
+        except Exception:
+            log.exception("Falha no stream SSE")
+            await emit("error", {"status": 500, "detail": "Erro interno ao gerar — tente novamente."})
+        finally:
+            await queue.put(None)
+
+    task = asyncio.create_task(runner())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                break
+            yield item
+    finally:
+        task.cancel()
+
+
+async def stream_pipeline(
+    pipeline: Pipeline,
+    encoders: dict[str, Callable[[Any], Any | Awaitable[Any]]],
+    keepalive: float = 15.0,
+) -> AsyncIterator[str]:
+    """Roda o pipeline e emite um evento por estágio presente em `encoders`
+    (encoders podem ser síncronos ou corrotinas). Termina com `event: done`."""
+
+    async def producer(emit: Emit) -> None:
+        async def on_done(name: str, result: Any) -> None:
+            encode = encoders.get(name)
+            if encode is not None:
+                payload = encode(result)
+                if asyncio.iscoroutine(payload):
+                    payload = await payload
+                await emit(name, payload)
+
+        await pipeline.run(on_done)
+        await emit("done", {})
+
+    async for item in stream_events(producer, keepalive):
+        yield item
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
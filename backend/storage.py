@@ -0,0 +1,221 @@
+"""
+Armazenamento de imagens endereçado por conteúdo (sha256).
+Imagens geradas/enviadas são gravadas uma vez e servidas por GET /api/images/{hash}
+com ETag e Cache-Control imutável. O modo data URL (base64 no JSON) continua
+disponível via IMAGE_STORAGE=dataurl para o deploy serverless.
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Protocol
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+from cache import LRUCache
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URL_RE = re.compile(r"^data:([\w.+-]+/[\w.+-]+);base64,")
+
+# Marca de imagem em respostas guardadas por pack()
+IMAGE_REF = "$image"
+
+# Padrão: .tmp/images na raiz do projeto (arquivos regeneráveis)
+_DEFAULT_DIR = Path(__file__).parent.parent / ".tmp" / "images"
+
+
+def sniff_mime(data: bytes, default: str = "application/octet-stream") -> str:
+    """Detecta o tipo de imagem pelos magic bytes."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return default
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class BlobStore(Protocol):
+    """Interface para backends (disco local, S3, GCS…). Métodos síncronos —
+    chamados via thread pool pelo ImageStorage."""
+
+    def put(self, key: str, data: bytes, mime: str) -> None: ...
+
+    def get(self, key: str) -> tuple[bytes, str] | None: ...
+
+    def exists(self, key: str) -> bool: ...
+
+
+class LocalBlobStore:
+    """Um arquivo por hash em <root>/<hash[:2]>/<hash>, mime em <hash>.mime."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes) -> None:
+        """Grava num temporário exclusivo e renomeia. O conteúdo é endereçado pelo
+        hash: se outra escrita chegou antes, o destino já tem os mesmos bytes."""
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            if not path.exists():
+                raise
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def put(self, key: str, data: bytes, mime: str) -> None:
+        path = self._path(key)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Dados antes do .mime: quem vê o mime sempre encontra o blob
+        # (sem o .mime, get() detecta o tipo pelos bytes)
+        self._write_atomic(path, data)
+        self._write_atomic(path.with_suffix(".mime"), mime.encode("utf-8"))
+
+    def get(self, key: str) -> tuple[bytes, str] | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            mime = path.with_suffix(".mime").read_text(encoding="utf-8")
+        except FileNotFoundError:
+            mime = sniff_mime(data)
+        return data, mime
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+
+# ---------------------------------------------------------------------------
+# Fachada usada pelas rotas
+# ---------------------------------------------------------------------------
+
+class ImageStorage:
+    def __init__(self, store: BlobStore | None, url_prefix: str = "/api/images",
+                 memory_entries: int = 32):
+        self.store = store  # None = modo data URL
+        self.url_prefix = url_prefix
+        # Uploads recentes em memória: handles funcionam mesmo sem store (serverless)
+        self.recent = LRUCache(memory_entries, ttl=3600.0)
+        # Imagens geradas de respostas guardadas por pack() no modo data URL
+        self.packed = LRUCache(memory_entries, ttl=86400.0)
+
+    @classmethod
+    def from_env(cls, default_mode: str = "local") -> "ImageStorage":
+        """IMAGE_STORAGE=local|dataurl, IMAGE_STORAGE_DIR para o backend local."""
+        mode = os.getenv("IMAGE_STORAGE", default_mode).lower()
+        memory_entries = int(os.getenv("UPLOAD_MEMORY_ENTRIES", 32))
+        if mode == "dataurl":
+            return cls(None, memory_entries=memory_entries)
+        if mode == "local":
+            store = LocalBlobStore(os.getenv("IMAGE_STORAGE_DIR") or _DEFAULT_DIR)
+            return cls(store, memory_entries=memory_entries)
+        raise ValueError(f"IMAGE_STORAGE inválido: {mode}")
+
+    async def save(self, data: bytes, mime: str | None = None) -> str:
+        """Grava a imagem e devolve o hash do conteúdo."""
+        key = content_hash(data)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put, key, data, mime or sniff_mime(data))
+        return key
+
+    async def remember(self, data: bytes, mime: str) -> str:
+        """Grava um upload e o mantém em memória; o hash serve de handle para /api/generate."""
+        key = await self.save(data, mime)
+        self.recent.set(key, (data, mime))
+        return key
+
+    async def load(self, key: str) -> tuple[bytes, str] | None:
+        """Bytes + mime de um handle devolvido por /api/upload (memória, depois store)."""
+        if not _HASH_RE.match(key):
+            return None
+        blob = self.recent.get(key)
+        if blob is None and self.store is not None:
+            blob = await asyncio.to_thread(self.store.get, key)
+            if blob is not None:
+                self.recent.set(key, blob)
+        return blob
+
+    def url(self, key: str, data: bytes, mime: str) -> str:
+        """URL pública de uma imagem já gravada (rota de blobs ou data URL)."""
+        if self.store is None:
+            return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+        return f"{self.url_prefix}/{key}"
+
+    async def publish(self, data: bytes, mime: str | None = None) -> str:
+        """Grava a imagem e devolve sua URL pública."""
+        mime = mime or sniff_mime(data, "image/jpeg")
+        if self.store is None:
+            return self.url("", data, mime)
+        key = await self.save(data, mime)
+        return self.url(key, data, mime)
+
+    def pack(self, response: dict) -> dict:
+        """Resposta → versão para guardar (idempotência, jobs): cada data URL vira
+        {"$image": hash} e os bytes ficam num LRU limitado. No modo local as URLs
+        já são referências à rota de blobs e nada muda."""
+        if self.store is not None:
+            return response
+        packed = {}
+        for name, value in response.items():
+            match = _DATA_URL_RE.match(value) if isinstance(value, str) else None
+            if match:
+                data = base64.b64decode(value[match.end():])
+                key = content_hash(data)
+                self.packed.set(key, (data, match.group(1)))
+                value = {IMAGE_REF: key}
+            packed[name] = value
+        return packed
+
+    def unpack(self, packed: dict) -> dict | None:
+        """Desfaz pack(); None se alguma imagem já saiu da memória."""
+        response = {}
+        for name, value in packed.items():
+            if isinstance(value, dict) and set(value) == {IMAGE_REF}:
+                blob = self.packed.get(value[IMAGE_REF])
+                if blob is None:
+                    return None
+                value = self.url(value[IMAGE_REF], *blob)
+            response[name] = value
+        return response
+
+    async def response(self, key: str, request: Request) -> Response:
+        """Resposta binária com ETag forte; 304 se o cliente já tem a versão."""
+        if self.store is None or not _HASH_RE.match(key):
+            raise HTTPException(404, "Imagem não encontrada")
+        etag = f'"{key}"'
+        headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        blob = await asyncio.to_thread(self.store.get, key)
+        if blob is None:
+            raise HTTPException(404, "Imagem não encontrada")
+        data, mime = blob
+        return Response(content=data, media_type=mime, headers=headers)
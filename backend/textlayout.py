@@ -0,0 +1,426 @@
+"""
+Extração local (só CPU) dos elementos de texto da thumbnail gerada.
+
+As linhas de texto são detectadas por contraste. Bordas fortes de cor
+são agregadas numa grade de células, e os componentes conexos densos da grade
+são fatiados em linhas por projeção. Para cada linha medimos cor de
+preenchimento, contorno, tamanho da fonte e posição no esquema do Fabric.js.
+Numa imagem 1280x720 isso leva dezenas de milissegundos.
+
+A leitura do texto vem do OCR local (pytesseract + binário tesseract) ou, se o
+binário/idioma não estiver instalado, de uma transcrição remota curta (ver
+backend/main.py). `confidence` indica se a
+geometria local basta ou se a extração completa via Gemini Vision é
+necessária. Mesmo nesse caso, `snap` troca as coordenadas aproximadas do
+modelo pelas medidas aqui.
+"""
+
+import io
+import os
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from fonts import FABRIC_FONT_SIZE_FRACTION, FABRIC_FONT_SIZE_MULT
+
+try:
+    import pytesseract
+except ImportError:  # sem ele o texto vem de uma transcrição remota
+    pytesseract = None
+
+CANVAS_W, CANVAS_H = 1280, 720
+
+_WORK_W = 640          # a análise roda na imagem reduzida para esta largura
+_CELL = 8              # lado da célula da grade, em px da imagem reduzida
+_EDGE = 48             # salto (0–255, qualquer canal) que conta como borda
+_CELL_DENSITY = 0.12   # fração mínima de pixels de borda numa célula de texto
+_CELL_RANGE = 90       # contraste mínimo (max − min, maior canal) na célula
+_INK = 60              # distância de cor ao fundo para um pixel ser "tinta"
+_MIN_LINE_PX = 10      # altura mínima de uma linha na imagem reduzida
+_KEEP_SCORE = 0.5      # abaixo disso o componente não é tratado como texto
+_CAP_HEIGHT = 0.75     # altura das maiúsculas / fontSize (Impact, Anton, Bebas ≈ 0.72–0.79)
+_BASELINE = FABRIC_FONT_SIZE_MULT * (1 - FABRIC_FONT_SIZE_FRACTION)
+
+
+def min_confidence() -> float:
+    return float(os.getenv("TEXT_LOCAL_MIN_CONFIDENCE", "0.6"))
+
+
+def mode() -> str:
+    """auto (local, remoto se preciso) · local (nunca chama o Gemini) · remote (comportamento antigo)."""
+    return os.getenv("TEXT_EXTRACT_MODE", "auto").lower()
+
+
+# ---------------------------------------------------------------------------
+# Resultado
+# ---------------------------------------------------------------------------
+
+@dataclass
+class TextLine:
+    box: tuple[int, int, int, int]        # x0, y0, x1, y1 no canvas (glifos + contorno)
+    baseline: float
+    font_size: float
+    fill: str
+    stroke: str | None
+    stroke_width: float                   # no padrão do Fabric (centrado: metade visível)
+    confidence: float
+    text: str = ""
+    crop: Image.Image | None = field(default=None, repr=False)
+
+    def element(self, index: int) -> dict:
+        half = self.stroke_width / 2
+        return {
+            "id": f"text_{index}",
+            "text": self.text,
+            "x": float(round(self.box[0] + half)),
+            # Maiúsculas apoiam na baseline; o y do Fabric é o topo da caixa da linha
+            "y": float(round(self.baseline - self.font_size * _BASELINE)),
+            "fontSize": float(round(self.font_size)),
+            "fontFamily": "Impact",
+            "fill": self.fill,
+            "stroke": self.stroke,
+            "strokeWidth": float(round(self.stroke_width)),
+            "fontWeight": "bold",
+        }
+
+
+@dataclass
+class LocalResult:
+    lines: list[TextLine]
+    confidence: float
+    elapsed_ms: float
+
+    @property
+    def transcribed(self) -> bool:
+        return all(line.text for line in self.lines)
+
+    def elements(self) -> list[dict]:
+        return [line.element(i) for i, line in enumerate(self.lines)]
+
+
+def _hex(rgb) -> str:
+    r, g, b = (int(round(float(c))) for c in rgb)
+    return f"#{r:02X}{g:02X}{b:02X}"
+
+
+# ---------------------------------------------------------------------------
+# Detecção
+# ---------------------------------------------------------------------------
+
+def _edges(rgb: np.ndarray) -> np.ndarray:
+    """Saltos fortes em qualquer canal — texto vermelho sobre fundo escuro tem pouco
+    contraste de luminância, mas muito no canal R."""
+    edges = np.zeros(rgb.shape[:2], dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(rgb, axis=1)).max(axis=2) > _EDGE
+    edges[1:, :] |= np.abs(np.diff(rgb, axis=0)).max(axis=2) > _EDGE
+    return edges
+
+
+def _merge(boxes: list[tuple[int, int, int, int]]) -> list[tuple[int, int, int, int]]:
+    """Une pedaços da mesma linha (palavras separadas por espaço largo): caixas que
+    se sobrepõem na vertical e estão a menos de uma altura de distância."""
+    boxes = sorted(boxes)
+    merged: list[list[int]] = []
+    for x0, y0, x1, y1 in boxes:
+        for m in merged:
+            overlap = min(y1, m[3]) - max(y0, m[1])
+            height = max(y1 - y0, m[3] - m[1])
+            if overlap > 0.6 * min(y1 - y0, m[3] - m[1]) and x0 - m[2] < height:
+                m[0], m[1], m[2], m[3] = min(x0, m[0]), min(y0, m[1]), max(x1, m[2]), max(y1, m[3])
+                break
+        else:
+            merged.append([x0, y0, x1, y1])
+    return [tuple(m) for m in merged]
+
+
+def _components(mask: np.ndarray) -> list[tuple[int, int, int, int]]:
+    """Componentes 8-conexos da grade (poucos milhares de células): (r0, c0, r1, c1)."""
+    h, w = mask.shape
+    cells = mask.tolist()
+    seen = [[False] * w for _ in range(h)]
+    boxes = []
+    for r in range(h):
+        for c in range(w):
+            if not cells[r][c] or seen[r][c]:
+                continue
+            seen[r][c] = True
+            stack = [(r, c)]
+            r0 = r1 = r
+            c0 = c1 = c
+            while stack:
+                y, x = stack.pop()
+                r0, r1, c0, c1 = min(r0, y), max(r1, y), min(c0, x), max(c1, x)
+                for ny in (y - 1, y, y + 1):
+                    for nx in (x - 1, x, x + 1):
+                        if 0 <= ny < h and 0 <= nx < w and cells[ny][nx] and not seen[ny][nx]:
+                            seen[ny][nx] = True
+                            stack.append((ny, nx))
+            boxes.append((r0, c0, r1 + 1, c1 + 1))
+    return boxes
+
+
+def _runs(profile: np.ndarray, min_len: int, max_gap: int) -> list[tuple[int, int]]:
+    """Trechos contíguos de `profile` verdadeiro, unindo lacunas de até max_gap."""
+    runs: list[list[int]] = []
+    for i in np.flatnonzero(profile).tolist():
+        if runs and i - runs[-1][1] <= max_gap + 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return [(a, b + 1) for a, b in runs if b + 1 - a >= min_len]
+
+
+def _erode(mask: np.ndarray) -> np.ndarray:
+    out = mask.copy()
+    out[1:, :] &= mask[:-1, :]
+    out[:-1, :] &= mask[1:, :]
+    out[:, 1:] &= mask[:, :-1]
+    out[:, :-1] &= mask[:, 1:]
+    return out
+
+
+def _measure(rgb: np.ndarray, box: tuple[int, int, int, int], scale: float) -> TextLine | None:
+    """Cores, contorno, tamanho e confiança de uma linha (coordenadas da imagem reduzida)."""
+    x0, y0, x1, y1 = box
+    h, w = rgb.shape[:2]
+    pad = 4
+    ring = np.concatenate([
+        rgb[max(0, y0 - pad):y0, x0:x1].reshape(-1, 3),
+        rgb[y1:min(h, y1 + pad), x0:x1].reshape(-1, 3),
+        rgb[y0:y1, max(0, x0 - pad):x0].reshape(-1, 3),
+        rgb[y0:y1, x1:min(w, x1 + pad)].reshape(-1, 3),
+    ])
+    if len(ring) == 0:
+        return None
+    background = np.median(ring, axis=0)
+
+    region = rgb[y0:y1, x0:x1]
+    ink = np.linalg.norm(region - background, axis=2) > _INK
+    ink_count = int(ink.sum())
+    if ink_count < 20:
+        return None
+
+    # Caixa justa da tinta: é ela que define tamanho e posição
+    rows, cols = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+    ty0, ty1, tx0, tx1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    ink = ink[ty0:ty1, tx0:tx1]
+    region = region[ty0:ty1, tx0:tx1]
+    lh, lw = ink.shape
+
+    # 2-means na tinta: preenchimento × contorno
+    pixels = region[ink]
+    luma = pixels @ np.array([0.299, 0.587, 0.114])
+    centers = np.stack([pixels[luma.argmin()], pixels[luma.argmax()]]).astype(np.float64)
+    for _ in range(4):
+        labels = np.linalg.norm(pixels[:, None, :] - centers[None], axis=2).argmin(axis=1)
+        for k in (0, 1):
+            if (labels == k).any():
+                centers[k] = pixels[labels == k].mean(axis=0)
+
+    label_map = np.full(ink.shape, -1)
+    label_map[ink] = labels
+    boundary = ink & ~_erode(ink)
+    counts = np.array([(labels == k).sum() for k in (0, 1)])
+    edge_share = np.array([
+        (boundary & (label_map == k)).sum() / max(1, counts[k]) for k in (0, 1)
+    ])
+    outer = int(edge_share.argmax())
+    inner = 1 - outer
+    stroke, visible = None, 0.0
+    fill_idx = int(counts.argmax())
+    # Contorno: cluster da borda com cor própria — não a mistura fundo/preenchimento
+    # que o antialiasing deixa em volta de qualquer letra
+    a, b = background, centers[inner]
+    t = np.clip(np.dot(centers[outer] - a, b - a) / max(1e-6, np.dot(b - a, b - a)), 0, 1)
+    off_blend = np.linalg.norm(centers[outer] - (a + t * (b - a)))
+    if (np.linalg.norm(centers[0] - centers[1]) > 80 and off_blend > 40
+            and 0.12 < counts[outer] / ink_count < 0.7):
+        fill_mask = label_map == inner
+        perimeter = max(1, int((fill_mask & ~_erode(fill_mask)).sum()))
+        visible = counts[outer] / perimeter
+        if visible >= 1.0:
+            stroke, fill_idx = _hex(centers[outer]), inner
+        else:
+            visible = 0.0
+    fill_mask = label_map == fill_idx
+    fill_pixels = pixels[labels == fill_idx]
+    fill = _hex(np.median(fill_pixels, axis=0))
+
+    # Altura das maiúsculas pelas linhas "cheias" — acentos, cedilha e o traço do
+    # cifrão não contam
+    row_ink = ink.sum(axis=1)
+    core = np.flatnonzero(row_ink >= 0.35 * np.percentile(row_ink[row_ink > 0], 75))
+    core_top, core_bottom = int(core[0]), int(core[-1]) + 1
+
+    # Confiança: proporção de linha, densidade de tinta, alternâncias do
+    # preenchimento por em (letras separadas) e uniformidade do preenchimento
+    aspect = lw / max(1, core_bottom - core_top)
+    density = ink_count / (lh * lw)
+    middle = fill_mask[core_top + (core_bottom - core_top) // 4: core_top + 3 * (core_bottom - core_top) // 4 + 1]
+    transitions = np.abs(np.diff(middle.astype(np.int8), axis=1)).sum(axis=1).mean()
+    per_em = transitions / max(1.0, aspect)
+    uniformity = 1 - min(1.0, float(fill_pixels.std(axis=0).mean()) / 60)
+    score = float(np.mean([
+        np.clip((aspect - 1) / 1.5, 0, 1),
+        1.0 if 0.2 <= density <= 0.8 else max(0.0, 1 - abs(density - 0.5) * 2),
+        uniformity,
+    ]) * np.clip(per_em / 2.5, 0, 1))
+
+    cap = max(1.0, (core_bottom - core_top - 2 * visible) * scale)
+    return TextLine(
+        box=(int((x0 + tx0) * scale), int((y0 + ty0) * scale),
+             int(round((x0 + tx1) * scale)), int(round((y0 + ty1) * scale))),
+        baseline=(y0 + ty0 + core_bottom - visible) * scale,
+        font_size=cap / _CAP_HEIGHT,
+        fill=fill, stroke=stroke, stroke_width=float(visible * scale * 2),
+        confidence=round(score, 3),
+    )
+
+
+def analyze_image(im: Image.Image) -> LocalResult:
+    started = time.perf_counter()
+    im = im.convert("RGB")
+    if im.size != (CANVAS_W, CANVAS_H):
+        im = im.resize((CANVAS_W, CANVAS_H), Image.Resampling.BILINEAR)
+    scale = CANVAS_W / _WORK_W
+    work = im.reduce(int(scale))
+    rgb = np.asarray(work, dtype=np.float32)
+    edges = _edges(rgb)
+
+    def done(lines: list[TextLine], confidence: float) -> LocalResult:
+        return LocalResult(lines, round(confidence, 3), (time.perf_counter() - started) * 1000)
+
+    # Imagem praticamente lisa: com certeza não há texto
+    if edges.mean() < 0.002:
+        return done([], 1.0)
+
+    h, w = edges.shape
+    gh, gw = h // _CELL, w // _CELL
+    cells_e = edges[:gh * _CELL, :gw * _CELL].reshape(gh, _CELL, gw, _CELL)
+    cells_c = rgb[:gh * _CELL, :gw * _CELL].reshape(gh, _CELL, gw, _CELL, 3)
+    contrast = (cells_c.max(axis=(1, 3)) - cells_c.min(axis=(1, 3))).max(axis=2)
+    dense = (cells_e.mean(axis=(1, 3)) > _CELL_DENSITY) & (contrast > _CELL_RANGE)
+    # Fecha lacunas de uma célula entre letras
+    bridged = dense.copy()
+    bridged[:, 1:-1] |= dense[:, :-2] & dense[:, 2:]
+
+    candidates = []
+    for r0, c0, r1, c1 in _components(bridged):
+        if (c1 - c0) * (r1 - r0) < 3:
+            continue
+        # Uma célula de folga: as bordas das letras das pontas caem em células esparsas
+        bx0, by0 = max(0, (c0 - 1) * _CELL), max(0, (r0 - 1) * _CELL)
+        bx1, by1 = min(w, (c1 + 1) * _CELL), min(h, (r1 + 1) * _CELL)
+        block = edges[by0:by1, bx0:bx1]
+        row_on = block.sum(axis=1) >= max(2, 0.02 * (bx1 - bx0))
+        for ly0, ly1 in _runs(row_on, _MIN_LINE_PX, 1):
+            spans = _runs(block[ly0:ly1].any(axis=0), 1, max(4, (ly1 - ly0) // 2))
+            if spans:
+                candidates.append((bx0 + spans[0][0], by0 + ly0, bx0 + spans[-1][1], by0 + ly1))
+
+    lines: list[TextLine] = []
+    ambiguous = 0
+    for x0, y0, x1, y1 in _merge(candidates):
+        box = (max(0, x0 - 2), max(0, y0 - 2), min(w, x1 + 2), min(h, y1 + 2))
+        line = _measure(rgb, box, scale)
+        if line is None:
+            continue
+        if line.confidence >= _KEEP_SCORE:
+            line.crop = im.crop(line.box)
+            lines.append(line)
+        elif line.confidence >= 0.35:
+            ambiguous += 1
+
+    lines.sort(key=lambda ln: (ln.box[1], ln.box[0]))
+    if not lines:
+        return done([], 0.0)
+    confidence = min(ln.confidence for ln in lines)
+    if ambiguous or len(lines) > 4:
+        confidence = min(confidence, 0.5)
+    return done(lines, confidence)
+
+
+@lru_cache(maxsize=1)
+def ocr_available() -> bool:
+    """pytesseract importável, binário tesseract executável (TESSERACT_CMD) e idioma
+    TEXT_OCR_LANG instalado. Checado uma vez por processo."""
+    if pytesseract is None:
+        return False
+    if os.getenv("TESSERACT_CMD"):
+        pytesseract.pytesseract.tesseract_cmd = os.environ["TESSERACT_CMD"]
+    try:
+        languages = pytesseract.get_languages(config="")
+    except Exception:  # binário ausente
+        return False
+    return all(lang in languages for lang in os.getenv("TEXT_OCR_LANG", "por").split("+"))
+
+
+def analyze(image_bytes: bytes) -> LocalResult:
+    """Detecta as linhas de texto e, com o OCR disponível, lê o texto."""
+    result = analyze_image(Image.open(io.BytesIO(image_bytes)))
+    if result.lines and ocr_available():
+        _ocr(result)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Leitura do texto
+# ---------------------------------------------------------------------------
+
+def _ocr(result: LocalResult) -> None:
+    lang = os.getenv("TEXT_OCR_LANG", "por")
+    for line in result.lines:
+        try:
+            data = pytesseract.image_to_data(
+                line.crop, lang=lang, config="--psm 7", output_type=pytesseract.Output.DICT
+            )
+        except Exception:  # binário do tesseract ausente ou idioma não instalado
+            return
+        words = [(w, float(c)) for w, c in zip(data["text"], data["conf"]) if w.strip() and float(c) >= 0]
+        if not words:
+            continue
+        line.text = " ".join(w for w, _ in words)
+        ocr_conf = sum(c for _, c in words) / len(words) / 100
+        line.confidence = round(min(line.confidence, ocr_conf), 3)
+    result.confidence = min([result.confidence] + [ln.confidence for ln in result.lines])
+
+
+def strip(result: LocalResult, line_height: int = 48) -> bytes:
+    """Recortes das linhas empilhados num JPEG pequeno, para transcrição remota."""
+    crops = []
+    for line in result.lines:
+        crop = line.crop
+        w = max(1, round(crop.width * line_height / max(1, crop.height)))
+        crops.append(crop.resize((min(w, 1024), line_height), Image.Resampling.BILINEAR))
+    gap = 12
+    width = max(c.width for c in crops)
+    sheet = Image.new("RGB", (width, len(crops) * (line_height + gap) - gap), "#808080")
+    for i, crop in enumerate(crops):
+        sheet.paste(crop, (0, i * (line_height + gap)))
+    out = io.BytesIO()
+    sheet.save(out, format="JPEG", quality=80)
+    return out.getvalue()
+
+
+def snap(remote: list[dict], local: LocalResult | None) -> list[dict]:
+    """Mantém o texto do Gemini e troca geometria/cores pelas medidas locais
+    quando uma linha detectada cobre o elemento."""
+    if not local or not local.lines:
+        return remote
+    free = list(local.lines)
+    snapped = []
+    for el in remote:
+        size = float(el.get("fontSize", 80))
+        center = float(el.get("y", 0)) + size * 0.6
+        best = min(free, key=lambda ln: abs((ln.box[1] + ln.box[3]) / 2 - center), default=None)
+        if best is None or abs((best.box[1] + best.box[3]) / 2 - center) > max(size, best.box[3] - best.box[1]):
+            snapped.append(el)
+            continue
+        free.remove(best)
+        measured = best.element(0)
+        snapped.append({**el, **{k: measured[k] for k in
+                                 ("x", "y", "fontSize", "fill", "stroke", "strokeWidth")}})
+    return snapped
@@ -0,0 +1,119 @@
+"""
+Leitura dos uploads com limites de tamanho e verificação do tipo real.
+
+- UPLOAD_MAX_REQUEST_BYTES: teto do corpo inteiro da requisição, aplicado pelo
+  BodyLimitMiddleware enquanto o corpo chega, antes do parser multipart:
+  Content-Length declarado acima do limite é recusado sem ler nada; corpos sem
+  Content-Length são contados a cada bloco. É este o limite de streaming.
+- UPLOAD_MAX_BYTES: teto por arquivo, checado depois do parse — quando `read()`
+  roda, o Starlette já gravou o arquivo no SpooledTemporaryFile (acima de 1 MB
+  vai para disco, não para a memória). `read()` usa o tamanho conhecido para
+  recusar (413) sem copiar nada e, sem ele, para de ler assim que passa do
+  limite; o que ele evita é montar em memória um arquivo grande demais.
+- O tipo vem dos magic bytes do primeiro bloco (não do Content-Type do cliente);
+  formatos que não são JPEG/PNG/WebP/GIF são recusados (415) antes do resto.
+"""
+
+import json
+import os
+
+from fastapi import HTTPException, UploadFile
+
+import metrics
+from storage import sniff_mime
+
+ALLOWED = ("image/jpeg", "image/png", "image/webp", "image/gif")
+CHUNK = 256 * 1024
+
+
+def max_bytes() -> int:
+    return int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+
+
+def max_request_bytes() -> int:
+    return int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(25 * 1024 * 1024)))
+
+
+def _size(limit: int) -> str:
+    if limit < 1024 * 1024:
+        return f"{max(1, round(limit / 1024))} KB"
+    return f"{limit / (1024 * 1024):.1f}".removesuffix(".0") + " MB"
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(413, f"Imagem maior que o limite de {_size(limit)}.")
+
+
+async def read(file: UploadFile, limit: int | None = None) -> tuple[bytes, str]:
+    """Lê o upload (já recebido pelo parser) em blocos → (bytes, mime detectado).
+    413 acima do limite por arquivo, 415 se não for imagem."""
+    limit = max_bytes() if limit is None else limit
+    if file.size is not None and file.size > limit:
+        raise _too_large(limit)
+
+    with metrics.stage("upload_read"):
+        first = await file.read(CHUNK)
+        mime = sniff_mime(first, "")
+        if mime not in ALLOWED:
+            raise HTTPException(415, f"{file.filename or 'arquivo'}: envie uma imagem JPEG, PNG, WebP ou GIF.")
+        chunks, total = [first], len(first)
+        while chunk := await file.read(CHUNK):
+            total += len(chunk)
+            if total > limit:
+                raise _too_large(limit)
+            chunks.append(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks), mime
+
+
+class _BodyTooLarge(HTTPException):
+    """HTTPException para atravessar o parser de formulário do FastAPI como 413."""
+
+    def __init__(self, limit: int):
+        super().__init__(413, f"Requisição maior que o limite de {_size(limit)}.")
+
+
+class BodyLimitMiddleware:
+    """ASGI: 413 para corpos acima de UPLOAD_MAX_REQUEST_BYTES, antes do parse do multipart."""
+
+    def __init__(self, app, limit: int | None = None):
+        self.app = app
+        self.limit = max_request_bytes() if limit is None else limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.limit:
+            return await self._reject(send)
+
+        received = 0
+        started = False
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    raise _BodyTooLarge(self.limit)
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, counted_receive, tracked_send)
+        except _BodyTooLarge:
+            if started:
+                raise
+            await self._reject(send)
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": _BodyTooLarge(self.limit).detail}, ensure_ascii=False).encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1 @@
+"""Benchmark ponta a ponta do gerador (ver bench/run.py)."""
@@ -0,0 +1,162 @@
+"""
+Mock local dos endpoints generativelanguage (`/v1beta/models/{modelo}:{método}`).
+
+Responde no mesmo formato da API real. Pedidos com responseModalities IMAGE
+recebem uma thumbnail JPEG; os demais recebem texto no formato que cada prompt
+do backend espera. Latência, tamanho das respostas e erros vêm do ambiente
+(ver bench/run.py, que sobe este servidor):
+
+    MOCK_LATENCY_IMAGE / MOCK_LATENCY_VISION / MOCK_LATENCY_TEXT
+        distribuição da latência em ms: "fixed:800", "uniform:200:900",
+        "normal:800:150" ou "lognormal:800:0.4" (mediana, sigma)
+    MOCK_IMAGE_BYTES    tamanho aproximado do JPEG gerado (padrão 250000)
+    MOCK_ERROR_RATE     fração das chamadas que falham (0–1)
+    MOCK_ERROR_STATUS   status das falhas (padrão 503)
+    MOCK_SEED           semente das distribuições
+
+GET /_stats devolve contadores de chamadas e bytes recebidos/enviados.
+"""
+
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import re
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image, ImageDraw
+
+app = FastAPI(title="Mock Gemini")
+
+_random = random.Random(os.getenv("MOCK_SEED", "0"))
+_stats = {"calls": Counter(), "errors": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def parse_distribution(spec: str):
+    """'tipo:p1:p2' (ms) → função sem argumentos que sorteia uma latência em segundos."""
+    kind, *params = spec.split(":")
+    v = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda: v[0] / 1000
+    if kind == "uniform":
+        return lambda: _random.uniform(v[0], v[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, _random.gauss(v[0], v[1])) / 1000
+    if kind == "lognormal":
+        return lambda: v[0] * _random.lognormvariate(0, v[1]) / 1000
+    raise ValueError(f"distribuição desconhecida: {spec!r}")
+
+
+_latency = {
+    kind: parse_distribution(os.getenv(f"MOCK_LATENCY_{kind.upper()}", default))
+    for kind, default in (("image", "fixed:0"), ("vision", "fixed:0"), ("text", "fixed:0"))
+}
+
+
+def _thumbnail(target_bytes: int) -> bytes:
+    """JPEG 1280x720 com uma faixa de título; linhas de ruído até chegar perto de target_bytes."""
+    rng = random.Random(0)
+    best = b""
+    for noise_rows in (0, 45, 90, 180, 360, 720):
+        im = Image.linear_gradient("L").resize((1280, 720)).convert("RGB")
+        if noise_rows:
+            noise = Image.frombytes("RGB", (1280, noise_rows), rng.randbytes(1280 * noise_rows * 3))
+            im.paste(noise, (0, 720 - noise_rows))
+        draw = ImageDraw.Draw(im)
+        draw.rectangle((60, 90, 700, 200), fill="#000000")
+        draw.rectangle((70, 100, 690, 190), fill="#FFD700")
+        out = io.BytesIO()
+        im.save(out, format="JPEG", quality=90)
+        best = out.getvalue()
+        if len(best) >= target_bytes:
+            break
+    return best
+
+
+_IMAGE = base64.b64encode(_thumbnail(int(os.getenv("MOCK_IMAGE_BYTES", "250000")))).decode()
+
+_REF_ANALYSIS = {
+    "typography": {
+        "headline_font": "Impact", "headline_weight": "bold", "text_case": "UPPERCASE",
+        "has_stroke": True, "stroke_thickness": "thick", "text_colors": ["#FFD700", "#FFFFFF"],
+        "stroke_colors": ["#000000"], "line_count": 2, "text_shadow": False,
+    },
+    "layout": {
+        "person_position": "right", "person_crop": "torso-up", "person_size": "large",
+        "text_zone": "left", "composition_type": "person-right-text-left",
+    },
+    "colors": {"background_main": "#0D0D1A", "background_type": "solid",
+               "accent_1": "#FFD700", "accent_2": "#FFFFFF"},
+    "atmosphere": "Mock: alto contraste, clima de conquista.",
+}
+
+
+def _text_answer(prompt: str, schema: dict | None) -> str:
+    batch = re.search(r"Escreva (\d+) headlines", prompt)
+    if batch:
+        return "\n".join(f"HEADLINE MOCK {i + 1}" for i in range(int(batch.group(1))))
+    faixas = re.search(r"(\d+) faixas", prompt)
+    if faixas:
+        return json.dumps([f"LINHA {i + 1}" for i in range(int(faixas.group(1)))])
+    count = re.search(r"Crie exatamente (\d+)", prompt)
+    if count:
+        return json.dumps([{"id": f"t{i}", "text": f"TEXTO {i + 1}", "y": 80 + i * 180,
+                            "fontSize": 130 - i * 40, "fontWeight": "bold"}
+                           for i in range(int(count.group(1)))])
+    if schema is not None and schema.get("type") == "ARRAY":
+        return json.dumps([{"id": "text_0", "text": "TEXTO", "x": 70, "y": 100, "fontSize": 110,
+                            "fill": "#FFD700", "stroke": "#000000", "strokeWidth": 8}])
+    return json.dumps(_REF_ANALYSIS, ensure_ascii=False)
+
+
+def _respond(body: dict, status: int = 200) -> JSONResponse:
+    response = JSONResponse(body, status_code=status)
+    _stats["bytes_out"] += len(response.body)
+    return response
+
+
+@app.post("/v1beta/models/{target}")
+async def generate(target: str, request: Request):
+    raw = await request.body()
+    _stats["bytes_in"] += len(raw)
+    payload = json.loads(raw)
+    model, _, method = target.partition(":")
+    parts = payload.get("contents", [{}])[0].get("parts", [])
+    is_image = "IMAGE" in payload.get("generationConfig", {}).get("responseModalities", [])
+    kind = "image" if is_image else "vision" if any("inline_data" in p for p in parts) else "text"
+    _stats["calls"][f"{model}:{kind}"] += 1
+
+    await asyncio.sleep(_latency[kind]())
+    if _random.random() < float(os.getenv("MOCK_ERROR_RATE", "0")):
+        _stats["errors"] += 1
+        return _respond({"error": {"message": "mock: falha injetada"}},
+                        int(os.getenv("MOCK_ERROR_STATUS", "503")))
+
+    if is_image:
+        part = {"inlineData": {"mimeType": "image/jpeg", "data": _IMAGE}}
+    else:
+        prompt = next((p["text"] for p in parts if "text" in p), "")
+        part = {"text": _text_answer(prompt, payload.get("generationConfig", {}).get("responseSchema"))}
+    if method == "streamGenerateContent" and "text" in part:
+        return _stream(part["text"])
+    return _respond({"candidates": [{"content": {"parts": [part]}, "finishReason": "STOP"}]})
+
+
+def _stream(text: str) -> StreamingResponse:
+    """alt=sse: um evento por linha do texto."""
+    lines = text.splitlines(keepends=True)
+    events = [
+        "data: " + json.dumps({"candidates": [{"content": {"parts": [{"text": line}]}}]}) + "\r\n\r\n"
+        for line in lines
+    ]
+    _stats["bytes_out"] += sum(len(e) for e in events)
+    return StreamingResponse(iter(events), media_type="text/event-stream")
+
+
+@app.get("/_stats")
+def stats():
+    return {**_stats, "calls": dict(_stats["calls"])}
@@ -0,0 +1,362 @@
+"""
+Benchmark ponta a ponta do pipeline de geração.
+
+Sobe o mock do Gemini (bench/mock_gemini.py) e o app FastAPI escolhido
+(backend/main.py, api/index.py ou ambos) como processos uvicorn separados, com
+GEMINI_BASE_URL apontando para o mock. Em seguida dispara /api/generate,
+/api/upload e /api/categories na concorrência pedida e relata, por endpoint:
+latência p50/p95/p99, vazão, erros, pico de RSS do servidor e bytes trafegados
+(cliente ↔ app e app ↔ mock).
+
+Cada execução é gravada em JSON (.tmp/bench/ por padrão) com o commit atual,
+para comparar regressões entre commits com --compare.
+
+Exemplo de uso:
+    python -m bench.run --app both --requests 200 --concurrency 16 \\
+        --latency-image lognormal:8000:0.3 --latency-vision normal:1500:300
+    python -m bench.run --app backend --compare .tmp/bench/20261017-101500_abc1234.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+from PIL import Image, ImageDraw
+
+ROOT = Path(__file__).resolve().parent.parent
+
+APPS = {
+    "backend": ("main:app", ROOT / "backend"),
+    "api": ("index:app", ROOT / "api"),
+}
+
+ENDPOINTS = ("generate", "upload", "categories")
+
+
+# ---------------------------------------------------------------------------
+# Processos
+# ---------------------------------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _spawn(target: str, app_dir: Path, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--app-dir", str(app_dir),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, **env},
+    )
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"processo saiu com código {proc.returncode} antes de responder em {url}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} não respondeu em {timeout:.0f}s")
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def _peak_rss_mb(pid: int) -> float | None:
+    """Pico de RSS (VmHWM) do processo — Linux; psutil (só RSS atual) como alternativa."""
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        return round(psutil.Process(pid).memory_info().rss / 2 ** 20, 1)
+    except psutil.Error:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Carga
+# ---------------------------------------------------------------------------
+
+def _jpeg(size: tuple[int, int], color: str, mark: int = 0) -> bytes:
+    im = Image.new("RGB", size, color)
+    draw = ImageDraw.Draw(im)
+    draw.ellipse((size[0] // 4, size[1] // 8, 3 * size[0] // 4, size[1]), fill="#D09070")
+    # Marca por requisição: referências distintas não acertam o cache de análise
+    draw.rectangle((0, 0, 8, 8), fill=(mark % 256, (mark // 256) % 256, 0))
+    out = io.BytesIO()
+    im.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _plan(requests: int, mix: dict[str, float], seed: int) -> list[str]:
+    total = sum(mix.values())
+    ops = [name for name, weight in mix.items() for _ in range(round(requests * weight / total))]
+    random.Random(seed).shuffle(ops)
+    return ops
+
+
+def _parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"endpoint desconhecido no --mix: {name!r}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def _drive(base_url: str, ops: list[str], concurrency: int, args) -> tuple[list[dict], float]:
+    person = _jpeg((800, 1000), "#203040")
+    refs = [_jpeg((1280, 720), "#101020", 0 if args.cached_refs else i) for i in range(len(ops))]
+    results: list[dict] = []
+    queue: asyncio.Queue = asyncio.Queue()
+    for i, op in enumerate(ops):
+        queue.put_nowait((i, op))
+
+    def build(client: httpx.AsyncClient, i: int, op: str) -> httpx.Request:
+        if op == "categories":
+            return client.build_request("GET", "/api/categories")
+        if op == "upload":
+            return client.build_request("POST", "/api/upload",
+                                        files={"file": ("p.jpg", person, "image/jpeg")})
+        return client.build_request(
+            "POST", "/api/generate",
+            data={"objective": "dinheiro", "prompt": "ganhei dez mil em sete dias"},
+            files={"person_image": ("p.jpg", person, "image/jpeg"),
+                   "reference_image": ("r.jpg", refs[i], "image/jpeg")},
+        )
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while not queue.empty():
+            i, op = queue.get_nowait()
+            request = build(client, i, op)
+            sent = len(request.read())
+            started = time.perf_counter()
+            try:
+                response = await client.send(request)
+                await response.aread()
+                status, received = response.status_code, response.num_bytes_downloaded
+            except httpx.HTTPError:
+                status, received = 0, 0
+            results.append({
+                "endpoint": op, "status": status,
+                "ms": (time.perf_counter() - started) * 1000,
+                "sent": sent, "received": received,
+            })
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return results, wall
+
+
+# ---------------------------------------------------------------------------
+# Relatório
+# ---------------------------------------------------------------------------
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank: o menor valor com pelo menos q% das amostras abaixo ou iguais."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(rows: list[dict], wall: float) -> dict:
+    ms = [r["ms"] for r in rows]
+    return {
+        "count": len(rows),
+        "errors": sum(1 for r in rows if not 200 <= r["status"] < 400),
+        "p50_ms": round(percentile(ms, 50), 1),
+        "p95_ms": round(percentile(ms, 95), 1),
+        "p99_ms": round(percentile(ms, 99), 1),
+        "mean_ms": round(sum(ms) / len(ms), 1) if ms else 0.0,
+        "max_ms": round(max(ms), 1) if ms else 0.0,
+        "throughput_rps": round(len(rows) / wall, 2) if wall else 0.0,
+        "bytes_sent": sum(r["sent"] for r in rows),
+        "bytes_received": sum(r["received"] for r in rows),
+    }
+
+
+def _mock_env(args) -> dict:
+    return {
+        "MOCK_LATENCY_IMAGE": args.latency_image,
+        "MOCK_LATENCY_VISION": args.latency_vision,
+        "MOCK_LATENCY_TEXT": args.latency_text,
+        "MOCK_IMAGE_BYTES": str(args.image_bytes),
+        "MOCK_ERROR_RATE": str(args.error_rate),
+        "MOCK_ERROR_STATUS": str(args.error_status),
+        "MOCK_SEED": str(args.seed),
+    }
+
+
+def run_app(name: str, args) -> dict:
+    target, app_dir = APPS[name]
+    mock_port, app_port = _free_port(), _free_port()
+    mock = _spawn("mock_gemini:app", ROOT / "bench", mock_port, _mock_env(args))
+    with tempfile.TemporaryDirectory(prefix="bench-images-") as images_dir:
+        app = _spawn(target, app_dir, app_port, {
+            "GEMINI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1beta/models",
+            "GOOGLE_API_KEY": "bench",
+            "GENERATION_ENGINE": "gemini",
+            "GEMINI_HTTP2": "0",
+            # Sem limitação de taxa nem circuito: mede o app, não a política de retry
+            "GEMINI_RATE_PER_SEC": "1000000",
+            "GEMINI_RATE_BURST": "1000000",
+            "GEMINI_BREAKER_THRESHOLD": "1000000",
+            "REF_CACHE_DB": "",
+            "IMAGE_STORAGE_DIR": images_dir,
+        })
+        try:
+            _wait_ready(f"http://127.0.0.1:{mock_port}/_stats", mock)
+            _wait_ready(f"http://127.0.0.1:{app_port}/api/health", app)
+            base_url = f"http://127.0.0.1:{app_port}"
+            if args.warmup:
+                asyncio.run(_drive(base_url, _plan(args.warmup, args.mix, args.seed + 1),
+                                   min(args.concurrency, args.warmup), args))
+            upstream_before = httpx.get(f"http://127.0.0.1:{mock_port}/_stats").json()
+            rows, wall = asyncio.run(_drive(base_url, _plan(args.requests, args.mix, args.seed),
+                                            args.concurrency, args))
+            upstream = httpx.get(f"http://127.0.0.1:{mock_port}/_stats").json()
+            peak_rss = _peak_rss_mb(app.pid)
+        finally:
+            _stop(app)
+            _stop(mock)
+
+    by_endpoint = defaultdict(list)
+    for row in rows:
+        by_endpoint[row["endpoint"]].append(row)
+    return {
+        "wall_s": round(wall, 3),
+        "overall": summarize(rows, wall),
+        "endpoints": {ep: summarize(r, wall) for ep, r in sorted(by_endpoint.items())},
+        "peak_rss_mb": peak_rss,
+        "upstream": {
+            "calls": sum(upstream["calls"].values()) - sum(upstream_before["calls"].values()),
+            "errors": upstream["errors"] - upstream_before["errors"],
+            "bytes_in": upstream["bytes_in"] - upstream_before["bytes_in"],
+            "bytes_out": upstream["bytes_out"] - upstream_before["bytes_out"],
+        },
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _print_report(report: dict) -> None:
+    header = f"{'app':8} {'endpoint':11} {'n':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>7}"
+    print(header)
+    print("-" * len(header))
+    for app, result in report["apps"].items():
+        for ep, s in [*result["endpoints"].items(), ("(total)", result["overall"])]:
+            print(f"{app:8} {ep:11} {s['count']:>5} {s['errors']:>4} {s['p50_ms']:>8.1f} "
+                  f"{s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['throughput_rps']:>7.2f}")
+        up = result["upstream"]
+        print(f"{app:8} pico RSS {result['peak_rss_mb']} MB · cliente {result['overall']['bytes_sent']:,} B ↑ "
+              f"{result['overall']['bytes_received']:,} B ↓ · mock {up['calls']} chamadas, "
+              f"{up['bytes_in']:,} B ↑ {up['bytes_out']:,} B ↓")
+
+
+def _print_comparison(report: dict, baseline: dict) -> None:
+    print(f"\ncomparação com {baseline['meta']['commit']} ({baseline['meta']['date']}):")
+    for app, result in report["apps"].items():
+        old_app = baseline["apps"].get(app)
+        if not old_app:
+            continue
+        for ep, s in [*result["endpoints"].items(), ("(total)", result["overall"])]:
+            old = old_app["overall"] if ep == "(total)" else old_app["endpoints"].get(ep)
+            if not old:
+                continue
+            deltas = []
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+                if old[key]:
+                    deltas.append(f"{key} {100 * (s[key] - old[key]) / old[key]:+.1f}%")
+            print(f"  {app:8} {ep:11} " + "  ".join(deltas))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta contra um mock do Gemini.")
+    parser.add_argument("--app", choices=[*APPS, "both"], default="both")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5, help="requisições descartadas antes da medição")
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("generate=1,upload=1,categories=2"),
+                        help="pesos por endpoint, ex.: generate=1,upload=2,categories=4")
+    parser.add_argument("--latency-image", default="lognormal:6000:0.3",
+                        help="distribuição em ms: fixed:N, uniform:A:B, normal:M:SD, lognormal:MEDIANA:SIGMA")
+    parser.add_argument("--latency-vision", default="normal:1200:250")
+    parser.add_argument("--latency-text", default="normal:800:150")
+    parser.add_argument("--image-bytes", type=int, default=250_000, help="tamanho aproximado da imagem gerada")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--cached-refs", action="store_true",
+                        help="mesma referência em todas as requisições (mede o cache de análise)")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=ROOT / ".tmp" / "bench")
+    parser.add_argument("--compare", type=Path, help="JSON de uma execução anterior")
+    args = parser.parse_args(argv)
+
+    apps = list(APPS) if args.app == "both" else [args.app]
+    report = {
+        "meta": {
+            "commit": _commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        },
+        "apps": {app: run_app(app, args) for app in apps},
+    }
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    path = args.out / f"{time.strftime('%Y%m%d-%H%M%S')}_{report['meta']['commit']}.json"
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    _print_report(report)
+    if args.compare:
+        _print_comparison(report, json.loads(args.compare.read_text(encoding="utf-8")))
+    print(f"\nresultado gravado em {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Renderização em lote a partir de um manifesto CSV ou JSONL.
+
+Cada linha descreve uma thumbnail:
+    template    ID em backend/data/templates.json (opcional)
+    texts       textos que substituem os do template — lista (JSONL) ou "A|B|C" (CSV)
+    title       texto único, usado quando não há template nem elements
+    elements    lista de elementos Fabric.js (só JSONL)
+    background  caminho da imagem de fundo ou cor '#RRGGBB' (opcional)
+    name        prefixo do arquivo de saída (opcional)
+
+As linhas são renderizadas num ProcessPoolExecutor; cada worker aquece o cache
+de templates e fontes uma vez. O nome do arquivo leva o hash das entradas: se
+ele já existe, a linha é pulada. Escritas são atômicas (arquivo temporário +
+rename), então uma execução interrompida nunca deixa imagens pela metade.
+
+Exemplo de uso:
+    python execution/batch_generate_thumbnails.py manifesto.csv --out-dir .tmp/output/lote --workers 8
+"""
+
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import render_thumbnail  # noqa: E402
+
+# Mude quando o resultado visual do renderizador mudar: invalida os hashes antigos
+RENDERER_VERSION = "1"
+
+DEFAULT_TITLE_ELEMENT = {
+    "x": 60, "y": 80, "fontSize": 120, "fontFamily": "Impact",
+    "fill": "#FFFFFF", "stroke": "#000000", "strokeWidth": 8, "fontWeight": "bold",
+}
+
+
+# ---------------------------------------------------------------------------
+# Manifesto
+# ---------------------------------------------------------------------------
+
+def read_manifest(path: Path) -> list[dict]:
+    """Lê CSV (cabeçalho obrigatório) ou JSONL (um objeto por linha)."""
+    rows: list[dict] = []
+    if path.suffix.lower() in (".jsonl", ".ndjson"):
+        with open(path, "r", encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        rows.append(json.loads(line))
+                    except json.JSONDecodeError as exc:
+                        raise ValueError(f"{path}:{n}: JSON inválido ({exc})") from exc
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                row = {k: v for k, v in row.items() if v not in (None, "")}
+                if "texts" in row:
+                    row["texts"] = row["texts"].split("|")
+                rows.append(row)
+    return rows
+
+
+def _background_fingerprint(background: Optional[str]) -> str:
+    """Fundo por caminho entra no hash via (tamanho, mtime) — sem ler o arquivo."""
+    if not background or background.startswith(("#", "rgb")):
+        return background or ""
+    stat = os.stat(background)
+    return f"{background}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def row_key(row: dict, fmt: str, quality: int) -> str:
+    spec = {
+        "template": row.get("template"),
+        "texts": row.get("texts"),
+        "title": row.get("title"),
+        "elements": row.get("elements"),
+        "background": _background_fingerprint(row.get("background")),
+        "format": fmt,
+        "quality": quality,
+        "renderer": RENDERER_VERSION,
+    }
+    raw = json.dumps(spec, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def output_path(out_dir: Path, row: dict, index: int, key: str, fmt: str) -> Path:
+    name = str(row.get("name") or row.get("title") or row.get("template") or f"thumb_{index}")
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", name)[:50].strip("_") or "thumb"
+    return out_dir / f"{slug}-{key}.{fmt.lower()}"
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+def _warm_worker() -> None:
+    """Inicializador do processo: templates, índice de fontes e fontes dos templates."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    templates = render_thumbnail.load_templates()
+    for tpl in templates.values():
+        for el in tpl.get("textElements", []):
+            render_thumbnail.get_font(el["fontFamily"], int(el["fontSize"]))
+
+
+def render_row(row: dict, dest: str, fmt: str, quality: int) -> float:
+    """Renderiza uma linha e grava de forma atômica. Retorna o tempo gasto (s)."""
+    started = time.perf_counter()
+    background = row.get("background")
+    if row.get("template"):
+        template = render_thumbnail.load_templates().get(row["template"])
+        if template is None:
+            raise ValueError(f"template desconhecido: {row['template']}")
+        img = render_thumbnail.render_template(template, background=background, texts=row.get("texts"))
+    else:
+        elements = row.get("elements")
+        if elements is None:
+            elements = [{**DEFAULT_TITLE_ELEMENT, "text": row.get("title", "")}]
+        img = render_thumbnail.render(background, elements)
+
+    data = render_thumbnail.encode_image(img, fmt, quality)
+    dest_path = Path(dest)
+    tmp = dest_path.with_name(f".{dest_path.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, dest_path)
+    except BaseException:
+        # Disco cheio, permissão, Ctrl+C: não deixa .tmp órfão ao lado das saídas
+        tmp.unlink(missing_ok=True)
+        raise
+    return time.perf_counter() - started
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main() -> None:
+    import argparse
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Renderiza thumbnails em lote a partir de CSV/JSONL.")
+    parser.add_argument("manifest", help="Arquivo .csv ou .jsonl.")
+    parser.add_argument("--out-dir", default=os.getenv("THUMB_OUTPUT_DIR", ".tmp/output"),
+                        help="Diretório de saída.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos de renderização.")
+    parser.add_argument("--format", default="png", choices=["png", "jpg", "webp"], help="Formato de saída.")
+    parser.add_argument("--quality", type=int, default=90, help="Qualidade JPEG/WebP.")
+    parser.add_argument("--force", action="store_true", help="Renderiza mesmo se a saída já existir.")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rows = read_manifest(Path(args.manifest))
+
+    started = time.perf_counter()
+    skipped = failed = rendered = 0
+    pending: list[tuple[int, dict, Path]] = []
+    for i, row in enumerate(rows):
+        try:
+            key = row_key(row, args.format, args.quality)
+        except OSError as exc:
+            failed += 1
+            print(f"[linha {i + 1}] fundo inacessível: {exc}", file=sys.stderr)
+            continue
+        dest = output_path(out_dir, row, i, key, args.format)
+        if dest.exists() and not args.force:
+            skipped += 1
+        else:
+            pending.append((i, row, dest))
+
+    render_seconds = 0.0
+    if pending:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_warm_worker) as pool:
+            futures = {
+                pool.submit(render_row, row, str(dest), args.format, args.quality): (i, dest)
+                for i, row, dest in pending
+            }
+            for future in as_completed(futures):
+                i, dest = futures[future]
+                try:
+                    render_seconds += future.result()
+                    rendered += 1
+                except Exception as exc:
+                    failed += 1
+                    print(f"[linha {i + 1}] falhou: {exc}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    throughput = rendered / elapsed if elapsed > 0 else 0.0
+    print(
+        f"{len(rows)} linhas: {rendered} renderizadas, {skipped} já existentes, {failed} falhas "
+        f"em {elapsed:.2f}s ({throughput:.1f} thumbs/s, {args.workers} workers, "
+        f"{(render_seconds / rendered * 1000) if rendered else 0:.1f} ms/thumb por worker)"
+    )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
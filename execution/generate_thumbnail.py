@@ -1,9 +1,14 @@
 import os
+import sys
 from pathlib import Path
 from typing import Optional
 
 from dotenv import load_dotenv
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import fonts  # noqa: E402
 
 
 def load_settings() -> dict:
@@ -20,6 +25,7 @@ def load_settings() -> dict:
     background_color = os.getenv("THUMB_BG_COLOR", "#000000")
     text_color = os.getenv("THUMB_TEXT_COLOR", "#FFFFFF")
     default_font_path = os.getenv("THUMB_FONT_PATH", "")
+    font_family = os.getenv("THUMB_FONT_FAMILY", "Impact")
 
     return {
         "output_dir": output_dir,
@@ -28,6 +34,7 @@ def load_settings() -> dict:
         "background_color": background_color,
         "text_color": text_color,
         "default_font_path": default_font_path,
+        "font_family": font_family,
     }
 
 
@@ -61,25 +68,21 @@ def create_basic_thumbnail(
     image = Image.new("RGB", (width, height), color=background_color)
     draw = ImageDraw.Draw(image)
 
-    # Fonte: tenta usar caminho configurado; se falhar, usa fonte padrão
-    font: ImageFont.FreeTypeFont | ImageFont.ImageFont
-    font_path = settings.get("default_font_path") or ""
-    try:
-        if font_path:
-            font = ImageFont.truetype(font_path, size=int(height * 0.08))
-        else:
-            raise OSError("Fonte não configurada.")
-    except OSError:
-        font = ImageFont.load_default()
-
-    # Calcula posição do texto (centralizado aproximadamente)
-    text_bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = text_bbox[2] - text_bbox[0]
-    text_height = text_bbox[3] - text_bbox[1]
-    x = (width - text_width) / 2
-    y = (height - text_height) / 2
-
-    draw.text((x, y), text, font=font, fill=text_color)
+    # Fonte: caminho configurado ou família do registro; o solver escolhe o
+    # maior tamanho (e as quebras de linha) em que o texto cabe na caixa central
+    family = settings.get("default_font_path") or settings.get("font_family") or "Impact"
+    fit = fonts.fit_text(
+        text, box_width=width * 0.9, box_height=height * 0.6,
+        family=family, weight="bold", max_lines=3, max_size=int(height * 0.2),
+    )
+    font = fonts.registry().font(fit.face, fit.font_size)
+
+    # Linhas centralizadas; baseline no mesmo layout do Fabric.js
+    em = fit.font_size * fonts.FABRIC_FONT_SIZE_MULT
+    top = (height - fit.height) / 2
+    for i, line in enumerate(fit.lines):
+        baseline = top + i * em * fonts.FABRIC_LINE_HEIGHT + em * (1 - fonts.FABRIC_FONT_SIZE_FRACTION)
+        draw.text((width / 2, baseline), line, font=font, fill=text_color, anchor="ms")
 
     # Nome de arquivo determinístico simples
     safe_title = (title or text)[:50].replace(" ", "_")
@@ -0,0 +1,222 @@
+"""
+Renderizador headless de thumbnails com Pillow.
+
+Recebe uma imagem de fundo + a mesma lista de elementos que o editor Fabric.js
+consome (vinda de `_generate_text_elements` ou de `templates.json`) e produz a
+imagem final em PNG/JPEG/WebP, sem navegador.
+
+Esquema de cada elemento de texto:
+    {"text", "x", "y", "fontSize", "fontFamily", "fill", "stroke", "strokeWidth", "fontWeight"}
+
+Exemplo de uso:
+    python execution/render_thumbnail.py spec.json -o .tmp/output/thumb.png
+    python execution/render_thumbnail.py --template dinheiro_01 -o .tmp/output/t.jpg
+"""
+
+import json
+import sys
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import Optional, Union
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+TEMPLATES_PATH = PROJECT_ROOT / "backend" / "data" / "templates.json"
+
+sys.path.insert(0, str(PROJECT_ROOT / "backend"))
+
+import fonts  # noqa: E402
+from fonts import FABRIC_FONT_SIZE_FRACTION, FABRIC_FONT_SIZE_MULT, FABRIC_LINE_HEIGHT  # noqa: E402,F401
+
+CANVAS_SIZE = (1280, 720)
+
+BackgroundSource = Union[None, str, bytes, Path, Image.Image]
+
+
+# ---------------------------------------------------------------------------
+# Fontes
+# ---------------------------------------------------------------------------
+
+def get_font(family: str, size: int, weight: str | int = "normal") -> ImageFont.FreeTypeFont:
+    """Fonte do registro (backend/fonts.py), em cache por (arquivo, tamanho)."""
+    reg = fonts.registry()
+    return reg.font(reg.resolve(family, weight), size)
+
+
+# ---------------------------------------------------------------------------
+# Camadas
+# ---------------------------------------------------------------------------
+
+def load_background(background: BackgroundSource, size: tuple[int, int] = CANVAS_SIZE,
+                    color: str = "#000000") -> Image.Image:
+    """Fundo esticado para o canvas (como o editor faz com scaleX/scaleY).
+
+    Aceita caminho, bytes, Image, cor ('#RRGGBB') ou None (cor sólida).
+    """
+    if background is None:
+        return Image.new("RGBA", size, color)
+    if isinstance(background, str) and background.startswith(("#", "rgb")):
+        return Image.new("RGBA", size, background)
+    if isinstance(background, Image.Image):
+        img = background
+    elif isinstance(background, bytes):
+        img = Image.open(BytesIO(background))
+    else:
+        img = Image.open(background)
+    img = img.convert("RGBA")
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    return img
+
+
+def draw_shapes(img: Image.Image, shapes: list[dict]) -> None:
+    """Formas de templates.json (hoje só 'rect'), desenhadas com alpha."""
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for shape in shapes:
+        if shape.get("type") != "rect":
+            continue
+        x, y = shape.get("x", 0), shape.get("y", 0)
+        w, h = shape.get("width", 0), shape.get("height", 0)
+        draw.rectangle([x, y, x + w - 1, y + h - 1], fill=ImageColor.getrgb(shape.get("fill", "#000000")))
+    img.alpha_composite(overlay)
+
+
+def draw_text_element(draw: ImageDraw.ImageDraw, el: dict) -> None:
+    """Desenha um elemento de texto com o mesmo layout vertical do Fabric.js.
+
+    No Fabric (paintFirst: 'stroke') o contorno é centrado no traço do glifo e o
+    preenchimento cobre a metade interna — só strokeWidth/2 fica visível. O
+    stroke do Pillow é todo externo, então usamos metade da largura.
+    """
+    text = str(el.get("text", ""))
+    if not text:
+        return
+    font_size = max(1, int(round(float(el.get("fontSize", 80)))))
+    font = get_font(str(el.get("fontFamily", "Impact")), font_size, el.get("fontWeight", "normal"))
+
+    fill = el.get("fill") or "#FFFFFF"
+    stroke = el.get("stroke")
+    stroke_w = int(round(float(el.get("strokeWidth", 0) or 0) / 2)) if stroke else 0
+
+    x = float(el.get("x", 60))
+    top = float(el.get("y", 100))
+    line_height = font_size * FABRIC_FONT_SIZE_MULT * FABRIC_LINE_HEIGHT
+    first_baseline = font_size * FABRIC_FONT_SIZE_MULT * (1 - FABRIC_FONT_SIZE_FRACTION)
+
+    for i, line in enumerate(text.split("\n")):
+        baseline = top + i * line_height + first_baseline
+        draw.text(
+            (x, baseline), line, font=font, fill=fill, anchor="ls",
+            stroke_width=stroke_w, stroke_fill=stroke if stroke_w else None,
+        )
+
+
+def render(
+    background: BackgroundSource,
+    elements: list[dict],
+    shapes: Optional[list[dict]] = None,
+    size: tuple[int, int] = CANVAS_SIZE,
+    background_color: str = "#000000",
+) -> Image.Image:
+    """Compõe fundo → formas → textos e retorna a imagem RGBA final."""
+    img = load_background(background, size, background_color)
+    if shapes:
+        draw_shapes(img, shapes)
+    draw = ImageDraw.Draw(img)
+    for el in elements:
+        draw_text_element(draw, el)
+    return img
+
+
+# ---------------------------------------------------------------------------
+# Templates e saída
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def load_templates(path: str = str(TEMPLATES_PATH)) -> dict[str, dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return {tpl["id"]: tpl for tpl in json.load(f)["templates"]}
+
+
+def render_template(template: dict, background: BackgroundSource = None,
+                    texts: Optional[list[str]] = None) -> Image.Image:
+    """Renderiza um template; `texts` substitui os textos na ordem dos elementos."""
+    elements = [dict(el) for el in template.get("textElements", [])]
+    for el, text in zip(elements, texts or []):
+        el["text"] = text
+    return render(
+        background, elements,
+        shapes=template.get("shapes"),
+        background_color=template.get("background", "#000000"),
+    )
+
+
+def encode_image(img: Image.Image, fmt: str = "PNG", quality: int = 90) -> bytes:
+    """Serializa em PNG, JPEG ou WEBP (JPEG perde o canal alpha)."""
+    fmt = fmt.upper().replace("JPG", "JPEG")
+    out = BytesIO()
+    if fmt == "JPEG":
+        img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+    elif fmt == "WEBP":
+        img.save(out, format="WEBP", quality=quality)
+    else:
+        img.save(out, format="PNG", optimize=False)
+    return out.getvalue()
+
+
+def save_image(img: Image.Image, path: Union[str, Path], quality: int = 90) -> Path:
+    """Salva inferindo o formato pela extensão (.png/.jpg/.jpeg/.webp)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fmt = path.suffix.lstrip(".") or "png"
+    path.write_bytes(encode_image(img, fmt, quality))
+    return path
+
+
+def main() -> None:
+    """
+    Entry point via CLI.
+
+    O spec JSON tem o formato:
+        {"background": "fundo.jpg" ou "#101010", "elements": [...], "shapes": [...]}
+    """
+    import argparse
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Renderiza uma thumbnail a partir de elementos Fabric.js.")
+    parser.add_argument("spec", nargs="?", help="Arquivo JSON com background/elements/shapes.")
+    parser.add_argument("--template", help="ID de template em backend/data/templates.json.")
+    parser.add_argument("--background", help="Imagem de fundo (sobrescreve a do spec/template).")
+    parser.add_argument("-o", "--output", default=".tmp/output/render.png", help="Arquivo de saída.")
+    parser.add_argument("--quality", type=int, default=90, help="Qualidade JPEG/WebP.")
+    args = parser.parse_args()
+
+    if args.template:
+        template = load_templates().get(args.template)
+        if template is None:
+            parser.error(f"template desconhecido: {args.template}")
+        img = render_template(template, background=args.background)
+    elif args.spec:
+        with open(args.spec, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        img = render(
+            args.background or spec.get("background"),
+            spec.get("elements", []),
+            shapes=spec.get("shapes"),
+            background_color=spec.get("background_color", "#000000"),
+        )
+    else:
+        parser.error("informe um spec JSON ou --template")
+
+    output_path = save_image(img, args.output, quality=args.quality)
+    print(f"Thumbnail renderizada em: {output_path}")
+
+
+if __name__ == "__main__":
+    main()